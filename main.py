@@ -1,10 +1,31 @@
 import os
 import dotenv
-from src.processing import segment_images_batch
+from src.processing import segment_images_batch, segment_image_stream, mask_filename_for
 from src.evaluation import save_visual_expected_result, evaluate_single_image, eval_dataset
 from src.analyzer import analyse_evaluation_image, analyze_dataset_eval
 from src.report import fill_template_and_save
+from src.colors import analyze_dataset_colors
+from src.shm_pipeline import eval_dataset_parallel
+from src.stability import select_stratified_sample
+from src.model_comparison import segment_images_multi_model, compare_models
+from src.loadtest import run_load_test, write_load_test_report
+from src.api import get_model_url
+from src.presence_index import update_presence_index, update_indexes_from_eval
+from src.evaluation import MASK_TRUE_DIR, MASK_PRED_DIR
+from src.pipeline import build_pipeline, run_pipeline
+from src.manifest import open_manifest, mark_stage
+from src.sharding import select_shard, write_shard_results, merge_shard_results
+from src.memory_profile import MemoryProfiler
+from src.video import segment_videos
+from src.similarity import update_similarity_index, print_similar_outfits
+from src.approx import calibrate_approximation, approximation_summary
+from src.query_service import start_query_service
+from src.config import (CLASS_MAPPING, MASK_STORAGE_FORMAT, SHM_DECODE_WORKERS, DEDUP_MAX_DISTANCE, DEFAULT_MODEL,
+                        LOAD_TEST_CONCURRENCY_LEVELS, LOAD_TEST_REQUESTS_PER_LEVEL, MEMORY_PROFILE_REPORT,
+                        VIDEO_DIR, VIDEO_SAMPLE_FPS, VIDEO_STATIC_THRESHOLD, SIMILARITY_TOP_K, SIMILARITY_IVF_NPROBE,
+                        APPROX_METHOD, APPROX_CALIBRATION_FACTORS, SERVE_PORT)
 import argparse
+import json
 
 dotenv.load_dotenv()
 
@@ -25,12 +46,173 @@ def main(sample_run=False):
     parser.add_argument('-e', '--evaluation', default=False,
                         help="Mode pour faire l'évaluation du modele de segmentation (défaut: False)",
                         action='store_true')
+    parser.add_argument('-c', '--colors', default=False,
+                        help="Mode pour extraire les couleurs dominantes par classe de vêtement (défaut: False)",
+                        action='store_true')
+    parser.add_argument('--mask-format', default=MASK_STORAGE_FORMAT, choices=['png', 'rle', 'both'],
+                        help=f"Format de stockage des masques prédits ; l'évaluation utilise les RLE si disponibles (défaut: {MASK_STORAGE_FORMAT})")
+    parser.add_argument('--tiled', default=False,
+                        help="Traitement par bandes à mémoire bornée pour les très grandes images (défaut: False)",
+                        action='store_true')
+    parser.add_argument('--compute-workers', type=int, default=0,
+                        help="Nombre de processus de calcul pour l'évaluation et le rendu des visuels attendus en parallèle, en mémoire partagée (défaut: 0, séquentiel)")
+    parser.add_argument('--decode-workers', type=int, default=SHM_DECODE_WORKERS,
+                        help=f"Nombre de processus de décodage des masques en mode parallèle (défaut: {SHM_DECODE_WORKERS})")
+    parser.add_argument('--dedup', default=False,
+                        help="Réutilise le masque des quasi-doublons (hash perceptuel) au lieu d'appeler l'API (défaut: False)",
+                        action='store_true')
+    parser.add_argument('--dedup-distance', type=int, default=DEDUP_MAX_DISTANCE,
+                        help=f"Distance de Hamming maximale entre quasi-doublons (défaut: {DEDUP_MAX_DISTANCE})")
+    parser.add_argument('--sample-ci-width', type=float, default=None,
+                        help="En mode sample, plus petit échantillon stratifié dont l'IC du Mean IoU (rapport précédent) a cette largeur, ex. 0.05")
+    parser.add_argument('--models', nargs='+', default=None,
+                        help="Comparaison A/B : identifiants des modèles Hugging Face à évaluer, le premier sert de référence")
+    parser.add_argument('--load-test', default=False,
+                        help="Test de charge : latences p50/p95/p99, débit et erreurs par niveau de concurrence (défaut: False)",
+                        action='store_true')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=LOAD_TEST_CONCURRENCY_LEVELS,
+                        help=f"Niveaux de concurrence du test de charge (défaut: {LOAD_TEST_CONCURRENCY_LEVELS})")
+    parser.add_argument('--load-requests', type=int, default=LOAD_TEST_REQUESTS_PER_LEVEL,
+                        help=f"Requêtes par niveau de concurrence (défaut: {LOAD_TEST_REQUESTS_PER_LEVEL})")
+    parser.add_argument('--endpoint', default=None,
+                        help="URL complète de l'endpoint testé, ex. un serveur local (défaut: URL du modèle Hugging Face)")
+    parser.add_argument('--query-with', nargs='+', default=None, choices=list(CLASS_MAPPING), metavar='CLASSE',
+                        help="Requête sur l'index de présence : images contenant toutes ces classes")
+    parser.add_argument('--query-without', nargs='+', default=None, choices=list(CLASS_MAPPING), metavar='CLASSE',
+                        help="Requête sur l'index de présence : images ne contenant aucune de ces classes")
+    parser.add_argument('--cooccurrence', default=False, action='store_true',
+                        help="Affiche la matrice de co-occurrence des classes à partir de l'index de présence")
+    parser.add_argument('--index-source', default='pred', choices=['pred', 'gt'],
+                        help="Masques interrogés : prédits ou ground truth (défaut: pred)")
+    parser.add_argument('--adaptive', default=False,
+                        help="Requêtes parallèles avec limite de concurrence adaptative (AIMD) et disjoncteur (défaut: False)",
+                        action='store_true')
+    parser.add_argument('--pipeline', default=False, action='store_true',
+                        help="Pipeline complet par étapes avec cache : seules les étapes dont les entrées ou le code ont changé sont rejouées")
+    parser.add_argument('--dry-run', default=False, action='store_true',
+                        help="Avec --pipeline : affiche les étapes qui seraient recalculées sans les exécuter")
+    parser.add_argument('--force', nargs='+', default=(), metavar='ETAPE',
+                        help="Avec --pipeline : étapes à rejouer même si elles sont à jour")
+    parser.add_argument('--shard-index', type=int, default=None,
+                        help="Exécution par shards : index du shard traité par cette machine (0 à --shard-count - 1)")
+    parser.add_argument('--shard-count', type=int, default=None,
+                        help="Exécution par shards : nombre total de shards (partition déterministe par hachage des identifiants)")
+    parser.add_argument('--merge-shards', nargs='+', default=None, metavar='FICHIER',
+                        help="Fusionne des résultats partiels de shards (fichiers ou répertoires) en un rapport complet")
+    parser.add_argument('--video', nargs='*', default=None, metavar='SOURCE',
+                        help=f"Segmente des vidéos ou des répertoires de frames (défaut: contenu de {VIDEO_DIR}) ; seules les images qui changent sont envoyées à l'API")
+    parser.add_argument('--video-fps', type=float, default=VIDEO_SAMPLE_FPS,
+                        help=f"Images échantillonnées par seconde de vidéo (défaut: {VIDEO_SAMPLE_FPS})")
+    parser.add_argument('--static-threshold', type=float, default=VIDEO_STATIC_THRESHOLD,
+                        help=f"Écart moyen (0-255) en dessous duquel le masque de l'image clé est propagé (défaut: {VIDEO_STATIC_THRESHOLD})")
+    parser.add_argument('--source', nargs='+', default=None, metavar='SOURCE',
+                        help="Segmente les images de répertoires ou d'archives zip / tar lues en flux, sans extraction (noms image_N conservés)")
+    parser.add_argument('--instances', default=False, action='store_true',
+                        help="Avec -e ou --pipeline : évaluation par instances (composantes connexes) des accessoires : précision/rappel de détection et erreurs de comptage")
+    parser.add_argument('--approx', type=int, default=None, metavar='FACTEUR',
+                        help="Avec -e et --mask-format png : évaluation approchée sur les masques réduits de ce facteur (≈ facteur² fois moins de pixels)")
+    parser.add_argument('--approx-method', default=APPROX_METHOD, choices=['stride', 'resize'],
+                        help="Réduction des masques : un pixel sur FACTEUR (stride) ou plus proche voisin au centre des blocs (resize)")
+    parser.add_argument('--calibrate-approx', nargs='*', type=int, default=None, metavar='FACTEUR',
+                        help=f"Mesure l'écart entre évaluation approchée et exacte pour ces facteurs (défaut: {' '.join(map(str, APPROX_CALIBRATION_FACTORS))})")
+    parser.add_argument('--similar', nargs='+', default=None, metavar='IMAGE',
+                        help="Tenues les plus similaires à ces images (image_N), d'après les descripteurs des masques (--index-source)")
+    parser.add_argument('--top-k', type=int, default=SIMILARITY_TOP_K,
+                        help="Nombre de tenues similaires retournées")
+    parser.add_argument('--nprobe', type=int, default=SIMILARITY_IVF_NPROBE,
+                        help="Listes IVF parcourues par requête (si l'index IVF existe)")
+    parser.add_argument('--ivf', default=False, action='store_true',
+                        help="(Re)construit l'index IVF de recherche approximative, quelle que soit la taille du jeu de données")
+    parser.add_argument('--serve', default=False, action='store_true',
+                        help="Service HTTP local de requêtes sur les résultats : métriques par image, filtres de classes, classements et tuiles de masques")
+    parser.add_argument('--serve-port', type=int, default=SERVE_PORT,
+                        help=f"Port du service de requêtes (défaut: {SERVE_PORT})")
+    parser.add_argument('--memory-profile', default=False, action='store_true',
+                        help=f"Profil mémoire par étape (pic RSS, sites d'allocation tracemalloc, pic par image) écrit dans {MEMORY_PROFILE_REPORT}")
 
     args = parser.parse_args()
-    
+    if args.memory_profile:
+        with MemoryProfiler() as profiler:
+            result = run(args, parser)
+        profiler.save()
+        return result
+    return run(args, parser)
+
+
+def run(args, parser):
+    """Exécute le mode demandé par les arguments de la ligne de commande"""
     sample_run = args.sample
     eval_mode = args.evaluation
+
+    if args.colors:
+        print("\nMode analyse des couleurs activé...")
+        analyze_dataset_colors()
+        return
+
+    if args.serve:
+        print("\nMode service de requêtes activé...")
+        start_query_service(port=args.serve_port)
+        return
+
+    if args.calibrate_approx is not None:
+        calibrate_approximation(args.calibrate_approx or APPROX_CALIBRATION_FACTORS, method=args.approx_method)
+        return
     
+    if args.merge_shards:
+        all_img_eval, _, _ = merge_shard_results(args.merge_shards)
+        dataset_results = analyze_dataset_eval(all_img_eval)
+        report_path = fill_template_and_save(dataset_results)
+        print(f"Rapport complet généré dans : {report_path}")
+        return
+
+    if args.approx and args.mask_format != 'png':
+        # L'évaluation RLE est exacte (calcul sur les plages) : le rapport ne doit pas la présenter comme approchée
+        parser.error("--approx ne s'applique qu'aux masques PNG (--mask-format png) : l'évaluation RLE est exacte")
+
+    shard = None
+    if args.shard_count is not None or args.shard_index is not None:
+        if args.shard_count is None or args.shard_index is None or not 0 <= args.shard_index < args.shard_count:
+            parser.error("--shard-index et --shard-count vont ensemble, avec 0 <= index < nombre")
+        shard = (args.shard_index, args.shard_count)
+
+    if args.video is not None:
+        print("\nMode vidéo activé...")
+        segment_videos(args.video, sample_fps=args.video_fps, static_threshold=args.static_threshold,
+                       model=args.models[0] if args.models else DEFAULT_MODEL)
+        return
+
+    if args.similar:
+        mask_dir = MASK_TRUE_DIR if args.index_source == 'gt' else MASK_PRED_DIR
+        index = update_similarity_index(image_dir, mask_dir, ivf=True if args.ivf else None)
+        print_similar_outfits(index, args.similar, k=args.top_k, nprobe=args.nprobe)
+        return
+
+    if args.query_with or args.query_without or args.cooccurrence:
+        mask_dir = MASK_TRUE_DIR if args.index_source == 'gt' else MASK_PRED_DIR
+        index = update_presence_index(mask_dir)
+        if args.query_with or args.query_without:
+            matches = index.query(args.query_with or (), args.query_without or ())
+            print(f"\n{len(matches)}/{len(index)} masque(s) correspondant(s) :")
+            for name in matches:
+                print(name)
+        if args.cooccurrence:
+            cooccurrence = index.cooccurrence()
+            names = list(CLASS_MAPPING)[1:]
+            print(f"\nCo-occurrence des classes ({len(index)} masque(s)) :")
+            print(" " * 14 + "".join(f"{name[:6]:>7}" for name in names))
+            for i, name in enumerate(names, start=1):
+                print(f"{name:<14}" + "".join(f"{count:>7}" for count in cooccurrence[i, 1:]))
+        return
+
+    if args.source and not eval_mode:
+        for source in args.source:
+            print(f"\nSegmentation en flux des images de {source}...")
+            segment_image_stream(source, mask_storage_format=args.mask_format, tiled=args.tiled,
+                                 limit=5 if sample_run else None)
+        save_visual_expected_result(tiled=args.tiled, compute_workers=args.compute_workers,
+                                    decode_workers=args.decode_workers)
+        return
+
     if not os.path.exists(image_dir):
         try:
             os.makedirs(image_dir, exist_ok=True)
@@ -40,10 +222,10 @@ def main(sample_run=False):
             print("Veuillez créer le répertoire manuellement ou changer le chemin.")
             return
         
-    image_paths = []
-    for img in os.listdir(image_dir):
-        print(f"Image trouvée : {img}")
-        image_paths.append(os.path.join(image_dir, img))
+    with open_manifest() as manifest:
+        image_paths = manifest.image_paths()
+    for img_path in image_paths:
+        print(f"Image trouvée : {os.path.basename(img_path)}")
         
     if not image_paths:
         print(f"Aucune image trouvée dans '{image_dir}'. Veuillez y ajouter des images.")
@@ -51,20 +233,85 @@ def main(sample_run=False):
     else:
         print(f"{len(image_paths)} image(s) à traiter : {image_paths}")
 
+    if shard is not None:
+        image_paths = select_shard(image_paths, *shard)
+        print(f"\nShard {shard[0]}/{shard[1]} : {len(image_paths)} image(s) à segmenter puis évaluer")
+        if not eval_mode:
+            segment_images_batch(image_paths, mask_storage_format=args.mask_format, tiled=args.tiled,
+                                 dedup=args.dedup, dedup_max_distance=args.dedup_distance, adaptive=args.adaptive)
+        if args.compute_workers > 0:
+            shard_eval = eval_dataset_parallel(args.decode_workers, args.compute_workers, shard=shard,
+                                               instances=args.instances, tiled=args.tiled)
+        else:
+            shard_eval = eval_dataset(use_rle=args.mask_format != 'png', tiled=args.tiled, shard=shard,
+                                      instances=args.instances)
+        mark_stage([img['image'] for img in shard_eval], "evaluate")
+        write_shard_results(shard_eval, *shard)
+        return
+
+    if args.load_test:
+        model = args.models[0] if args.models else DEFAULT_MODEL
+        target = args.endpoint or get_model_url(model)
+        print(f"\nTest de charge de {target} avec {len(image_paths)} image(s)...")
+        levels = run_load_test(image_paths, args.concurrency, args.load_requests, model=model, api_url=args.endpoint)
+        write_load_test_report(levels, target)
+        return
+
+    if args.pipeline:
+        stages = build_pipeline(image_paths, mask_storage_format=args.mask_format, tiled=args.tiled, dedup=args.dedup,
+                                dedup_max_distance=args.dedup_distance, adaptive=args.adaptive,
+                                compute_workers=args.compute_workers, decode_workers=args.decode_workers,
+                                instances=args.instances)
+        run_pipeline(stages, dry_run=args.dry_run, force=args.force)
+        return
+
     if not eval_mode:
         print("\nMode segmentation activé...")
-        if sample_run:
+        if sample_run and args.sample_ci_width and os.path.exists('dataset_evaluation_report.json'):
+            with open('dataset_evaluation_report.json', 'r') as f:
+                previous_results = json.load(f)['per_image_results']
+            selected, ci_width = select_stratified_sample(previous_results, args.sample_ci_width)
+            selected = set(selected)
+            image_paths = [p for p in image_paths if mask_filename_for(os.path.basename(p)) in selected]
+            print(f"Sample run stratifié : {len(image_paths)} image(s) (largeur d'IC estimée {ci_width*100:.1f} pts) : {image_paths}")
+        elif sample_run:
             image_paths = image_paths[:5]
             print(f"Sample run : {len(image_paths)} image(s) sélectionnée(s) : {image_paths}")
             
+        if args.models:
+            print(f"\nSegmentation de {len(image_paths)} image(s) avec {len(args.models)} modèle(s)...")
+            segment_images_multi_model(image_paths, args.models, mask_storage_format=args.mask_format)
+            compare_models(args.models)
+            return
+
         print(f"\nDémarrage du traitement de {len(image_paths)} image(s) en batch...")
-        segment_images_batch(image_paths)
-        save_visual_expected_result()
+        segment_images_batch(image_paths, mask_storage_format=args.mask_format, tiled=args.tiled,
+                             dedup=args.dedup, dedup_max_distance=args.dedup_distance, adaptive=args.adaptive)
+        save_visual_expected_result(tiled=args.tiled, compute_workers=args.compute_workers,
+                                    decode_workers=args.decode_workers)
     else:
         print("\nMode évaluation activé...")
+        if args.models:
+            compare_models(args.models)
+            return
         mean_iou, iou_scores, accuracy, distributions_GT, distributions_Pred = evaluate_single_image()
         analyse_evaluation_image(mean_iou, iou_scores, accuracy, distributions_GT, distributions_Pred)
-        all_img_eval = eval_dataset()
+        if args.approx:
+            # Évaluation approchée (séquentielle) : les index de présence et le manifeste ne sont pas mis à jour
+            all_img_eval = eval_dataset(instances=args.instances, approx_factor=args.approx,
+                                        approx_method=args.approx_method)
+            dataset_results = analyze_dataset_eval(all_img_eval, approximation_summary(args.approx, args.approx_method))
+            report_path = fill_template_and_save(dataset_results)
+            print(f"Rapport complet (approché) généré dans : {report_path}")
+            return
+        if args.compute_workers > 0:
+            all_img_eval = eval_dataset_parallel(args.decode_workers, args.compute_workers, instances=args.instances,
+                                                 tiled=args.tiled)
+        else:
+            all_img_eval = eval_dataset(use_rle=args.mask_format != 'png', tiled=args.tiled,
+                                        instances=args.instances)
+        update_indexes_from_eval(all_img_eval, MASK_TRUE_DIR, MASK_PRED_DIR)
+        mark_stage([img['image'] for img in all_img_eval], "evaluate")
         dataset_results = analyze_dataset_eval(all_img_eval)
         report_path = fill_template_and_save(dataset_results)
         print(f"Rapport complet généré dans : {report_path}")
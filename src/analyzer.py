@@ -1,8 +1,11 @@
 
-from .utils import get_logger
+from .utils import get_logger, memory_stage
 import json
 import numpy as np
 from .config import CLASS_MAPPING
+from .stability import bootstrap_confidence_intervals, cross_validation_iou
+from .confusion import accumulate_confusion, analyze_confusion
+from .instances import analyze_instances
 
 logger = get_logger(__name__, 'report.log')
 
@@ -69,10 +72,23 @@ def analyse_evaluation_image(mean_iou, iou_scores, accuracy, distributions_GT, d
     logger.info(f"Répartition des performances : {excellent_classes} excellentes, {good_classes} bonnes, {moderate_classes} modérées, {poor_classes} faibles")
     
 
-def analyze_dataset_eval(dataset_eval):
+@memory_stage("analyze_dataset_eval")
+def analyze_dataset_eval(dataset_eval, approximation=None):
     """
     Analyse les résultats d'évaluation pour un ensemble d'images.
+    approximation : description d'une évaluation approchée (voir approximation_summary), reprise dans le rapport.
     """
+    # Matrice de confusion du jeu de données (les matrices par image ne sont pas gardées dans le JSON)
+    confusion_analysis = None
+    if dataset_eval and all('confusion' in img for img in dataset_eval):
+        confusion_analysis = analyze_confusion(accumulate_confusion(img['confusion'] for img in dataset_eval))
+    # Évaluation par instances (eval_dataset(instances=True))
+    instance_analysis = None
+    if dataset_eval and all('instances' in img for img in dataset_eval):
+        instance_analysis = analyze_instances(img['instances'] for img in dataset_eval)
+    dataset_eval = [{key: value for key, value in img.items() if key not in ('confusion', 'instances')}
+                    for img in dataset_eval]
+
     # Stabilité - Écart-type des Mean IoU
     mean_ious = [img['mean_iou'] for img in dataset_eval]
     # Calculs statistiques
@@ -142,6 +158,10 @@ def analyze_dataset_eval(dataset_eval):
         if failure_rate > 0.5:  # Problématique dans >50% des cas
             problematic_classes[class_name] = failure_rate
             
+    # Intervalles de confiance bootstrap et cross-validation IoU
+    confidence_intervals = bootstrap_confidence_intervals(dataset_eval)
+    cross_validation = cross_validation_iou(dataset_eval)
+
     dataset_eval = clean_numpy_for_json(dataset_eval)
     dataset_results = {
         'global_metrics': {
@@ -173,12 +193,17 @@ def analyze_dataset_eval(dataset_eval):
                         'mean_iou': float(stats['mean_iou']) if not np.isnan(stats['mean_iou']) else None,
                         'std_iou': float(stats['std_iou']) if not np.isnan(stats['std_iou']) else None
                     } for class_name, stats in class_stability.items()
-               }
+               },
+            'confidence_intervals': clean_numpy_for_json(confidence_intervals),
+            'cross_validation_iou': clean_numpy_for_json(cross_validation)
         },
         'class_frequency': {
             class_name: freq for class_name, freq in class_frequency.items()
         },
         'problematic_classes': problematic_classes,
+        'confusion_analysis': confusion_analysis,
+        'instance_analysis': instance_analysis,
+        'approximation': approximation,
         'performance_ranking': {
             'worst_5': [{'image': img['image'], 'mean_iou': float(img['mean_iou'])} for img in worst_5],
             'best_5': [{'image': img['image'], 'mean_iou': float(img['mean_iou'])} for img in best_5]
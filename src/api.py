@@ -1,29 +1,57 @@
 from .utils import get_logger
+from .config import HF_API_BASE_URL, DEFAULT_MODEL
 import os
 import requests
 
 logger = get_logger(__name__, __name__ + ".log")
 
-def call_hf_segmentation_api(image_data, model="sayeed99/segformer_b3_clothes"):
+def get_model_url(model=DEFAULT_MODEL):
     """
-    Calls the Hugging Face segmentation API with the provided image data.
+    Builds the inference URL of a model.
+
+    The base URL can be overridden with the HF_API_BASE_URL environment variable
+    (e.g. to target a local stand-in server).
+    """
+    base_url = os.getenv("HF_API_BASE_URL") or HF_API_BASE_URL
+    return f"{base_url.rstrip('/')}/{model}"
+
+def post_segmentation_request(data, model=DEFAULT_MODEL, api_url=None, timeout=None):
+    """
+    Sends raw image bytes to the segmentation endpoint.
 
     Args:
-        image_data (bytes): The image data to be sent to the API.
+        data (bytes): The encoded image.
         model (str): The model to be used for segmentation.
+        api_url (str): Full endpoint URL, overrides the model URL (e.g. a local stand-in server).
+        timeout (float): Request timeout in seconds.
 
     Returns:
-        dict: The response from the API containing segmentation results.
+        requests.Response: The raw HTTP response.
     """
-    API_URL = "https://router.huggingface.co/hf-inference/models/sayeed99/segformer_b3_clothes"
     headers = {
         "Authorization": f"Bearer {os.environ['HF_TOKEN']}",
+        "Content-Type": "image/jpeg",
     }
+    return requests.post(api_url or get_model_url(model), headers=headers, data=data, timeout=timeout)
+
+def call_hf_segmentation_api(image_data, model=DEFAULT_MODEL):
+    """
+    Calls the Hugging Face segmentation API with the provided image data.
+
+    Args:
+        image_data (str | bytes): Path to the image, or its raw content if already read.
+        model (str): The model to be used for segmentation.
 
+    Returns:
+        dict: The response from the API containing segmentation results.
+    """
     try:
-        with open(image_data, "rb") as f:
-            data = f.read()
-        response = requests.post(API_URL, headers={"Content-Type": "image/jpeg", **headers}, data=data)
+        if isinstance(image_data, (bytes, bytearray, memoryview)):
+            data = image_data
+        else:
+            with open(image_data, "rb") as f:
+                data = f.read()
+        response = post_segmentation_request(data, model)
         logger.info(f"API Response Status Code: {response.status_code}")
         logger.info(f"API Response Content: {response.content}")
         if response.status_code == 200:
@@ -0,0 +1,167 @@
+import json
+import os
+import time
+import numpy as np
+from tqdm import tqdm
+from .utils import get_logger
+from .evaluation import (get_y_from_mask, get_y_from_mask_reduced, compute_confusion_matrix, rescale_confusion,
+                         evaluate_pair_from_confusion)
+from .manifest import open_manifest
+from .stability import per_image_matrix
+from .config import (APPROX_METHOD, APPROX_CALIBRATION_FACTORS, APPROX_CALIBRATION_IMAGES, APPROX_CALIBRATION_REPORT,
+                     APPROX_BOUND_Z)
+
+logger = get_logger(__name__, 'report.log')
+
+
+def _records(confusions):
+    """Mean IoU, IoU par classe et Pixel Accuracy de chaque matrice de confusion (conventions de eval_dataset)"""
+    records = []
+    for confusion in confusions:
+        mean_iou, iou_scores, accuracy, _, _ = evaluate_pair_from_confusion(confusion)
+        records.append({'mean_iou': mean_iou, 'iou_scores': iou_scores, 'accuracy': accuracy})
+    return records
+
+
+def metric_error(exact, approx, z=APPROX_BOUND_Z, span=1.0):
+    """
+    Écart entre la moyenne approchée et la moyenne exacte d'une métrique par image (NaN ignorés,
+    comme dans analyze_dataset_eval) et borne de cet écart : |écart| + z x erreur standard des
+    différences appariées image par image, plafonnée à l'étendue de la métrique (span).
+    """
+    exact, approx = np.asarray(exact, dtype=np.float64), np.asarray(approx, dtype=np.float64)
+    if np.isnan(exact).all() or np.isnan(approx).all():
+        return None
+    error = float(np.nanmean(approx) - np.nanmean(exact))
+    paired = approx - exact
+    paired = paired[~np.isnan(paired)]
+    stderr = float(paired.std(ddof=1) / np.sqrt(len(paired))) if len(paired) > 1 else 0.0
+    return {
+        'exact': float(np.nanmean(exact)),
+        'approx': float(np.nanmean(approx)),
+        'error': error,
+        'bound': min(abs(error) + z * stderr, span)
+    }
+
+
+def calibrate_approximation(factors=APPROX_CALIBRATION_FACTORS, method=APPROX_METHOD,
+                            sample_size=APPROX_CALIBRATION_IMAGES, output_path=APPROX_CALIBRATION_REPORT, rng=None):
+    """
+    Calibration de l'évaluation approchée : sur un échantillon d'images, chaque paire de masques
+    est évaluée en pleine résolution puis relue réduite et évaluée à chaque facteur de réduction.
+
+    Pour chaque facteur, le rapport donne l'écart et la borne d'erreur du Mean IoU global, de la
+    Pixel Accuracy et du Mean IoU de chaque classe, la distribution de l'erreur absolue du Mean IoU
+    par image, la part de pixels réellement évalués et le gain de temps de bout en bout (lecture
+    des masques et calcul des métriques).
+
+    Returns:
+        dict: Calibration de la méthode (sauvegardée sous sa clé dans output_path).
+    """
+    rng = rng if rng is not None else np.random.default_rng(0)
+    with open_manifest() as manifest:
+        pairs = [pair for pair in manifest.eval_pairs(include_rle=True) if pair[1] is not None]
+    if not pairs:
+        raise FileNotFoundError("Aucune paire de masques (ground truth, prédit) à calibrer")
+    if len(pairs) > sample_size:
+        pairs = [pairs[i] for i in np.sort(rng.choice(len(pairs), size=sample_size, replace=False))]
+
+    exact_confusions, approx_confusions = [], {factor: [] for factor in factors}
+    exact_seconds, approx_seconds = 0.0, {factor: 0.0 for factor in factors}
+    pixels, sampled = 0, {factor: 0 for factor in factors}
+    for _, true_mask_path, pred_mask_path in tqdm(pairs, desc="Calibration de l'évaluation approchée"):
+        # Temps de bout en bout, comme dans eval_dataset : lecture des deux masques puis calcul
+        start = time.perf_counter()
+        y_true, y_pred = get_y_from_mask(true_mask_path), get_y_from_mask(pred_mask_path)
+        exact_confusions.append(compute_confusion_matrix(y_true, y_pred))
+        exact_seconds += time.perf_counter() - start
+        pixels += y_true.size
+        del y_true, y_pred
+        for factor in factors:
+            start = time.perf_counter()
+            small_true, full_pixels = get_y_from_mask_reduced(true_mask_path, factor, method)
+            small_pred, _ = get_y_from_mask_reduced(pred_mask_path, factor, method)
+            approx_confusions[factor].append(rescale_confusion(compute_confusion_matrix(small_true, small_pred),
+                                                               full_pixels))
+            approx_seconds[factor] += time.perf_counter() - start
+            sampled[factor] += small_true.size
+
+    exact_records = _records(exact_confusions)
+    exact_mean_ious, exact_class_ious, class_names = per_image_matrix(exact_records)
+    exact_accuracy = np.array([r['accuracy'] for r in exact_records])
+    calibration = {'method': method, 'images': len(pairs), 'z': APPROX_BOUND_Z, 'factors': {}}
+    for factor in factors:
+        records = _records(approx_confusions[factor])
+        mean_ious, class_ious, _ = per_image_matrix(records)
+        per_image_error = np.abs(mean_ious - exact_mean_ious)
+        per_class = {}
+        for i, class_name in enumerate(class_names):
+            error = metric_error(exact_class_ious[:, i], class_ious[:, i])
+            if error is not None:
+                per_class[class_name] = error
+        calibration['factors'][str(factor)] = {
+            'factor': factor,
+            'pixel_fraction': sampled[factor] / pixels,
+            'speedup': exact_seconds / approx_seconds[factor] if approx_seconds[factor] > 0 else None,
+            'mean_iou': metric_error(exact_mean_ious, mean_ious),
+            'pixel_accuracy': metric_error(exact_accuracy, [r['accuracy'] for r in records], span=100.0),
+            'per_image_abs_error': {
+                'mean': float(per_image_error.mean()),
+                'p95': float(np.percentile(per_image_error, 95)),
+                'max': float(per_image_error.max())
+            },
+            'per_class': per_class,
+            'max_class_bound': max((e['bound'] for e in per_class.values()), default=None)
+        }
+
+    # Une calibration par méthode de réduction dans le même fichier
+    calibrations = {}
+    if os.path.exists(output_path):
+        with open(output_path, 'r') as f:
+            calibrations = json.load(f)
+    calibrations[method] = calibration
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(calibrations, f, indent=4)
+    print_calibration(calibration)
+    logger.info(f"Calibration de l'évaluation approchée ({len(pairs)} image(s)) sauvegardée dans '{output_path}'")
+    return calibration
+
+
+def print_calibration(calibration):
+    print(f"\nCalibration de l'évaluation approchée ({calibration['method']}, {calibration['images']} image(s)) :")
+    print(f"{'Facteur':>8} {'Pixels':>8} {'Gain':>7} {'Écart mIoU':>11} {'Borne mIoU':>11} {'p95 image':>10} {'Borne classe max':>17}")
+    for entry in calibration['factors'].values():
+        speedup = f"x{entry['speedup']:.1f}" if entry['speedup'] else "-"
+        class_bound = f"{entry['max_class_bound']*100:.2f} pts" if entry['max_class_bound'] is not None else "-"
+        print(f"{entry['factor']:>8} {entry['pixel_fraction']*100:>7.2f}% {speedup:>7} "
+              f"{entry['mean_iou']['error']*100:>+7.2f} pts {entry['mean_iou']['bound']*100:>7.2f} pts "
+              f"{entry['per_image_abs_error']['p95']*100:>6.2f} pts {class_bound:>17}")
+
+
+def load_calibration(factor, method=APPROX_METHOD, path=APPROX_CALIBRATION_REPORT):
+    """Entrée de calibration d'un facteur et d'une méthode, ou None si elle n'a pas été calibrée"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        calibration = json.load(f).get(method)
+    return calibration['factors'].get(str(factor)) if calibration else None
+
+
+def approximation_summary(factor, method=APPROX_METHOD, path=APPROX_CALIBRATION_REPORT):
+    """
+    Description d'une évaluation approchée pour le rapport : facteur, méthode et bornes d'erreur
+    calibrées (None si le facteur n'a pas été calibré : lancer --calibrate-approx).
+    """
+    entry = load_calibration(factor, method, path)
+    summary = {'factor': factor, 'method': method, 'calibrated': entry is not None}
+    if entry is None:
+        logger.warning(f"Facteur d'approximation {factor} ({method}) non calibré : bornes d'erreur inconnues")
+        return summary
+    summary.update({
+        'pixel_fraction': entry['pixel_fraction'],
+        'mean_iou_bound': entry['mean_iou']['bound'],
+        'pixel_accuracy_bound': entry['pixel_accuracy']['bound'],
+        'per_class_bounds': {name: e['bound'] for name, e in entry['per_class'].items()}
+    })
+    return summary
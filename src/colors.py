@@ -0,0 +1,235 @@
+import json
+import numpy as np
+import cv2
+from tqdm import tqdm
+from .utils import get_logger, iter_local_dataset
+from .config import (CLASS_MAPPING, API_SEGMENTATION_OUTPUTS_DIR, COLOR_ANALYSIS_CLASSES,
+                     COLOR_TOP_K, COLOR_MAX_SCAN_PIXELS, COLOR_MAX_SAMPLES_PER_CLASS,
+                     COLOR_MIN_PIXELS, COLOR_ANALYSIS_REPORT)
+import os
+
+logger = get_logger(__name__, __name__ + ".log")
+
+CLASS_NAMES = list(CLASS_MAPPING.keys())
+
+
+def bgr_to_lab(pixels_bgr):
+    """
+    Convertit des pixels BGR uint8 (N, 3) en Lab réel (L dans [0, 100], a/b centrés sur 0).
+    """
+    pixels = pixels_bgr.reshape(-1, 1, 3).astype(np.float32) / 255.0
+    return cv2.cvtColor(pixels, cv2.COLOR_BGR2Lab).reshape(-1, 3)
+
+
+def lab_to_rgb(colors_lab):
+    """
+    Convertit des couleurs Lab (N, 3) en RGB uint8 (N, 3).
+    """
+    lab = np.asarray(colors_lab, dtype=np.float32).reshape(-1, 1, 3)
+    bgr = cv2.cvtColor(lab, cv2.COLOR_Lab2BGR).reshape(-1, 3)
+    rgb = np.clip(np.rint(bgr[:, ::-1] * 255.0), 0, 255)
+    return rgb.astype(np.uint8)
+
+
+def kmeans_lab(points, k, weights=None, max_iter=20, tol=1e-2, rng=None):
+    """
+    K-means vectorisé (Lloyd + initialisation k-means++) sur des points Lab.
+
+    Args:
+        points (np.ndarray): Points (N, 3) en float32.
+        k (int): Nombre de clusters demandés (réduit si N < k).
+        weights (np.ndarray, optional): Poids (N,) de chaque point.
+        max_iter (int): Nombre maximal d'itérations.
+        tol (float): Déplacement maximal des centroïdes (en unités Lab) pour arrêter.
+        rng (np.random.Generator, optional): Générateur aléatoire (reproductibilité).
+
+    Returns:
+        tuple: (centroïdes (k, 3), parts (k,)) triés par part décroissante.
+    """
+    rng = rng if rng is not None else np.random.default_rng(0)
+    points = np.asarray(points, dtype=np.float32)
+    n = len(points)
+    weights = np.ones(n, dtype=np.float64) if weights is None else np.asarray(weights, dtype=np.float64)
+    k = min(k, n)
+    if k == 0:
+        return np.empty((0, 3), dtype=np.float32), np.empty(0)
+
+    # Initialisation k-means++ pondérée
+    centroids = np.empty((k, points.shape[1]), dtype=np.float32)
+    centroids[0] = points[rng.choice(n, p=weights / weights.sum())]
+    closest = ((points - centroids[0]) ** 2).sum(axis=1)
+    for i in range(1, k):
+        probs = closest * weights
+        total = probs.sum()
+        if total <= 0:  # Tous les points sont déjà des centroïdes
+            centroids = centroids[:i]
+            break
+        centroids[i] = points[rng.choice(n, p=probs / total)]
+        closest = np.minimum(closest, ((points - centroids[i]) ** 2).sum(axis=1))
+    k = len(centroids)
+
+    points_sq = (points ** 2).sum(axis=1)[:, None]
+    for _ in range(max_iter):
+        # Distances au carré (N, k) en une seule opération matricielle
+        distances = points_sq - 2.0 * points @ centroids.T + (centroids ** 2).sum(axis=1)[None, :]
+        labels = distances.argmin(axis=1)
+        cluster_weights = np.bincount(labels, weights=weights, minlength=k)
+        new_centroids = np.stack([
+            np.bincount(labels, weights=weights * points[:, d], minlength=k) for d in range(points.shape[1])
+        ], axis=1)
+        non_empty = cluster_weights > 0
+        new_centroids[non_empty] /= cluster_weights[non_empty, None]
+        new_centroids[~non_empty] = centroids[~non_empty]  # Cluster vide : on garde l'ancien centroïde
+        shift = np.abs(new_centroids - centroids).max()
+        centroids = new_centroids.astype(np.float32)
+        if shift < tol:
+            break
+
+    distances = points_sq - 2.0 * points @ centroids.T + (centroids ** 2).sum(axis=1)[None, :]
+    labels = distances.argmin(axis=1)
+    shares = np.bincount(labels, weights=weights, minlength=k) / weights.sum()
+    order = np.argsort(shares)[::-1]
+    keep = shares[order] > 0
+    return centroids[order][keep], shares[order][keep]
+
+
+def histogram_lab(points, k, bins=8):
+    """
+    Quantification par histogramme 3D dans l'espace Lab (alternative plus rapide au k-means).
+
+    Returns:
+        tuple: (couleurs moyennes des k bins les plus peuplés, parts correspondantes).
+    """
+    points = np.asarray(points, dtype=np.float32)
+    if len(points) == 0:
+        return np.empty((0, 3), dtype=np.float32), np.empty(0)
+    lows = np.array([0.0, -128.0, -128.0], dtype=np.float32)
+    spans = np.array([100.0, 256.0, 256.0], dtype=np.float32)
+    cells = np.clip(((points - lows) / spans * bins).astype(np.int64), 0, bins - 1)
+    flat = (cells[:, 0] * bins + cells[:, 1]) * bins + cells[:, 2]
+    counts = np.bincount(flat, minlength=bins ** 3)
+    top = np.argsort(counts)[::-1][:k]
+    top = top[counts[top] > 0]
+    sums = np.stack([np.bincount(flat, weights=points[:, d], minlength=bins ** 3) for d in range(3)], axis=1)
+    colors = sums[top] / counts[top, None]
+    return colors.astype(np.float32), counts[top] / len(points)
+
+
+def format_palette(colors_lab, shares):
+    """Formate une palette Lab en liste de dictionnaires sérialisables en JSON"""
+    rgb = lab_to_rgb(colors_lab)
+    return [
+        {
+            'lab': [round(float(v), 2) for v in lab],
+            'rgb': [int(v) for v in color],
+            'hex': '#{:02x}{:02x}{:02x}'.format(*color),
+            'share': round(float(share), 4)
+        }
+        for lab, color, share in zip(colors_lab, rgb, shares)
+    ]
+
+
+def extract_dominant_colors(image, label_map, class_ids=None, k=COLOR_TOP_K, method="kmeans",
+                            max_scan_pixels=COLOR_MAX_SCAN_PIXELS,
+                            max_samples_per_class=COLOR_MAX_SAMPLES_PER_CLASS,
+                            min_pixels=COLOR_MIN_PIXELS, rng=None):
+    """
+    Extrait les couleurs dominantes de chaque classe présente dans un masque de segmentation.
+
+    Le coût est borné quelle que soit la résolution : l'image est d'abord parcourue avec un
+    pas régulier pour ne pas dépasser `max_scan_pixels`, puis au plus `max_samples_per_class`
+    pixels sont tirés au hasard par classe avant la quantification dans l'espace Lab.
+
+    Args:
+        image (np.ndarray): Image BGR (H, W, 3).
+        label_map (np.ndarray): Masque (H, W) d'identifiants de classes.
+        class_ids (list, optional): Classes à analyser (défaut : toutes sauf Background).
+        k (int): Nombre de couleurs dominantes par classe.
+        method (str): "kmeans" ou "histogram".
+
+    Returns:
+        dict: {class_name: {'pixel_count': int, 'colors': [{'lab', 'rgb', 'hex', 'share'}, ...]}}
+    """
+    if image.shape[:2] != label_map.shape[:2]:
+        raise ValueError(f"Dimensions incompatibles entre l'image {image.shape[:2]} et le masque {label_map.shape[:2]}")
+    rng = rng if rng is not None else np.random.default_rng(0)
+    class_ids = class_ids if class_ids is not None else range(1, len(CLASS_MAPPING))
+
+    # Sous-échantillonnage régulier (vue sans copie) pour borner le nombre de pixels parcourus
+    height, width = label_map.shape[:2]
+    stride = max(1, int(np.ceil(np.sqrt(height * width / max_scan_pixels))))
+    labels = np.ascontiguousarray(label_map[::stride, ::stride]).ravel()
+    pixels = image[::stride, ::stride].reshape(-1, 3)
+    counts = np.bincount(labels, minlength=len(CLASS_MAPPING))
+
+    palettes = {}
+    for class_id in class_ids:
+        if counts[class_id] * stride * stride < min_pixels:
+            continue
+        positions = np.flatnonzero(labels == class_id)
+        if len(positions) > max_samples_per_class:
+            positions = rng.choice(positions, size=max_samples_per_class, replace=False)
+        points = bgr_to_lab(pixels[positions])
+        if method == "histogram":
+            colors, shares = histogram_lab(points, k)
+        else:
+            colors, shares = kmeans_lab(points, k, rng=rng)
+        palettes[CLASS_NAMES[class_id]] = {
+            'pixel_count': int(counts[class_id] * stride * stride),
+            'colors': format_palette(colors, shares)
+        }
+    return palettes
+
+
+def aggregate_palettes(per_image_palettes, k=COLOR_TOP_K):
+    """
+    Agrège les palettes par image en une palette par classe pour tout le jeu de données.
+    Les couleurs de chaque image sont pondérées par leur nombre de pixels puis re-quantifiées.
+    """
+    points_by_class = {}
+    for palettes in per_image_palettes:
+        for class_name, palette in palettes.items():
+            for color in palette['colors']:
+                points_by_class.setdefault(class_name, []).append(
+                    (color['lab'], color['share'] * palette['pixel_count'])
+                )
+
+    dataset_palettes = {}
+    for class_name, entries in points_by_class.items():
+        points = np.array([lab for lab, _ in entries], dtype=np.float32)
+        weights = np.array([weight for _, weight in entries], dtype=np.float64)
+        colors, shares = kmeans_lab(points, k, weights=weights)
+        dataset_palettes[class_name] = {
+            'pixel_count': int(weights.sum()),
+            'images': sum(1 for palettes in per_image_palettes if class_name in palettes),
+            'colors': format_palette(colors, shares)
+        }
+    return dataset_palettes
+
+
+def analyze_dataset_colors(image_dir=os.path.join(API_SEGMENTATION_OUTPUTS_DIR, "IMG"),
+                           mask_dir=os.path.join(API_SEGMENTATION_OUTPUTS_DIR, "Mask"),
+                           output_path=COLOR_ANALYSIS_REPORT, k=COLOR_TOP_K, method="kmeans"):
+    """
+    Calcule les couleurs dominantes par (image, classe) pour tout un répertoire et sauvegarde le JSON.
+    Par défaut, les images segmentées (Output_API/IMG) et leurs masques prédits, appariés par numéro.
+    """
+    class_ids = [CLASS_MAPPING[name] for name in COLOR_ANALYSIS_CLASSES]
+    rng = np.random.default_rng(0)
+    per_image = []
+    for image, mask, idx in tqdm(iter_local_dataset(image_dir, mask_dir), desc="Analyse des couleurs"):
+        palettes = extract_dominant_colors(image, mask, class_ids=class_ids, k=k, method=method, rng=rng)
+        per_image.append({'image': f"image_{idx}", 'classes': palettes})
+        logger.info(f"Image {idx} - Classes analysées : {list(palettes.keys())}")
+
+    results = {
+        'method': method,
+        'top_k': k,
+        'dataset_palettes': aggregate_palettes([img['classes'] for img in per_image], k=k),
+        'per_image_palettes': per_image
+    }
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=4)
+    logger.info(f"Analyse des couleurs sauvegardée dans '{output_path}'")
+    print(f"Analyse des couleurs de {len(per_image)} image(s) sauvegardée dans '{output_path}'")
+    return results
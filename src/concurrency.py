@@ -0,0 +1,209 @@
+from collections import deque
+import threading
+import time
+from .api import post_segmentation_request
+from .utils import get_logger
+from .config import (DEFAULT_MODEL, ADAPTIVE_INITIAL_CONCURRENCY, ADAPTIVE_MIN_CONCURRENCY, ADAPTIVE_MAX_CONCURRENCY,
+                     ADAPTIVE_DECREASE_FACTOR, ADAPTIVE_LATENCY_TARGET, ADAPTIVE_ERROR_WINDOW,
+                     BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN, BREAKER_MAX_TRIPS)
+
+logger = get_logger(__name__, __name__ + ".log")
+
+# Statuts signalant une surcharge ou une indisponibilité temporaire de l'endpoint
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Le disjoncteur s'est ouvert trop de fois de suite : le reste du lot est abandonné"""
+
+
+class CircuitBreaker:
+    """
+    Disjoncteur à trois états :
+    - fermé : les requêtes passent ; `failure_threshold` échecs consécutifs l'ouvrent ;
+    - ouvert : aucune requête pendant `cooldown` secondes ;
+    - semi-ouvert : une seule requête de test ; un succès le referme, un échec le rouvre.
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN,
+                 max_trips=BREAKER_MAX_TRIPS):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_trips = max_trips
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.consecutive_trips = 0
+        self.opened_at = 0.0
+        self.open_for = cooldown
+        self.probe_in_flight = False
+
+    def allows(self, now):
+        """Indique si une requête peut partir (à appeler sous le verrou du contrôleur)"""
+        if self.state == "open" and now - self.opened_at >= self.open_for:
+            self.state = "half-open"
+            self.probe_in_flight = False
+            logger.info("Disjoncteur semi-ouvert : envoi d'une requête de test")
+        if self.state == "closed":
+            return True
+        if self.state == "half-open" and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return True
+        return False
+
+    def record(self, success, now, retry_after=None):
+        if self.state == "open":
+            return  # Réponse d'une requête partie avant l'ouverture : n'influe pas sur l'état
+        if success:
+            if self.state != "closed":
+                logger.info("Disjoncteur refermé")
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self.consecutive_trips = 0
+            return
+        self.consecutive_failures += 1
+        if self.state == "half-open" or self.consecutive_failures >= self.failure_threshold:
+            self.trip(now, retry_after)
+
+    def trip(self, now, retry_after=None):
+        self.state = "open"
+        self.opened_at = now
+        self.consecutive_trips += 1
+        self.probe_in_flight = False
+        # Temps d'attente annoncé par l'endpoint (ex. modèle en cours de chargement) s'il est plus long
+        self.open_for = max(self.cooldown, retry_after or 0.0)
+        logger.warning(f"Disjoncteur ouvert pour {self.open_for:.0f} s "
+                       f"({self.consecutive_failures} échec(s) consécutif(s), ouverture n°{self.consecutive_trips})")
+
+    @property
+    def exhausted(self):
+        return self.consecutive_trips >= self.max_trips
+
+
+class AdaptiveConcurrencyController:
+    """
+    Limite adaptative du nombre de requêtes simultanées (AIMD) :
+    - augmentation additive : +1/limite par succès, soit environ +1 par « fenêtre » de requêtes ;
+    - diminution multiplicative sur 429 / 5xx / exception ou latence supérieure à latency_target.
+      Une seule diminution par épisode de congestion : les réponses à des requêtes parties avant
+      la dernière diminution ne la réappliquent pas.
+    Le disjoncteur coupe l'envoi quand l'endpoint échoue de façon répétée.
+    """
+
+    def __init__(self, initial=ADAPTIVE_INITIAL_CONCURRENCY, min_limit=ADAPTIVE_MIN_CONCURRENCY,
+                 max_limit=ADAPTIVE_MAX_CONCURRENCY, decrease_factor=ADAPTIVE_DECREASE_FACTOR,
+                 latency_target=ADAPTIVE_LATENCY_TARGET, error_window=ADAPTIVE_ERROR_WINDOW, breaker=None):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_target = latency_target
+        self.breaker = breaker or CircuitBreaker()
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.recent = deque(maxlen=error_window)  # True = erreur
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """Attend une place libre et l'autorisation du disjoncteur ; retourne l'heure de départ"""
+        with self.condition:
+            while True:
+                if self.breaker.exhausted:
+                    raise CircuitOpenError(f"Disjoncteur ouvert {self.breaker.consecutive_trips} fois de suite")
+                now = time.monotonic()
+                if self.in_flight < int(self.limit) and self.breaker.allows(now):
+                    self.in_flight += 1
+                    return now
+                # Réveil périodique pour le passage à l'état semi-ouvert
+                self.condition.wait(timeout=0.5)
+
+    def release(self, started, status, latency, retry_after=None):
+        """Enregistre l'issue d'une requête (status None : exception réseau) et ajuste la limite"""
+        success = status == 200
+        congested = not success and (status is None or status in TRANSIENT_STATUSES)
+        congested = congested or (success and latency > self.latency_target)
+        with self.condition:
+            now = time.monotonic()
+            self.in_flight -= 1
+            self.recent.append(not success)
+            previous = int(self.limit)
+            if congested and started >= self.last_decrease:
+                self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                self.last_decrease = now
+            elif success and not congested:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            # Un 429 est d'abord traité par la diminution de la limite ; il ne compte pour le
+            # disjoncteur qu'une fois la limite au minimum. Les 5xx et erreurs réseau comptent toujours.
+            if status is None or (status in TRANSIENT_STATUSES and (status != 429 or previous <= self.min_limit)):
+                self.breaker.record(False, now, retry_after)
+            elif success:
+                self.breaker.record(True, now)
+            elif self.breaker.state == "half-open":
+                self.breaker.probe_in_flight = False  # Erreur définitive : le test ne conclut pas
+            if int(self.limit) != previous:
+                logger.info(f"Limite de concurrence : {previous} -> {int(self.limit)} ({self.describe()})")
+            self.condition.notify_all()
+
+    @property
+    def error_rate(self):
+        return sum(self.recent) / len(self.recent) if self.recent else 0.0
+
+    def snapshot(self):
+        """État courant pour la barre de progression et le journal"""
+        return {
+            'limite': int(self.limit),
+            'en_cours': self.in_flight,
+            'erreurs': f"{self.error_rate*100:.0f}%",
+            'disjoncteur': self.breaker.state
+        }
+
+    def describe(self):
+        return ", ".join(f"{key}={value}" for key, value in self.snapshot().items())
+
+
+def _retry_after(response):
+    """Délai d'attente annoncé par l'endpoint (en-tête Retry-After ou estimated_time d'un 503)"""
+    value = response.headers.get('Retry-After')
+    if value is None and response.status_code == 503:
+        try:
+            value = response.json().get('estimated_time')
+        except Exception:
+            value = None
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_controller(controller, img_path, model=DEFAULT_MODEL, max_retries=0, data=None):
+    """
+    Appelle l'API de segmentation sous le contrôle d'un AdaptiveConcurrencyController.
+    Les erreurs transitoires (429 / 5xx / réseau) sont retentées jusqu'à max_retries fois,
+    chaque tentative repassant par le contrôleur (limite et disjoncteur).
+    Le contenu de l'image peut être fourni (data) s'il a déjà été lu.
+
+    Returns:
+        list | None: Réponse de l'API, ou None en cas d'échec définitif.
+    """
+    if data is None:
+        with open(img_path, "rb") as f:
+            data = f.read()
+    for attempt in range(max_retries + 1):
+        started = controller.acquire()
+        status, retry_after, output = None, None, None
+        try:
+            response = post_segmentation_request(data, model)
+            status = response.status_code
+            if status == 200:
+                output = response.json()
+            else:
+                retry_after = _retry_after(response)
+                logger.info(f"Erreur API ({status}) pour {img_path} : {response.text[:200]}")
+        except Exception as e:
+            logger.info(f"Exception lors de l'appel API pour {img_path} : {e}")
+        finally:
+            controller.release(started, status, time.monotonic() - started, retry_after)
+        if status == 200:
+            return output
+        if status is not None and status not in TRANSIENT_STATUSES:
+            return None  # Erreur définitive (ex. 400) : inutile de réessayer
+    return None
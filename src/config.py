@@ -62,8 +62,181 @@ COLOR_MAPPING = {
 
 
 API_SEGMENTATION_OUTPUTS_DIR = "content/top_influenceurs_2024/Output_API"
+GT_RLE_DIR = "content/top_influenceurs_2024/Output_API/gt_rle"  # Cache RLE des masques ground truth (évaluation RLE), hors du jeu annoté
+SOURCE_IDS_FILE = "content/top_influenceurs_2024/Output_API/source_ids.json"  # Numéro N attribué à chaque image lue en flux (--source)
 IMG_DIR = "content/top_influenceurs_2024/IMG"
 MASK_DIR = "content/top_influenceurs_2024/Mask"
 EXPECTED_SEGMENTATION_OUTPUTS_DIR = "content/top_influenceurs_2024/Expected_Results"
 WWG_SEGMENTATION_OUTPUTS_DIR = "content/top_influenceurs_2024/Real_Results"
-LOG_DIR = "logs"
\ No newline at end of file
+LOG_DIR = "logs"
+
+# Analyse des couleurs dominantes par classe de vêtement
+COLOR_ANALYSIS_CLASSES = [
+    "Hat", "Sunglasses", "Upper-clothes", "Skirt", "Pants", "Dress",
+    "Belt", "Left-shoe", "Right-shoe", "Bag", "Scarf"
+]
+COLOR_TOP_K = 5                      # Nombre de couleurs dominantes conservées par (image, classe)
+COLOR_MAX_SCAN_PIXELS = 1_000_000    # Pixels max parcourus par image (sous-échantillonnage régulier au-delà)
+COLOR_MAX_SAMPLES_PER_CLASS = 20_000 # Pixels max tirés par classe pour le k-means
+COLOR_MIN_PIXELS = 50                # En dessous, la classe est ignorée (bruit de segmentation)
+COLOR_ANALYSIS_REPORT = "color_analysis_report.json"
+
+# Format de stockage des masques prédits : "png", "rle" (JSON run-length façon COCO) ou "both"
+MASK_STORAGE_FORMAT = "png"
+RLE_EXTENSION = ".rle.json"
+
+# Traitement par bandes de lignes pour les très grandes images (mode --tiled)
+TILE_MEMORY_BUDGET_MB = 64  # Mémoire de travail maximale par bande (hors image source et résultat final)
+
+# Pipeline multi-processus à mémoire partagée (décodage -> calcul)
+SHM_DECODE_WORKERS = 2   # Processus de lecture/décodage des PNG et images
+SHM_COMPUTE_WORKERS = 2  # Processus de calcul (évaluation, colorisation)
+SHM_SLOT_MB = 64         # Taille d'un emplacement du tampon circulaire partagé si la taille des entrées n'est pas estimée (sinon : plus grande entrée)
+SHM_SLOTS_PER_WORKER = 2 # Emplacements par processus de calcul (profondeur de la file / contre-pression)
+SHM_POLL_SECONDS = 1.0   # Intervalle de vérification des processus pendant l'attente des résultats (arrêt anormal d'un worker)
+
+# Déduplication des images avant segmentation (hash perceptuel)
+DEDUP_HASH = "phash"      # "phash" (DCT) ou "dhash" (gradient)
+DEDUP_MAX_DISTANCE = 6    # Distance de Hamming maximale (sur 64 bits) entre deux quasi-doublons
+
+# Stabilité des métriques : bootstrap et cross-validation
+STABILITY_BOOTSTRAP_RESAMPLES = 1000
+STABILITY_CONFIDENCE = 0.95
+STABILITY_FOLDS = 5
+
+# Modèles de segmentation (API d'inférence Hugging Face)
+HF_API_BASE_URL = "https://router.huggingface.co/hf-inference/models"  # Surchargeable par la variable d'environnement HF_API_BASE_URL
+DEFAULT_MODEL = "sayeed99/segformer_b3_clothes"
+MODEL_COMPARISON_WORKERS = 4  # Requêtes simultanées en mode comparaison multi-modèles
+MODEL_OUTPUTS_DIR = "content/top_influenceurs_2024/Output_API/models"
+
+# Test de charge de l'API de segmentation
+LOAD_TEST_CONCURRENCY_LEVELS = [1, 2, 4, 8, 16]  # Niveaux de concurrence testés successivement
+LOAD_TEST_REQUESTS_PER_LEVEL = 32                # Requêtes envoyées par niveau (les images sont rejouées en boucle)
+LOAD_TEST_TIMEOUT = 60                           # Délai maximal d'une requête (secondes)
+
+# Serveur local compatible avec l'API de segmentation (tests hors ligne)
+STUB_SERVER_PORT = 8000
+STUB_LATENCY_MEDIAN_MS = 400   # Latence médiane simulée (distribution log-normale)
+STUB_LATENCY_SIGMA = 0.5       # Dispersion log-normale de la latence
+STUB_ERROR_RATE = 0.0          # Proportion de réponses 503
+STUB_RATE_LIMIT_RATE = 0.0     # Proportion de réponses 429
+STUB_MAX_CONCURRENT = 0        # Requêtes simultanées au-delà desquelles le serveur répond 429 (0 : illimité)
+STUB_MASK_SCALE = 1.0          # Résolution des masques retournés par rapport à l'image (ex. 0.5)
+
+# Jeu de données synthétique (paires image_N / mask_N)
+SYNTHETIC_IMAGE_SIZE = (512, 768)  # (largeur, hauteur)
+SYNTHETIC_IMG_DIR = "content/synthetic/IMG"    # Jamais le jeu annoté : les masques ground truth seraient écrasés
+SYNTHETIC_MASK_DIR = "content/synthetic/Mask"
+
+# Hiérarchie des classes pour l'analyse de confusion (niveau -> groupe -> classes).
+# Les classes non listées dans un niveau restent un groupe à part entière.
+CLASS_HIERARCHY = {
+    "parts": {
+        "Footwear": ["Left-shoe", "Right-shoe"],
+        "Legs": ["Left-leg", "Right-leg"],
+        "Arms": ["Left-arm", "Right-arm"]
+    },
+    "families": {
+        "Garments": ["Upper-clothes", "Skirt", "Pants", "Dress"],
+        "Footwear": ["Left-shoe", "Right-shoe"],
+        "Legs": ["Left-leg", "Right-leg"],
+        "Arms": ["Left-arm", "Right-arm"],
+        "Skin": ["Face"],
+        "Hair": ["Hair"],
+        "Accessories": ["Hat", "Sunglasses", "Belt", "Bag", "Scarf"]
+    }
+}
+CONFUSION_TOP_PAIRS = 10  # Nombre de paires de confusion les plus fréquentes rapportées par niveau
+
+# Index de présence des classes (un entier de 18 bits par masque, stocké dans le répertoire des masques)
+PRESENCE_INDEX_FILE = "presence_index.npz"
+
+# Concurrence adaptative (AIMD) et disjoncteur pour l'API de segmentation
+ADAPTIVE_INITIAL_CONCURRENCY = 2   # Requêtes simultanées au démarrage
+ADAPTIVE_MIN_CONCURRENCY = 1
+ADAPTIVE_MAX_CONCURRENCY = 16
+ADAPTIVE_DECREASE_FACTOR = 0.5     # Diminution multiplicative sur 429 / 503 / timeout / latence excessive
+ADAPTIVE_LATENCY_TARGET = 15.0     # Latence (s) au-delà de laquelle une réponse compte comme congestion
+ADAPTIVE_ERROR_WINDOW = 50         # Nombre de réponses récentes pour le taux d'erreur affiché
+ADAPTIVE_MAX_RETRIES = 3           # Nouvelles tentatives d'une image après une erreur transitoire
+BREAKER_FAILURE_THRESHOLD = 5      # Échecs consécutifs avant ouverture du disjoncteur
+BREAKER_COOLDOWN = 30.0            # Durée (s) d'ouverture avant une requête de test (semi-ouvert)
+BREAKER_MAX_TRIPS = 5              # Ouvertures consécutives sans rétablissement avant abandon du lot
+
+# Exécution du pipeline par étapes avec cache entre les exécutions
+PIPELINE_CACHE_FILE = ".pipeline_cache.json"
+PIPELINE_WORKERS = 2  # Étapes indépendantes exécutées en parallèle
+
+# Manifeste du jeu de données (SQLite) : chemins, dimensions, empreintes et statut par image
+MANIFEST_DB = "content/top_influenceurs_2024/manifest.sqlite"
+
+# Exécution par shards (plusieurs machines) et fusion des résultats partiels
+SHARD_OUTPUT_DIR = "shards"
+
+# Écriture asynchrone des sorties (masques, copies d'images, visuels)
+WRITER_WORKERS = 4             # Threads d'encodage et d'écriture
+WRITER_MAX_PENDING_MB = 256    # Volume en attente au-delà duquel les producteurs sont bloqués (contre-pression)
+
+# Profilage mémoire (--memory-profile) : pic RSS et sites d'allocation tracemalloc par étape
+MEMORY_PROFILE_REPORT = "reports/memory_profile_report.json"
+MEMORY_PROFILE_TOP_SITES = 10            # Sites d'allocation rapportés par étape
+MEMORY_PROFILE_SAMPLE_INTERVAL = 0.005   # Période (s) d'échantillonnage du RSS
+
+# Vidéos et séquences d'images : échantillonnage et réutilisation temporelle des masques
+VIDEO_DIR = "content/top_influenceurs_2024/VIDEO"
+VIDEO_OUTPUTS_DIR = "content/top_influenceurs_2024/Output_Video"  # Un sous-répertoire IMG / Mask / Real_Results par vidéo
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.webm')
+VIDEO_SAMPLE_FPS = 2.0           # Images échantillonnées par seconde de vidéo
+VIDEO_SEQUENCE_FPS = 25.0        # Cadence supposée des séquences d'images (répertoires de frames)
+VIDEO_STATIC_THRESHOLD = 6.0     # Écart absolu moyen (0-255, vignette en niveaux de gris) en dessous duquel une image est quasi statique
+VIDEO_MAX_REUSE = 10             # Images consécutives au plus sans nouvel appel API
+VIDEO_DIFF_WIDTH = 64            # Largeur de la vignette de comparaison
+
+# Lecture en flux des images depuis des archives zip / tar (sans extraction)
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# Recherche de tenues similaires : descripteurs issus des masques et index de similarité
+SIMILARITY_INDEX_FILE = "similarity_index.npz"  # Sauvegardé dans le répertoire des masques
+SIMILARITY_GRID_SIZE = 4                 # Grille G x G de disposition des classes (boîte englobante de la silhouette)
+SIMILARITY_COLOR_BINS = (2, 3, 3)        # Histogramme Lab (L, a, b) par vêtement de COLOR_ANALYSIS_CLASSES
+SIMILARITY_BLOCK_WEIGHTS = {'area': 1.0, 'layout': 1.0, 'color': 1.0}  # Poids des blocs dans la similarité cosinus
+SIMILARITY_MAX_SCAN_PIXELS = 250_000     # Pixels max parcourus par image (sous-échantillonnage régulier au-delà)
+SIMILARITY_TOP_K = 10                    # Nombre de tenues similaires retournées
+SIMILARITY_MAX_SCORE_CELLS = 20_000_000  # Taille max de la matrice de scores (requêtes x images) calculée en une fois
+SIMILARITY_IVF_MIN_VECTORS = 100_000     # Index IVF (quantification grossière) construit automatiquement au-delà
+SIMILARITY_IVF_LISTS_FACTOR = 4          # Nombre de listes IVF = facteur x sqrt(nombre d'images)
+SIMILARITY_IVF_TRAIN_PER_LIST = 64       # Descripteurs tirés par liste pour l'apprentissage des centroïdes
+SIMILARITY_IVF_ITERATIONS = 20           # Itérations max du k-means sphérique
+SIMILARITY_IVF_NPROBE = 8                # Listes parcourues par requête
+
+# Évaluation par instances (composantes connexes) des petites classes d'accessoires
+INSTANCE_CLASSES = ["Hat", "Sunglasses", "Belt", "Left-shoe", "Right-shoe", "Bag", "Scarf"]
+INSTANCE_IOU_THRESHOLD = 0.5   # IoU minimale pour apparier une instance prédite à une instance GT
+INSTANCE_MIN_AREA = 20         # Composantes plus petites ignorées (pixels isolés, bruit de segmentation)
+INSTANCE_CONNECTIVITY = 8      # Connexité des composantes (4 ou 8)
+
+# Évaluation approchée (--approx) : masques sous-échantillonnés et bornes d'erreur calibrées
+APPROX_METHOD = "stride"                  # "stride" (un pixel sur f, vue sans copie) ou "resize" (plus proche voisin au centre des blocs)
+APPROX_CALIBRATION_FACTORS = (2, 4, 8)    # Facteurs calibrés par --calibrate-approx
+APPROX_CALIBRATION_IMAGES = 50            # Images tirées pour la calibration (exact vs approché sur les mêmes masques)
+APPROX_CALIBRATION_REPORT = "reports/approx_calibration.json"
+APPROX_BOUND_Z = 1.96                     # Quantile normal de la borne d'erreur (95 %)
+
+# Pyramide de vignettes des visuels de résultats (Real_Results, Expected_Results)
+RESULT_PYRAMID_WIDTHS = (256, 1024)   # Largeurs totales (3 panneaux) des niveaux, rangés dans <sortie>/w<largeur>/
+RESULT_PYRAMID_FORMAT = "webp"        # "webp" ou "jpg"
+RESULT_PYRAMID_QUALITY = 80           # Qualité d'encodage des niveaux (0-100)
+RESULT_FULL_RESOLUTION = True         # Écrit aussi le visuel PNG pleine résolution (result_N.png)
+RESULT_LEGEND_MIN_HEIGHT = 768        # Niveaux moins hauts rendus sans légende (elle en couvrirait l'essentiel)
+REPORT_IMAGE_WIDTH = 1024             # Largeur minimale des visuels copiés dans le rapport (plus petit niveau suffisant)
+
+# Service de requêtes local (--serve) sur les résultats d'évaluation, les index de présence et les masques
+SERVE_HOST = "127.0.0.1"
+SERVE_PORT = 8800
+SERVE_RELOAD_INTERVAL = 5.0           # Secondes entre deux vérifications des nouveaux résultats (0 : rechargement manuel via POST /reload)
+SERVE_PAGE_SIZE = 100                 # Images retournées par défaut par /images
+SERVE_MAX_PAGE_SIZE = 5000            # Limite de /images et de /ranking par requête
+SERVE_TILE_WIDTHS = (128, 256, 512, 1024)  # Largeurs servies (la largeur demandée est arrondie au niveau supérieur)
+SERVE_TILE_CACHE_MB = 256             # Taille max du cache LRU des tuiles encodées
+SERVE_TILE_MAX_AGE = 3600             # Cache-Control des tuiles (secondes ; l'ETag change avec le masque)
@@ -0,0 +1,103 @@
+import numpy as np
+from .utils import get_logger
+from .config import CLASS_MAPPING, CLASS_HIERARCHY, CONFUSION_TOP_PAIRS
+
+logger = get_logger(__name__, 'report.log')
+
+CLASS_NAMES = list(CLASS_MAPPING.keys())
+
+
+def accumulate_confusion(per_image_confusions):
+    """Somme des matrices de confusion par image en une matrice (18, 18) du jeu de données"""
+    total = np.zeros((len(CLASS_NAMES), len(CLASS_NAMES)), dtype=np.int64)
+    for confusion in per_image_confusions:
+        total += np.asarray(confusion, dtype=np.int64)
+    return total
+
+
+def folding_matrix(groups):
+    """
+    Matrice d'appartenance (18, G) d'un niveau de la hiérarchie : chaque classe est rattachée à
+    son groupe, les classes non listées restent seules (Background reste toujours le groupe 0).
+
+    Returns:
+        tuple: (matrice d'appartenance, noms des groupes)
+    """
+    group_of = {class_name: group for group, members in groups.items() for class_name in members}
+    names = []
+    for class_name in CLASS_NAMES:
+        name = group_of.get(class_name, class_name)
+        if name not in names:
+            names.append(name)
+    membership = np.zeros((len(CLASS_NAMES), len(names)), dtype=np.int64)
+    for i, class_name in enumerate(CLASS_NAMES):
+        membership[i, names.index(group_of.get(class_name, class_name))] = 1
+    return membership, names
+
+
+def fold_confusion(confusion, membership):
+    """Replie lignes et colonnes de la matrice de confusion sur les groupes : M.T @ C @ M"""
+    return membership.T @ confusion @ membership
+
+
+def level_metrics(confusion, names, top_k=CONFUSION_TOP_PAIRS):
+    """
+    Pixel Accuracy, IoU par groupe et principales confusions d'une matrice (repliée ou non).
+    Mêmes conventions que evaluate_pair_from_confusion : les pixels Background du GT sont exclus.
+    """
+    scored = confusion[1:, :]  # Lignes GT hors Background
+    diagonal = np.diag(confusion)
+    true_counts = confusion.sum(axis=1)
+    pred_counts = scored.sum(axis=0)
+    total = scored.sum()
+
+    group_iou = {}
+    for i, name in enumerate(names):
+        if i == 0 or true_counts[i] == 0:
+            continue
+        group_iou[name] = float(diagonal[i] / (true_counts[i] + pred_counts[i] - diagonal[i]))
+
+    off_diagonal = scored.astype(np.float64).copy()
+    off_diagonal[np.arange(len(names) - 1), np.arange(1, len(names))] = 0
+    order = np.argsort(off_diagonal, axis=None)[::-1][:top_k]
+    top_pairs = []
+    for flat in order:
+        row, col = np.unravel_index(flat, off_diagonal.shape)
+        pixels = int(off_diagonal[row, col])
+        if pixels == 0:
+            break
+        top_pairs.append({
+            'true': names[row + 1],
+            'pred': names[col],
+            'pixels': pixels,
+            'rate': pixels / int(true_counts[row + 1])  # Part des pixels GT de la classe
+        })
+    return {
+        'accuracy': float(diagonal[1:].sum() / total * 100) if total else None,
+        'group_iou': group_iou,
+        'top_confusions': top_pairs
+    }
+
+
+def analyze_confusion(confusion, hierarchy=CLASS_HIERARCHY, top_k=CONFUSION_TOP_PAIRS):
+    """
+    Analyse de confusion à tous les niveaux de la hiérarchie à partir de la seule matrice
+    du jeu de données (aucune réévaluation des masques).
+
+    Returns:
+        dict: {'matrix', 'class_names', 'levels': {niveau: métriques}}
+    """
+    confusion = np.asarray(confusion, dtype=np.int64)
+    levels = {'classes': level_metrics(confusion, CLASS_NAMES, top_k)}
+    for level, groups in hierarchy.items():
+        membership, names = folding_matrix(groups)
+        levels[level] = level_metrics(fold_confusion(confusion, membership), names, top_k)
+        levels[level]['groups'] = names
+    for level, metrics in levels.items():
+        if metrics['accuracy'] is not None:
+            logger.info(f"Accuracy hiérarchique ({level}) : {metrics['accuracy']:.2f}%")
+    return {
+        'matrix': confusion.tolist(),
+        'class_names': CLASS_NAMES,
+        'levels': levels
+    }
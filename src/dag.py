@@ -0,0 +1,198 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import inspect
+import json
+import os
+from .utils import get_logger
+from .config import PIPELINE_CACHE_FILE, PIPELINE_WORKERS
+
+logger = get_logger(__name__, __name__ + ".log")
+
+
+class Stage:
+    """
+    Étape du pipeline.
+
+    Args:
+        name (str): Identifiant de l'étape.
+        run (callable): Fonction sans argument exécutant l'étape.
+        inputs (list): Fichiers ou répertoires lus par l'étape (hachés par contenu) ; un tuple
+            (répertoire, extensions) restreint l'empreinte aux fichiers portant ces extensions.
+        outputs (list): Fichiers ou répertoires produits (l'étape est rejouée s'ils manquent).
+        deps (list): Étapes à exécuter avant celle-ci.
+        code (list): Fonctions ou modules dont le code source fait partie de la version de l'étape.
+        params (dict): Paramètres influençant le résultat (ex. options de la ligne de commande).
+    """
+
+    def __init__(self, name, run, inputs=(), outputs=(), deps=(), code=(), params=None):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+        self.code = list(code)
+        self.params = params or {}
+
+    def code_version(self):
+        digest = hashlib.blake2b(digest_size=16)
+        for obj in self.code:
+            digest.update(inspect.getsource(obj).encode('utf-8'))
+        digest.update(json.dumps(self.params, sort_keys=True, default=str).encode('utf-8'))
+        return digest.hexdigest()
+
+
+class FileHasher:
+    """
+    Empreintes de contenu des fichiers, mémorisées par (taille, date de modification) :
+    un fichier inchangé depuis l'exécution précédente n'est pas relu.
+    """
+
+    def __init__(self, known=None):
+        self.known = known or {}
+
+    def file_digest(self, path):
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        cached = self.known.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        self.known[path] = [signature, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def digest(self, path, suffixes=None):
+        """Empreinte d'un fichier, d'un répertoire (récursif, ordre trié) ou d'un chemin absent"""
+        if os.path.isfile(path):
+            return self.file_digest(path)
+        if not os.path.isdir(path):
+            return "absent"
+        digest = hashlib.blake2b(digest_size=16)
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if suffixes and not name.endswith(tuple(suffixes)):
+                    continue
+                file_path = os.path.join(root, name)
+                digest.update(os.path.relpath(file_path, path).encode('utf-8'))
+                digest.update(self.file_digest(file_path).encode('ascii'))
+        return digest.hexdigest()
+
+
+def topological_levels(stages):
+    """Regroupe les étapes en niveaux : les étapes d'un même niveau sont indépendantes"""
+    by_name = {stage.name: stage for stage in stages}
+    depth = {}
+
+    def level_of(name, visiting=()):
+        if name in depth:
+            return depth[name]
+        if name in visiting:
+            raise ValueError(f"Dépendance circulaire autour de l'étape '{name}'")
+        deps = [d for d in by_name[name].deps if d in by_name]
+        depth[name] = 1 + max((level_of(d, visiting + (name,)) for d in deps), default=-1)
+        return depth[name]
+
+    for stage in stages:
+        level_of(stage.name)
+    levels = [[] for _ in range(max(depth.values(), default=-1) + 1)]
+    for stage in stages:
+        levels[depth[stage.name]].append(stage)
+    return levels
+
+
+class Pipeline:
+    """
+    Exécute des étapes en respectant leurs dépendances. Une étape est sautée lorsque
+    l'empreinte de ses entrées, la version de son code et ses paramètres sont identiques
+    à ceux de sa dernière exécution réussie et que ses sorties existent toujours.
+    Les étapes indépendantes (même niveau) sont exécutées en parallèle.
+    """
+
+    def __init__(self, stages, cache_file=PIPELINE_CACHE_FILE, max_workers=PIPELINE_WORKERS):
+        self.stages = stages
+        self.cache_file = cache_file
+        self.max_workers = max_workers
+        self.cache = {'stages': {}, 'files': {}}
+        if os.path.exists(cache_file):
+            with open(cache_file, 'r') as f:
+                self.cache = json.load(f)
+        self.hasher = FileHasher(self.cache.get('files'))
+
+    def stage_key(self, stage):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(stage.code_version().encode('ascii'))
+        for item in stage.inputs:
+            path, suffixes = item if isinstance(item, tuple) else (item, None)
+            digest.update(path.encode('utf-8'))
+            digest.update(self.hasher.digest(path, suffixes).encode('ascii'))
+        return digest.hexdigest()
+
+    def status(self, stage, force=()):
+        """Retourne (à rejouer ?, raison, empreinte)"""
+        if stage.name in force:
+            return True, "forcée", None
+        missing = [path for path in stage.outputs if not os.path.exists(path)]
+        key = self.stage_key(stage)
+        previous = self.cache['stages'].get(stage.name)
+        if previous is None:
+            return True, "jamais exécutée", key
+        if missing:
+            return True, f"sortie manquante : {missing[0]}", key
+        if previous.get('code') != stage.code_version():
+            return True, "code ou paramètres modifiés", key
+        if previous.get('key') != key:
+            return True, "entrées modifiées", key
+        return False, "à jour", key
+
+    def plan(self, force=()):
+        """
+        Vue « dry-run » : ce qui serait recalculé. Une étape dont une dépendance serait
+        rejouée est considérée comme à rejouer, ses entrées ne pouvant pas être connues d'avance.
+        """
+        plan, rerun = [], set()
+        for level in topological_levels(self.stages):
+            for stage in level:
+                upstream = [d for d in stage.deps if d in rerun]
+                if upstream:
+                    needed, reason = True, f"dépend de {', '.join(upstream)}"
+                else:
+                    needed, reason, _ = self.status(stage, force)
+                if needed:
+                    rerun.add(stage.name)
+                plan.append((stage.name, needed, reason))
+        return plan
+
+    def print_plan(self, force=()):
+        print("\nPlan d'exécution :")
+        for name, needed, reason in self.plan(force):
+            print(f"  {'▶ recalculée' if needed else '✓ en cache  '}  {name:<20} {reason}")
+
+    def run(self, force=()):
+        """Exécute le pipeline ; retourne la liste des étapes effectivement rejouées"""
+        executed = []
+        for level in topological_levels(self.stages):
+            todo = []
+            for stage in level:
+                needed, reason, _ = self.status(stage, force)
+                if needed:
+                    todo.append(stage)
+                    print(f"Étape '{stage.name}' : {reason}")
+                else:
+                    print(f"Étape '{stage.name}' : à jour, ignorée")
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(todo)))) as executor:
+                for stage, future in [(stage, executor.submit(stage.run)) for stage in todo]:
+                    future.result()  # Propage l'erreur éventuelle : le cache de l'étape n'est pas mis à jour
+                    # Empreinte des entrées telles que l'étape les a lues (les sorties amont sont terminées)
+                    self.cache['stages'][stage.name] = {'key': self.stage_key(stage), 'code': stage.code_version()}
+                    executed.append(stage.name)
+                    logger.info(f"Étape '{stage.name}' exécutée")
+            self.save()
+        return executed
+
+    def save(self):
+        self.cache['files'] = self.hasher.known
+        with open(self.cache_file, 'w') as f:
+            json.dump(self.cache, f)
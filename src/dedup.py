@@ -0,0 +1,141 @@
+import json
+import os
+import numpy as np
+import cv2
+from tqdm import tqdm
+from .utils import get_logger
+from .config import DEDUP_HASH, DEDUP_MAX_DISTANCE
+
+logger = get_logger(__name__, __name__ + ".log")
+
+
+def load_gray_for_hash(img_path):
+    """
+    Charge une image en niveaux de gris pour le hachage. Le décodage JPEG réduit (1/4)
+    suffit largement pour un hash 8x8 et évite de décoder les images en pleine résolution.
+    """
+    gray = cv2.imread(img_path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if gray is None:
+        gray = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise FileNotFoundError(f"Impossible de lire l'image '{img_path}'")
+    return gray
+
+
+def _bits_to_int(bits):
+    """Convertit un tableau de 64 booléens en entier"""
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+def dhash(gray, hash_size=8):
+    """
+    Difference hash : signe du gradient horizontal sur une vignette (hash_size+1) x hash_size.
+    """
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    return _bits_to_int(small[:, 1:] > small[:, :-1])
+
+
+def phash(gray, hash_size=8, highfreq_factor=4):
+    """
+    Perceptual hash : coefficients basse fréquence de la DCT d'une vignette 32x32,
+    comparés à leur médiane.
+    """
+    size = hash_size * highfreq_factor
+    small = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_freq = cv2.dct(small)[:hash_size, :hash_size]
+    return _bits_to_int(low_freq > np.median(low_freq))
+
+
+def hamming_distance(hash_a, hash_b):
+    return (hash_a ^ hash_b).bit_count()
+
+
+class BKTree:
+    """
+    BK-tree sur la distance de Hamming : une recherche dans un rayon r n'explore que les
+    sous-arbres dont la distance à la racine est dans [d - r, d + r] (inégalité triangulaire),
+    ce qui évite la comparaison de toutes les paires d'images.
+    """
+
+    def __init__(self):
+        self.root = None  # (hash, item, {distance: noeud})
+        self.size = 0
+
+    def add(self, hash_value, item):
+        node = (hash_value, item, {})
+        self.size += 1
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = hamming_distance(hash_value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, hash_value, radius):
+        """Retourne [(distance, item)] des éléments à une distance <= radius, triés par distance"""
+        matches = []
+        candidates = [self.root] if self.root is not None else []
+        while candidates:
+            node_hash, item, children = candidates.pop()
+            distance = hamming_distance(hash_value, node_hash)
+            if distance <= radius:
+                matches.append((distance, item))
+            for child_distance, child in children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    candidates.append(child)
+        return sorted(matches, key=lambda m: m[0])
+
+
+def compute_image_hash(img_path, hash_type=DEDUP_HASH):
+    gray = load_gray_for_hash(img_path)
+    return phash(gray) if hash_type == "phash" else dhash(gray)
+
+
+def find_near_duplicates(image_paths, max_distance=DEDUP_MAX_DISTANCE, hash_type=DEDUP_HASH):
+    """
+    Regroupe les quasi-doublons d'une liste d'images.
+
+    La première image rencontrée d'un groupe devient l'image canonique ; chaque image suivante
+    à une distance de Hamming <= max_distance d'une image canonique y est rattachée.
+
+    Returns:
+        dict: {chemin du doublon: (chemin canonique, distance)}
+    """
+    tree = BKTree()
+    duplicates = {}
+    for img_path in tqdm(image_paths, desc="Hachage perceptuel des images"):
+        try:
+            hash_value = compute_image_hash(img_path, hash_type)
+        except FileNotFoundError as e:
+            logger.warning(str(e))
+            continue
+        matches = tree.search(hash_value, max_distance)
+        if matches:
+            distance, canonical = matches[0]
+            duplicates[img_path] = (canonical, distance)
+            logger.info(f"Quasi-doublon : {os.path.basename(img_path)} -> {os.path.basename(canonical)} (distance {distance})")
+        else:
+            tree.add(hash_value, img_path)
+    print(f"{len(duplicates)} quasi-doublon(s) détecté(s) parmi {len(image_paths)} image(s)")
+    return duplicates
+
+
+def save_dedup_report(duplicates, reused, total, output_path):
+    """Sauvegarde la correspondance doublon -> canonique et le nombre d'appels API évités"""
+    report = {
+        'total_images': total,
+        'near_duplicates': len(duplicates),
+        'api_calls_avoided': reused,
+        'duplicates': {
+            os.path.basename(path): {'canonical': os.path.basename(canonical), 'distance': distance}
+            for path, (canonical, distance) in duplicates.items()
+        }
+    }
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=4)
+    return report
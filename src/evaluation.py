@@ -1,24 +1,37 @@
-from .config import EXPECTED_SEGMENTATION_OUTPUTS_DIR, IMG_DIR, MASK_DIR
-from .utils import save_results, get_logger
+from .config import EXPECTED_SEGMENTATION_OUTPUTS_DIR, IMG_DIR, MASK_DIR, GT_RLE_DIR
+from .utils import (save_results, get_logger, memory_stage, track_memory, load_mask_rle, rle_path_for, get_class_rle,
+                    rle_area, rle_intersection_area, decode_label_map_rle, convert_mask_dir_to_rle, tile_rows_for,
+                    iter_row_tiles, load_mask, load_mask_reduced)
 import os
 from sklearn.metrics import jaccard_score
 import numpy as np
-import cv2
-from .config import CLASS_MAPPING
+from .config import CLASS_MAPPING, RLE_EXTENSION, APPROX_METHOD, SHM_DECODE_WORKERS
+from .manifest import open_manifest
+from .sharding import in_shard
+from .writer import OutputWriter
+from .instances import instance_counts
 
 
 logger = get_logger(__name__, __name__ + ".log")
 
 
-def save_visual_expected_result():
+def save_visual_expected_result(tiled=False, compute_workers=0, decode_workers=SHM_DECODE_WORKERS):
     """
     Sauvegarde des images avec overlay mask attendus. A faire qu'une seule fois pour tout un jeu de donnée avec mask de segmentation déjà fourni.
+    Avec compute_workers > 0, le rendu est fait en parallèle (voir shm_pipeline.save_results_parallel).
     """
     print("\nSauvegarde des images attendus ..")
     # Verifier si EXPECTED_SEGMENTATION_OUTPUTS_DIR existe est déjà remplie
     if not os.path.exists(EXPECTED_SEGMENTATION_OUTPUTS_DIR) or not os.listdir(EXPECTED_SEGMENTATION_OUTPUTS_DIR):
+        if compute_workers > 0:
+            # Import local : shm_pipeline importe ce module
+            from .shm_pipeline import save_results_parallel
+            save_results_parallel(IMG_DIR, MASK_DIR, EXPECTED_SEGMENTATION_OUTPUTS_DIR, tiled=tiled,
+                                  decode_workers=decode_workers, compute_workers=compute_workers)
+            return
         # Sauvegarde d'image comparative des résultats attendus
-        save_results(IMG_DIR, MASK_DIR, EXPECTED_SEGMENTATION_OUTPUTS_DIR)
+        with OutputWriter() as writer:
+            save_results(IMG_DIR, MASK_DIR, EXPECTED_SEGMENTATION_OUTPUTS_DIR, tiled=tiled, writer=writer)
 
 
 """ 
@@ -45,15 +58,16 @@ VALIDATION_METRICS = ["Cross_validation_IoU", "Inference_Time", "Hierarchical_ac
 MASK_PRED_DIR = "content/top_influenceurs_2024/Output_API/Mask"
 MASK_TRUE_DIR = "content/top_influenceurs_2024/Mask"
 
+@track_memory
 def get_y_from_mask(mask_path):
     """
     Charge un masque de segmentation et retourne un tableau y
     """
-    # Verification si le fichier existe
-    if not os.path.exists(mask_path):
+    # Verification si le fichier existe (PNG, ou seulement RLE avec --mask-format rle)
+    if not os.path.exists(mask_path) and not os.path.exists(rle_path_for(mask_path)):
         raise FileNotFoundError(f"Le fichier de masque '{mask_path}' est introuvable.")
     # Chargement du masque
-    mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+    mask = load_mask(mask_path)
     if mask is None:
         raise FileNotFoundError(f"Le masque '{mask_path}' est introuvable ou illisible.")
     # Verification la plage de valeurs du masque    
@@ -64,6 +78,27 @@ def get_y_from_mask(mask_path):
     return mask
 
 
+@track_memory
+def get_y_from_mask_reduced(mask_path, factor, method=APPROX_METHOD):
+    """
+    Charge un masque directement réduit d'un facteur `factor` pour l'évaluation approchée (voir load_mask_reduced) :
+    aucune carte de labels pleine résolution n'est gardée et la vérification des labels ne porte que sur les
+    pixels conservés.
+
+    Returns:
+        tuple: (masque réduit, nombre de pixels en pleine résolution)
+    """
+    if not os.path.exists(mask_path) and not os.path.exists(rle_path_for(mask_path)):
+        raise FileNotFoundError(f"Le fichier de masque '{mask_path}' est introuvable.")
+    loaded = load_mask_reduced(mask_path, factor, method)
+    if loaded is None:
+        raise FileNotFoundError(f"Le masque '{mask_path}' est introuvable ou illisible.")
+    mask, (height, width) = loaded
+    if mask.size and mask.max() >= len(CLASS_MAPPING):
+        raise ValueError(f"Le masque '{mask_path}' contient des valeurs hors de la plage attendue (0-{len(CLASS_MAPPING)-1}).")
+    return mask, height * width
+
+
 def calculate_mean_iou(y_true, y_pred):
     """
     Calcule Mean IoU entre masques ground truth et prédits
@@ -198,26 +233,201 @@ def calculate_pixel_accuracy(y_true, y_pred):
         raise ValueError("les dimensions du mask prédit et GT ne sont pas égal")
 
 
+def calculate_mean_iou_from_counts(true_counts, pred_counts, intersections):
+    """
+    Calcule le Mean IoU à partir de comptages de pixels par classe, avec la même convention
+    que calculate_mean_iou (pixels Background du ground truth exclus).
+
+    Args:
+        true_counts (np.ndarray): Pixels GT de chaque classe (0 pour Background).
+        pred_counts (np.ndarray): Pixels prédits de chaque classe parmi les pixels GT non-Background.
+        intersections (np.ndarray): Pixels correctement prédits de chaque classe.
+    """
+    class_names = list(CLASS_MAPPING.keys())
+    iou_scores = []
+    warning_messages = []
+    for class_id, class_name in enumerate(class_names):
+        true_sum, pred_sum, inter = true_counts[class_id], pred_counts[class_id], intersections[class_id]
+        if true_sum == 0 and pred_sum == 0:
+            iou = 1.0
+        elif true_sum == 0:
+            iou = np.nan
+            logger.warning(f"Classe '{class_name}' absente en ground truth. IoU non défini.")
+        else:
+            iou = inter / (true_sum + pred_sum - inter)
+        iou_scores.append({'class_name': class_name, 'iou': iou})
+        logger.info(f"IoU for {class_name}: {iou:.4f}")
+        if iou < 0.5:
+            warning_messages.append({
+                'class_id': class_id,
+                'mess': f"Faible IoU pour la classe '{class_name}': {iou:.4f}"
+            })
+    mean_iou = np.nanmean([score['iou'] for score in iou_scores])
+    logger.info(f"Mean IoU: {mean_iou:.4f}")
+    return mean_iou, iou_scores, warning_messages
+
+
+def distributions_from_counts(counts, total):
+    """Construit la distribution des classes (format analyze_class_distribution) à partir de comptages"""
+    class_names = list(CLASS_MAPPING.keys())
+    return [
+        {
+            'class_name': class_names[class_id],
+            'class_id': class_id,
+            'count': int(count),
+            'percentage': count / total * 100
+        }
+        for class_id, count in enumerate(counts) if count > 0
+    ]
+
+
+@track_memory
+def compute_confusion_matrix(y_true, y_pred, tiled=False):
+    """
+    Matrice de confusion (classes GT en lignes, classes prédites en colonnes) entre deux masques.
+
+    Avec tiled=True, les masques sont parcourus par bandes de lignes pour borner la mémoire
+    de travail ; le résultat est identique.
+    """
+    if y_true.shape != y_pred.shape:
+        logger.error("les dimensions du mask prédit et GT ne sont pas égal")
+        raise ValueError("les dimensions du mask prédit et GT ne sont pas égal")
+    num_classes = len(CLASS_MAPPING)
+    height = y_true.shape[0]
+    width = y_true.size // max(1, height)
+    # Par pixel : index int64 (8 octets) + temporaire de calcul (8 octets)
+    rows = tile_rows_for(width, bytes_per_pixel=16) if tiled else max(1, height)
+    confusion = np.zeros(num_classes * num_classes, dtype=np.int64)
+    for band in iter_row_tiles(height, rows):
+        flat_index = y_true[band].astype(np.int64).ravel() * num_classes + y_pred[band].ravel()
+        confusion += np.bincount(flat_index, minlength=num_classes * num_classes)
+    return confusion.reshape(num_classes, num_classes)
+
+
+def rescale_confusion(confusion, full_pixels):
+    """
+    Remet une matrice de confusion calculée sur des masques réduits (un pixel sur factor² environ)
+    à l'échelle du nombre de pixels en pleine résolution : les ratios (IoU, Pixel Accuracy,
+    distributions) sont approchés, les comptes restent comparables.
+    """
+    return np.rint(confusion * (full_pixels / max(1, confusion.sum()))).astype(np.int64)
+
+
+def evaluate_pair_from_confusion(confusion):
+    """
+    Calcule Mean IoU, Pixel Accuracy et distributions à partir d'une matrice de confusion,
+    avec les mêmes conventions que calculate_mean_iou / calculate_pixel_accuracy.
+    """
+    total = confusion.sum()
+    true_counts = confusion.sum(axis=1)
+    true_counts[0] = 0  # Pixels Background du GT exclus
+    pred_counts = confusion[1:, :].sum(axis=0)
+    intersections = np.diag(confusion).copy()
+    intersections[0] = 0
+    mean_iou, iou_scores, warning_messages = calculate_mean_iou_from_counts(true_counts, pred_counts, intersections)
+
+    accuracy = intersections.sum() / confusion[1:, :].sum() * 100
+    logger.info(f"La valeur de la metrique Pixel Accuracy est : {accuracy}")
+
+    distributions_GT = distributions_from_counts(confusion.sum(axis=1), total)
+    distributions_Pred = distributions_from_counts(confusion.sum(axis=0), total)
+    return mean_iou, iou_scores, accuracy, distributions_GT, distributions_Pred
+
+
+def evaluate_rle_pair(rle_true, rle_pred):
+    """
+    Calcule Mean IoU, Pixel Accuracy et distributions directement sur les RLE de deux masques,
+    sans reconstruire les masques denses.
+
+    Args:
+        rle_true (dict): RLE du masque ground truth (voir utils.encode_label_map_rle).
+        rle_pred (dict): RLE du masque prédit.
+    """
+    if list(rle_true['size']) != list(rle_pred['size']):
+        logger.error("les dimensions du mask prédit et GT ne sont pas égal")
+        raise ValueError("les dimensions du mask prédit et GT ne sont pas égal")
+    num_classes = len(CLASS_MAPPING)
+    height, width = rle_true['size']
+    gt_background = get_class_rle(rle_true, 0)
+
+    area_true = np.zeros(num_classes, dtype=np.int64)
+    area_pred = np.zeros(num_classes, dtype=np.int64)
+    pred_on_background = np.zeros(num_classes, dtype=np.int64)
+    intersections = np.zeros(num_classes, dtype=np.int64)
+    for class_id in range(num_classes):
+        true_rle = get_class_rle(rle_true, class_id)
+        pred_rle = get_class_rle(rle_pred, class_id)
+        area_true[class_id] = rle_area(true_rle)
+        area_pred[class_id] = rle_area(pred_rle)
+        if area_pred[class_id] == 0:
+            continue
+        pred_on_background[class_id] = rle_intersection_area(pred_rle, gt_background)
+        if class_id != 0 and area_true[class_id] > 0:
+            intersections[class_id] = rle_intersection_area(true_rle, pred_rle)
+
+    # Même convention que calculate_mean_iou : les pixels Background du GT sont exclus
+    true_counts = area_true.copy()
+    true_counts[0] = 0
+    pred_counts = area_pred - pred_on_background
+    mean_iou, iou_scores, warning_messages = calculate_mean_iou_from_counts(true_counts, pred_counts, intersections)
+
+    non_bg_pixels = height * width - area_true[0]
+    accuracy = intersections.sum() / non_bg_pixels * 100
+    logger.info(f"La valeur de la metrique Pixel Accuracy est : {accuracy}")
+
+    distributions_GT = distributions_from_counts(area_true, height * width)
+    distributions_Pred = distributions_from_counts(area_pred, height * width)
+    return mean_iou, iou_scores, accuracy, distributions_GT, distributions_Pred
+
+
+def rle_confusion_matrix(rle_true, rle_pred):
+    """
+    Matrice de confusion (classes GT en lignes, classes prédites en colonnes) calculée sur les RLE :
+    seules les paires de classes présentes dans les deux masques sont intersectées.
+    """
+    num_classes = len(CLASS_MAPPING)
+    confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+    for true_id in rle_true['classes']:
+        true_rle = get_class_rle(rle_true, true_id)
+        for pred_id in rle_pred['classes']:
+            confusion[int(true_id), int(pred_id)] = rle_intersection_area(true_rle, get_class_rle(rle_pred, pred_id))
+    return confusion
+
+
+def check_pairs_found(count, shard=None):
+    """
+    Arrêt explicite si aucune paire de masques n'est à évaluer : un rapport vide ne peut pas être généré.
+    Un shard peut en revanche ne contenir aucune image.
+    """
+    if count == 0 and shard is None:
+        logger.error("Aucun masque prédit avec son masque ground truth à évaluer.")
+        raise FileNotFoundError("Aucun masque prédit avec son masque ground truth à évaluer "
+                                f"(masques prédits attendus dans {MASK_PRED_DIR}).")
+
                 
 def evaluate_single_image():
     """
         Calcule et affiche les métriques pour une seule paire de masques (prédit vs ground truth)
     """
-    # Selectionne un mask predit random
-    random_pred_mask_file = np.random.choice(os.listdir(MASK_PRED_DIR))
-    # random_pred_mask_file = "mask_23.png"
+    # Selectionne un mask predit random parmi ceux qui ont un ground truth (PNG ou seulement RLE)
+    with open_manifest(refresh=False) as manifest:
+        entries = [entry for entry in manifest.entries() if entry['gt_mask_path'] is not None
+                   and (entry['pred_mask_path'] is not None or entry['pred_rle_path'] is not None)]
+    if not entries:
+        raise FileNotFoundError("Aucun masque prédit avec son masque ground truth à évaluer.")
+    entry = entries[np.random.randint(len(entries))]
+    pred_mask_path = entry['pred_mask_path'] or entry['pred_rle_path'][:-len(RLE_EXTENSION)] + ".png"
+    random_pred_mask_file = os.path.basename(pred_mask_path)
     print(f"\nEvaluation du masque prédit: {random_pred_mask_file}")
     logger.info(f"\nEvaluation du masque prédit: {random_pred_mask_file}")
     
-    # Recuperation du mask ground truth correspondant
-    corresponding_true_mask_file = random_pred_mask_file  # Supposons que les noms de fichiers correspondent
-    if not os.path.exists(os.path.join(MASK_TRUE_DIR, corresponding_true_mask_file)):
-        raise FileNotFoundError(f"Le masque ground truth '{corresponding_true_mask_file}' est introuvable.")
+    # Recuperation du mask ground truth correspondant (même identifiant d'image)
+    corresponding_true_mask_file = os.path.basename(entry['gt_mask_path'])
     print(f"Masque ground truth correspondant: {corresponding_true_mask_file}")
     logger.info(f"Masque ground truth correspondant: {corresponding_true_mask_file}")
     
-    y_true = get_y_from_mask(os.path.join(MASK_TRUE_DIR, corresponding_true_mask_file))
-    y_pred = get_y_from_mask(os.path.join(MASK_PRED_DIR, random_pred_mask_file))
+    y_true = get_y_from_mask(entry['gt_mask_path'])
+    y_pred = get_y_from_mask(pred_mask_path)
     
     print("\n==============Mean IoU metrique==============\n")
     logger.info("==============Mean IoU metrique==============")
@@ -237,29 +447,80 @@ def evaluate_single_image():
 
     
                 
-def eval_dataset():
+@memory_stage("eval_dataset")
+def eval_dataset(use_rle=False, tiled=False, shard=None, instances=False, approx_factor=None,
+                 approx_method=APPROX_METHOD):
     """
         Calcule et affiche les métriques pour une seule paire de masques (prédit vs ground truth)
+
+        Si use_rle est vrai, les métriques sont calculées directement sur les fichiers RLE
+        (les RLE ground truth manquants sont générés une fois à partir des PNG).
+        Si tiled est vrai, les métriques sont accumulées bande par bande dans une matrice
+        de confusion (mémoire bornée, résultats identiques).
+        Si shard = (index, nombre), seules les images de ce shard sont évaluées.
+        Si instances est vrai, chaque résultat porte aussi ses comptes d'instances ('instances',
+        voir instance_counts), calculés sur les masques déjà chargés.
+        Si approx_factor > 1, les masques sont lus directement réduits de ce facteur et les métriques
+        calculées sur environ approx_factor² fois moins de pixels (voir get_y_from_mask_reduced et
+        rescale_confusion) ; les bornes
+        d'erreur correspondantes sont données par la calibration (src/approx.py). Le chemin RLE,
+        déjà calculé sur les plages sans décodage, reste exact.
     """
+    if use_rle:
+        if approx_factor:
+            logger.warning("Évaluation approchée ignorée pour les masques RLE (évaluation exacte sur les plages)")
+        return eval_dataset_rle(shard, instances)
     list_metrics_per_img = []
     print("\nEvaluation du jeu de donnée complet...")
     logger.info("\nEvaluation du jeu de donnée complet...")
     
+    # Paires (GT, prédit) du manifeste, masques prédits PNG ou seulement RLE
+    with open_manifest(refresh=False) as manifest:
+        pairs = [pair for pair in manifest.eval_pairs(include_rle=True) if in_shard(pair[0], shard)]
+    check_pairs_found(len(pairs), shard)
     # Pour chaque mask predit
-    for msk in os.listdir(MASK_PRED_DIR):
-        # random_pred_mask_file = "mask_23.png"
+    for image_id, true_mask_path, pred_mask_path in pairs:
+        msk = os.path.basename(pred_mask_path)
         print(f"\nEvaluation du masque prédit: {msk}")
         logger.info(f"\nEvaluation du masque prédit: {msk}")
         
         # Recuperation du mask ground truth correspondant
-        corresponding_true_mask_file = msk  # Supposons que les noms de fichiers correspondent
-        if not os.path.exists(os.path.join(MASK_TRUE_DIR, corresponding_true_mask_file)):
-            raise FileNotFoundError(f"Le masque ground truth '{corresponding_true_mask_file}' est introuvable.")
-        print(f"Masque ground truth correspondant: {corresponding_true_mask_file}")
-        logger.info(f"Masque ground truth correspondant: {corresponding_true_mask_file}")
+        if true_mask_path is None:
+            raise FileNotFoundError(f"Le masque ground truth de l'image {image_id} est introuvable.")
+        print(f"Masque ground truth correspondant: {os.path.basename(true_mask_path)}")
+        logger.info(f"Masque ground truth correspondant: {os.path.basename(true_mask_path)}")
         
-        y_true = get_y_from_mask(os.path.join(MASK_TRUE_DIR, corresponding_true_mask_file))
-        y_pred = get_y_from_mask(os.path.join(MASK_PRED_DIR, msk))
+        approximate = (approx_factor or 1) > 1
+        if approximate:
+            # Masques lus directement à résolution réduite : décodage et calcul portent sur ≈ factor² fois moins de pixels
+            y_true, full_pixels = get_y_from_mask_reduced(true_mask_path, approx_factor, approx_method)
+            y_pred, _ = get_y_from_mask_reduced(pred_mask_path, approx_factor, approx_method)
+        else:
+            y_true = get_y_from_mask(true_mask_path)
+            y_pred = get_y_from_mask(pred_mask_path)
+
+        if tiled or approximate:
+            if approximate:
+                confusion = rescale_confusion(compute_confusion_matrix(y_true, y_pred), full_pixels)
+            else:
+                confusion = compute_confusion_matrix(y_true, y_pred, tiled=True)
+            mean_iou, iou_scores, accuracy, distributions_GT, distributions_Pred = evaluate_pair_from_confusion(confusion)
+            print(f"{msk} - Mean IoU: {mean_iou:.4f} - Pixel Accuracy: {accuracy:.2f}%")
+            list_metrics_per_img.append({
+                'image': msk,
+                'mean_iou': mean_iou,
+                'iou_scores': iou_scores,
+                'accuracy': accuracy,
+                'distributions_GT': distributions_GT,
+                'distributions_Pred': distributions_Pred,
+                'confusion': confusion
+            })
+            if instances:
+                # Les seuils d'aire des instances sont en pixels pleine résolution : masques complets relus
+                list_metrics_per_img[-1]['instances'] = (
+                    instance_counts(get_y_from_mask(true_mask_path), get_y_from_mask(pred_mask_path)) if approximate
+                    else instance_counts(y_true, y_pred))
+            continue
         
         print("\n==============Mean IoU metrique==============\n")
         logger.info("==============Mean IoU metrique==============")
@@ -277,9 +538,56 @@ def eval_dataset():
             'iou_scores': iou_scores,
             'accuracy': accuracy,
             'distributions_GT': distributions_GT,
-            'distributions_Pred': distributions_Pred
+            'distributions_Pred': distributions_Pred,
+            'confusion': compute_confusion_matrix(y_true, y_pred)
         }
+        if instances:
+            per_image_results['instances'] = instance_counts(y_true, y_pred)
         list_metrics_per_img.append(per_image_results)
         
     return list_metrics_per_img
-    
\ No newline at end of file
+    
+
+
+def eval_dataset_rle(shard=None, instances=False):
+    """
+        Evaluation du jeu de donnée complet à partir des masques encodés en RLE
+        (les comptes d'instances demandés décodent les deux masques en carte de labels)
+    """
+    list_metrics_per_img = []
+    print("\nEvaluation du jeu de donnée complet (RLE)...")
+    logger.info("\nEvaluation du jeu de donnée complet (RLE)...")
+    # Cache RLE des masques ground truth hors du jeu annoté (seuls les masques nouveaux ou modifiés sont encodés)
+    written = convert_mask_dir_to_rle(MASK_TRUE_DIR, output_dir=GT_RLE_DIR)
+    if written:
+        print(f"{written} masque(s) ground truth encodé(s) en RLE dans {GT_RLE_DIR}")
+
+    with open_manifest(refresh=False) as manifest:
+        entries = [entry for entry in manifest.entries()
+                   if entry['pred_rle_path'] is not None and in_shard(entry['id'], shard)]
+    check_pairs_found(len(entries), shard)
+    for entry in entries:
+        rle_file = os.path.basename(entry['pred_rle_path'])
+        msk = rle_file[:-len(RLE_EXTENSION)] + ".png"
+        if entry['gt_mask_path'] is None:
+            raise FileNotFoundError(f"Le masque ground truth '{msk}' est introuvable.")
+        logger.info(f"\nEvaluation du masque prédit (RLE): {rle_file}")
+
+        rle_true = load_mask_rle(rle_path_for(os.path.join(GT_RLE_DIR, os.path.basename(entry['gt_mask_path']))))
+        rle_pred = load_mask_rle(entry['pred_rle_path'])
+        mean_iou, iou_scores, accuracy, distributions_GT, distributions_Pred = evaluate_rle_pair(rle_true, rle_pred)
+        print(f"{msk} - Mean IoU: {mean_iou:.4f} - Pixel Accuracy: {accuracy:.2f}%")
+        list_metrics_per_img.append({
+            'image': msk,
+            'mean_iou': mean_iou,
+            'iou_scores': iou_scores,
+            'accuracy': accuracy,
+            'distributions_GT': distributions_GT,
+            'distributions_Pred': distributions_Pred,
+            'confusion': rle_confusion_matrix(rle_true, rle_pred)
+        })
+        if instances:
+            list_metrics_per_img[-1]['instances'] = instance_counts(decode_label_map_rle(rle_true),
+                                                                    decode_label_map_rle(rle_pred))
+
+    return list_metrics_per_img
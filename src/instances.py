@@ -0,0 +1,179 @@
+import numpy as np
+import cv2
+from .utils import get_logger, track_memory
+from .config import (CLASS_MAPPING, INSTANCE_CLASSES, INSTANCE_IOU_THRESHOLD, INSTANCE_MIN_AREA,
+                     INSTANCE_CONNECTIVITY)
+
+logger = get_logger(__name__, 'report.log')
+
+CLASS_NAMES = list(CLASS_MAPPING.keys())
+
+# Colonnes de la matrice par image (18, 4) : instances GT, prédites, appariées, somme des IoU appariées
+GT, PRED, MATCHED, IOU_SUM = range(4)
+
+
+def class_bounding_boxes(label_map, class_ids):
+    """
+    Boîtes englobantes de toutes les classes demandées en un seul parcours du masque.
+
+    Returns:
+        dict: {class_id: (y0, y1, x0, x1)} pour les classes présentes.
+    """
+    selected = np.zeros(len(CLASS_MAPPING), dtype=bool)
+    selected[list(class_ids)] = True
+    ys, xs = np.nonzero(selected[label_map])
+    if len(ys) == 0:
+        return {}
+    labels = label_map[ys, xs]
+    order = np.argsort(labels, kind='stable')
+    labels, ys, xs = labels[order], ys[order], xs[order]
+    present, starts = np.unique(labels, return_index=True)
+    y0, y1 = np.minimum.reduceat(ys, starts), np.maximum.reduceat(ys, starts) + 1
+    x0, x1 = np.minimum.reduceat(xs, starts), np.maximum.reduceat(xs, starts) + 1
+    return {int(c): (int(a), int(b), int(d), int(e)) for c, a, b, d, e in zip(present, y0, y1, x0, x1)}
+
+
+def class_components(label_map, class_ids=None, min_area=INSTANCE_MIN_AREA, connectivity=INSTANCE_CONNECTIVITY):
+    """
+    Composantes connexes de chaque classe d'un masque.
+
+    Les boîtes englobantes de toutes les classes sont obtenues en un parcours, puis
+    cv2.connectedComponentsWithStats ne traite que la boîte de chaque classe présente
+    (quelques pourcents de l'image pour les accessoires). Les classes sont séparées : deux
+    chaussures gauche/droite qui se touchent restent deux instances.
+
+    Returns:
+        dict: {class_id: (étiquettes des composantes dans la boîte (0 = rien), boîte, aires (k,))}
+    """
+    class_ids = class_ids if class_ids is not None else [CLASS_MAPPING[name] for name in INSTANCE_CLASSES]
+    components = {}
+    for class_id, box in class_bounding_boxes(label_map, class_ids).items():
+        y0, y1, x0, x1 = box
+        binary = (label_map[y0:y1, x0:x1] == class_id).view(np.uint8)
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=connectivity)
+        areas = stats[1:, cv2.CC_STAT_AREA]
+        keep = areas >= min_area
+        if not keep.any():
+            continue
+        if not keep.all():  # Renumérotation sans les composantes trop petites
+            relabel = np.zeros(count, dtype=np.int32)
+            relabel[1:][keep] = np.arange(1, keep.sum() + 1)
+            labels = relabel[labels]
+        components[class_id] = (labels, box, areas[keep].astype(np.int64))
+    return components
+
+
+def pairwise_iou(true_component, pred_component):
+    """
+    IoU de toutes les paires (instance GT, instance prédite) d'une classe : les intersections
+    sont comptées par un unique bincount sur l'intersection des deux boîtes.
+
+    Returns:
+        np.ndarray: Matrice (k_true, k_pred).
+    """
+    true_labels, (ty0, ty1, tx0, tx1), true_areas = true_component
+    pred_labels, (py0, py1, px0, px1), pred_areas = pred_component
+    n_true, n_pred = len(true_areas), len(pred_areas)
+    intersections = np.zeros((n_true, n_pred), dtype=np.int64)
+    y0, y1, x0, x1 = max(ty0, py0), min(ty1, py1), max(tx0, px0), min(tx1, px1)
+    if y0 < y1 and x0 < x1:
+        t = true_labels[y0 - ty0:y1 - ty0, x0 - tx0:x1 - tx0].astype(np.int64)
+        p = pred_labels[y0 - py0:y1 - py0, x0 - px0:x1 - px0].astype(np.int64)
+        joint = np.bincount((t * (n_pred + 1) + p).ravel(), minlength=(n_true + 1) * (n_pred + 1))
+        intersections = joint.reshape(n_true + 1, n_pred + 1)[1:, 1:]
+    unions = true_areas[:, None] + pred_areas[None, :] - intersections
+    return intersections / unions
+
+
+def greedy_match(iou, threshold=INSTANCE_IOU_THRESHOLD):
+    """
+    Appariement glouton par IoU décroissante (convention COCO) : chaque instance est appariée
+    au plus une fois, et seulement au-dessus du seuil.
+
+    Returns:
+        np.ndarray: IoU des paires retenues.
+    """
+    rows, cols = np.nonzero(iou >= threshold)
+    order = np.argsort(-iou[rows, cols], kind='stable')
+    used_rows, used_cols, matched = set(), set(), []
+    for r, c in zip(rows[order], cols[order]):
+        if r in used_rows or c in used_cols:
+            continue
+        used_rows.add(r)
+        used_cols.add(c)
+        matched.append(iou[r, c])
+    return np.array(matched, dtype=np.float64)
+
+
+@track_memory
+def instance_counts(y_true, y_pred, class_ids=None, threshold=INSTANCE_IOU_THRESHOLD):
+    """
+    Évaluation par instances d'une paire de masques.
+
+    Returns:
+        np.ndarray: Matrice (18, 4) : par classe, instances GT, instances prédites, instances
+        appariées et somme de leurs IoU (lignes nulles pour les classes non évaluées).
+    """
+    if y_true.shape != y_pred.shape:
+        raise ValueError("les dimensions du mask prédit et GT ne sont pas égal")
+    counts = np.zeros((len(CLASS_MAPPING), 4), dtype=np.float64)
+    true_components = class_components(y_true, class_ids)
+    pred_components = class_components(y_pred, class_ids)
+    for class_id, component in true_components.items():
+        counts[class_id, GT] = len(component[2])
+    for class_id, component in pred_components.items():
+        counts[class_id, PRED] = len(component[2])
+    for class_id in true_components.keys() & pred_components.keys():
+        matched = greedy_match(pairwise_iou(true_components[class_id], pred_components[class_id]), threshold)
+        counts[class_id, MATCHED] = len(matched)
+        counts[class_id, IOU_SUM] = matched.sum()
+    return counts
+
+
+def _ratio(numerator, denominator):
+    return float(numerator / denominator) if denominator > 0 else None
+
+
+def analyze_instances(per_image_counts, class_names=INSTANCE_CLASSES, threshold=INSTANCE_IOU_THRESHOLD):
+    """
+    Précision / rappel de détection et erreurs de comptage par classe, à partir des matrices
+    (18, 4) de chaque image. Les erreurs de comptage ne portent que sur les images où la
+    classe est présente en GT ou prédite.
+    """
+    stacked = np.stack([np.asarray(c, dtype=np.float64) for c in per_image_counts])  # (n, 18, 4)
+    totals = stacked.sum(axis=0)
+    classes = {}
+    for class_name in class_names:
+        class_id = CLASS_MAPPING[class_name]
+        gt, pred, matched, iou_sum = totals[class_id]
+        if gt == 0 and pred == 0:
+            continue
+        per_image = stacked[:, class_id]
+        involved = (per_image[:, GT] > 0) | (per_image[:, PRED] > 0)
+        errors = per_image[involved, PRED] - per_image[involved, GT]
+        precision, recall = _ratio(matched, pred), _ratio(matched, gt)
+        classes[class_name] = {
+            'gt_instances': int(gt),
+            'pred_instances': int(pred),
+            'matched': int(matched),
+            'precision': precision,
+            'recall': recall,
+            'f1': _ratio(2 * matched, gt + pred),
+            'mean_matched_iou': _ratio(iou_sum, matched),
+            'images': int(involved.sum()),
+            'count_mae': float(np.abs(errors).mean()),
+            'count_exact_rate': float((errors == 0).mean()),
+            'over_counted_images': int((errors > 0).sum()),
+            'under_counted_images': int((errors < 0).sum()),
+            'missed_images': int(((per_image[:, GT] > 0) & (per_image[:, MATCHED] == 0)).sum())
+        }
+    class_ids = [CLASS_MAPPING[name] for name in class_names]
+    gt, pred, matched = totals[class_ids, GT].sum(), totals[class_ids, PRED].sum(), totals[class_ids, MATCHED].sum()
+    results = {
+        'iou_threshold': threshold,
+        'min_area': INSTANCE_MIN_AREA,
+        'overall': {'precision': _ratio(matched, pred), 'recall': _ratio(matched, gt), 'f1': _ratio(2 * matched, gt + pred)},
+        'per_class': classes
+    }
+    logger.info(f"Évaluation par instances : précision {results['overall']['precision']}, rappel {results['overall']['recall']}")
+    return results
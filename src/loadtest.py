@@ -0,0 +1,136 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import json
+import time
+import numpy as np
+import matplotlib.pyplot as plt
+from .api import post_segmentation_request
+from .utils import get_logger
+from .analyzer import clean_numpy_for_json
+from .config import (DEFAULT_MODEL, LOAD_TEST_CONCURRENCY_LEVELS, LOAD_TEST_REQUESTS_PER_LEVEL,
+                     LOAD_TEST_TIMEOUT)
+
+logger = get_logger(__name__, __name__ + ".log")
+
+
+def _timed_request(data, model, api_url, timeout):
+    """Envoie une requête et mesure sa latence, son statut et les octets échangés"""
+    start = time.perf_counter()
+    try:
+        response = post_segmentation_request(data, model, api_url, timeout=timeout)
+        status, received, error = response.status_code, len(response.content), None
+    except Exception as e:
+        status, received, error = None, 0, type(e).__name__
+    return {
+        'latency': time.perf_counter() - start,
+        'status': status,
+        'bytes_sent': len(data),
+        'bytes_received': received,
+        'error': error
+    }
+
+
+def summarize_level(concurrency, samples, wall):
+    """Percentiles de latence, débit, taux d'erreur et volume transféré d'un niveau de concurrence"""
+    latencies = np.array([s['latency'] for s in samples])
+    ok = np.array([s['status'] == 200 for s in samples])
+    statuses = {}
+    for s in samples:
+        key = str(s['status']) if s['status'] is not None else s['error']
+        statuses[key] = statuses.get(key, 0) + 1
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (np.nan,) * 3
+    return {
+        'concurrency': concurrency,
+        'requests': len(samples),
+        'wall_seconds': wall,
+        'throughput_rps': ok.sum() / wall if wall > 0 else 0.0,
+        'p50_ms': p50 * 1000,
+        'p95_ms': p95 * 1000,
+        'p99_ms': p99 * 1000,
+        'error_rate': 1.0 - ok.mean() if len(samples) else 0.0,
+        'status_counts': statuses,
+        'bytes_sent': sum(s['bytes_sent'] for s in samples),
+        'bytes_received': sum(s['bytes_received'] for s in samples)
+    }
+
+
+def run_load_test(image_paths, concurrency_levels=LOAD_TEST_CONCURRENCY_LEVELS,
+                  requests_per_level=LOAD_TEST_REQUESTS_PER_LEVEL, model=DEFAULT_MODEL, api_url=None,
+                  timeout=LOAD_TEST_TIMEOUT):
+    """
+    Rejoue les images vers l'API de segmentation (ou un serveur local via api_url) à des
+    niveaux de concurrence croissants.
+
+    Les images sont lues une seule fois en mémoire pour que la lecture disque n'entre pas
+    dans les latences mesurées. Chaque niveau envoie requests_per_level requêtes avec
+    `concurrency` requêtes simultanées au plus.
+
+    Returns:
+        list: Un résumé par niveau (voir summarize_level).
+    """
+    payloads = []
+    for img_path in image_paths:
+        with open(img_path, "rb") as f:
+            payloads.append(f.read())
+    if not payloads:
+        raise ValueError("Aucune image à rejouer pour le test de charge")
+
+    levels = []
+    for concurrency in concurrency_levels:
+        batch = [payloads[i % len(payloads)] for i in range(requests_per_level)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(lambda data: _timed_request(data, model, api_url, timeout), batch))
+        level = summarize_level(concurrency, samples, time.perf_counter() - start)
+        levels.append(level)
+        message = (f"Concurrence {concurrency:>3} : p50 {level['p50_ms']:.0f} ms, p95 {level['p95_ms']:.0f} ms, "
+                   f"p99 {level['p99_ms']:.0f} ms, {level['throughput_rps']:.2f} req/s, "
+                   f"erreurs {level['error_rate']*100:.1f}%")
+        print(message)
+        logger.info(message)
+    return levels
+
+
+def write_load_test_report(levels, target, report_dir="reports"):
+    """Écrit la courbe de saturation (tableau Markdown et graphique) et le détail JSON"""
+    output_dir = Path(report_dir)
+    output_dir.mkdir(exist_ok=True)
+
+    with open(output_dir / "load_test_report.json", 'w') as f:
+        json.dump(clean_numpy_for_json({'target': target, 'levels': levels}), f, indent=4)
+
+    content = "# ⏱️ Test de charge de l'API de segmentation\n\n"
+    content += f"- **Cible** : {target}\n\n"
+    content += "| Concurrence | Requêtes | p50 (ms) | p95 (ms) | p99 (ms) | Débit (req/s) | Erreurs | Envoyé (Mo) | Reçu (Mo) |\n"
+    content += "|---|---|---|---|---|---|---|---|---|\n"
+    for level in levels:
+        content += (f"| {level['concurrency']} | {level['requests']} | {level['p50_ms']:.0f} | {level['p95_ms']:.0f} | "
+                    f"{level['p99_ms']:.0f} | {level['throughput_rps']:.2f} | {level['error_rate']*100:.1f}% | "
+                    f"{level['bytes_sent']/1e6:.2f} | {level['bytes_received']/1e6:.2f} |\n")
+    table_path = output_dir / "load_test.md"
+    with open(table_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+    concurrency = [level['concurrency'] for level in levels]
+    fig, ax_latency = plt.subplots(figsize=(10, 6))
+    for key, label in (('p50_ms', 'p50'), ('p95_ms', 'p95'), ('p99_ms', 'p99')):
+        ax_latency.plot(concurrency, [level[key] for level in levels], marker='o', label=label)
+    ax_latency.set_xscale('log', base=2)
+    ax_latency.set_xlabel('Requêtes simultanées', fontsize=12)
+    ax_latency.set_ylabel('Latence (ms)', fontsize=12)
+    ax_throughput = ax_latency.twinx()
+    ax_throughput.plot(concurrency, [level['throughput_rps'] for level in levels], color='black',
+                       linestyle='--', marker='s', label='Débit')
+    ax_throughput.set_ylabel('Débit (req/s)', fontsize=12)
+    lines = ax_latency.get_legend_handles_labels()
+    lines_throughput = ax_throughput.get_legend_handles_labels()
+    ax_latency.legend(lines[0] + lines_throughput[0], lines[1] + lines_throughput[1], loc='upper left')
+    plt.title('Courbe de saturation', fontsize=16, fontweight='bold')
+    plt.tight_layout()
+    chart_path = output_dir / "load_test_saturation.png"
+    plt.savefig(chart_path, dpi=300, bbox_inches='tight')
+    plt.close()
+
+    logger.info(f"Rapport de test de charge sauvegardé dans '{table_path}' et '{chart_path}'")
+    print(f"Rapport de test de charge généré : {table_path}")
+    return table_path
@@ -0,0 +1,243 @@
+import hashlib
+import os
+import sqlite3
+import time
+from PIL import Image
+from .utils import get_logger, source_image_id
+from .config import (IMG_DIR, MASK_DIR, API_SEGMENTATION_OUTPUTS_DIR, EXPECTED_SEGMENTATION_OUTPUTS_DIR,
+                     WWG_SEGMENTATION_OUTPUTS_DIR, RLE_EXTENSION, MANIFEST_DB)
+
+logger = get_logger(__name__, __name__ + ".log")
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+PRED_MASK_DIR = os.path.join(API_SEGMENTATION_OUTPUTS_DIR, "Mask")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    image_path TEXT,
+    image_size INTEGER,
+    image_mtime REAL,
+    width INTEGER,
+    height INTEGER,
+    image_hash TEXT,
+    gt_mask_path TEXT,
+    pred_mask_path TEXT,
+    pred_rle_path TEXT,
+    result_path TEXT,
+    expected_path TEXT
+);
+CREATE TABLE IF NOT EXISTS stage_status (
+    id INTEGER,
+    stage TEXT,
+    status TEXT,
+    updated_at REAL,
+    PRIMARY KEY (id, stage)
+);
+CREATE TABLE IF NOT EXISTS directories (
+    path_column TEXT PRIMARY KEY,
+    directory TEXT,
+    mtime_ns INTEGER
+);
+"""
+
+# Colonne de chemin -> (répertoire, extensions acceptées)
+PATH_COLUMNS = {
+    'gt_mask_path': (MASK_DIR, ('.png',)),
+    'pred_mask_path': (PRED_MASK_DIR, ('.png',)),
+    'pred_rle_path': (PRED_MASK_DIR, (RLE_EXTENSION,)),
+    'result_path': (WWG_SEGMENTATION_OUTPUTS_DIR, ('.png',)),
+    'expected_path': (EXPECTED_SEGMENTATION_OUTPUTS_DIR, ('.png',)),
+}
+
+
+def image_id_from_name(filename):
+    """
+    Identifiant d'une image à partir d'un nom de fichier (image_12.jpg, mask_12.png, result_12.png -> 12) :
+    même règle que source_image_id, None si le nom ne contient pas exactement un nombre (image_1_2.jpg)
+    """
+    return source_image_id(filename)
+
+
+def scan_dir(directory, extensions):
+    """
+    {id: chemin} des fichiers d'un répertoire (un seul parcours). Deux fichiers de même identifiant
+    (image_12.jpg et image_12.png) sont signalés et seul le premier par ordre de nom est gardé ;
+    les noms sans identifiant sont ignorés.
+    """
+    found = {}
+    if not os.path.isdir(directory):
+        return found
+    with os.scandir(directory) as entries:
+        files = sorted((entry for entry in entries if entry.is_file() and entry.name.endswith(extensions)),
+                       key=lambda entry: entry.name)
+    for entry in files:
+        image_id = image_id_from_name(entry.name)
+        if image_id is None:
+            logger.warning(f"Fichier ignoré, identifiant d'image ambigu ou absent : {entry.path}")
+        elif image_id in found:
+            message = (f"Attention : {entry.path} a le même identifiant ({image_id}) que {found[image_id]}, "
+                       f"seul {os.path.basename(found[image_id])} est pris en compte")
+            print(message)
+            logger.warning(message)
+        else:
+            found[image_id] = entry.path
+    return found
+
+
+def file_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    Index SQLite du jeu de données, par identifiant d'image : chemins de l'image, du masque
+    ground truth, du masque prédit (PNG / RLE), du rendu et du visuel attendu, dimensions,
+    empreinte de l'image et statut par étape.
+
+    Construit en un seul parcours de chaque répertoire puis mis à jour de façon incrémentale :
+    seuls les répertoires dont la date de modification a changé (fichier ajouté, supprimé ou
+    renommé) sont reparcourus, seules les lignes modifiées sont réécrites, et dimensions et
+    empreinte ne sont recalculées que pour les images nouvelles ou modifiées.
+    Une connexion par instance (à ouvrir dans chaque thread).
+    """
+
+    def __init__(self, db_path=MANIFEST_DB):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(db_path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def refresh(self, force=False):
+        """
+        Synchronise le manifeste avec les répertoires du projet. Sans changement de répertoire,
+        le coût se limite à un stat par répertoire. force=True reparcourt tous les répertoires
+        (images modifiées sur place, sans écriture par renommage).
+
+        Returns:
+            int: Nombre d'images dont dimensions et empreinte ont été (re)calculées.
+        """
+        directories = dict({'image_path': (IMG_DIR, IMAGE_EXTENSIONS)}, **PATH_COLUMNS)
+        scanned = {row['path_column']: (row['directory'], row['mtime_ns']) for row in self.connection.execute(
+            "SELECT path_column, directory, mtime_ns FROM directories")}
+        changed = {}
+        for column, (directory, extensions) in directories.items():
+            # mtime lue avant le parcours : un fichier ajouté pendant le parcours sera vu au prochain refresh
+            mtime_ns = os.stat(directory).st_mtime_ns if os.path.isdir(directory) else None
+            if force or scanned.get(column) != (directory, mtime_ns):
+                changed[column] = (scan_dir(directory, extensions), mtime_ns)
+        if not changed:
+            return 0
+
+        known = {row['id']: dict(row) for row in self.connection.execute("SELECT * FROM images")}
+        all_ids = set(known).union(*(found for found, _ in changed.values()))
+        empty = {column: None for column in ('image_path', 'image_size', 'image_mtime', 'width', 'height',
+                                             'image_hash', *PATH_COLUMNS)}
+        updated = 0
+        rows, deleted = [], []
+        for image_id in sorted(all_ids):
+            previous = known.get(image_id)
+            row = dict(empty, id=image_id) if previous is None else dict(previous)
+            for column, (found, _) in changed.items():
+                row[column] = found.get(image_id)
+            if 'image_path' in changed:
+                if row['image_path'] is not None:
+                    stat = os.stat(row['image_path'])
+                    row['image_size'], row['image_mtime'] = stat.st_size, stat.st_mtime
+                    unchanged = (previous is not None and previous['image_path'] == row['image_path']
+                                 and previous['image_size'] == stat.st_size and previous['image_mtime'] == stat.st_mtime)
+                    if not unchanged:
+                        with Image.open(row['image_path']) as img:  # Lecture de l'en-tête uniquement
+                            row['width'], row['height'] = img.size
+                        row['image_hash'] = file_hash(row['image_path'])
+                        updated += 1
+                else:
+                    row.update(image_size=None, image_mtime=None, width=None, height=None, image_hash=None)
+            if row['image_path'] is None and all(row[column] is None for column in PATH_COLUMNS):
+                if previous is not None:
+                    deleted.append(image_id)
+            elif row != previous:
+                rows.append(row)
+
+        with self.connection:
+            self.connection.executemany("DELETE FROM images WHERE id = ?", [(i,) for i in deleted])
+            for row in rows:
+                columns_sql = ", ".join(row)
+                placeholders = ", ".join(f":{column}" for column in row)
+                updates = ", ".join(f"{column}=excluded.{column}" for column in row if column != 'id')
+                self.connection.execute(
+                    f"INSERT INTO images ({columns_sql}) VALUES ({placeholders}) ON CONFLICT(id) DO UPDATE SET {updates}",
+                    row)
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO directories (path_column, directory, mtime_ns) VALUES (?, ?, ?)",
+                [(column, directories[column][0], mtime_ns) for column, (_, mtime_ns) in changed.items()])
+        logger.info(f"Manifeste : {len(changed)} répertoire(s) reparcouru(s), {len(rows)} ligne(s) écrite(s), "
+                    f"{len(deleted)} supprimée(s), {updated} image(s) (re)lue(s)")
+        return updated
+
+    def get(self, image_id):
+        """Entrée d'une image (dict) ou None"""
+        row = self.connection.execute("SELECT * FROM images WHERE id = ?", (image_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def image_paths(self):
+        return [row['image_path'] for row in self.connection.execute(
+            "SELECT image_path FROM images WHERE image_path IS NOT NULL ORDER BY id")]
+
+    def entries(self):
+        """Toutes les entrées (dicts), triées par identifiant"""
+        return [dict(row) for row in self.connection.execute("SELECT * FROM images ORDER BY id")]
+
+    def eval_pairs(self, include_rle=False):
+        """
+        [(id, chemin GT ou None, chemin prédit)] des images ayant un masque prédit PNG.
+        Avec include_rle, les masques stockés uniquement en RLE sont inclus sous leur chemin PNG
+        (load_mask lit alors le RLE).
+        """
+        condition = "pred_mask_path IS NOT NULL OR pred_rle_path IS NOT NULL" if include_rle else "pred_mask_path IS NOT NULL"
+        return [(row['id'], row['gt_mask_path'], row['pred_mask_path'] or row['pred_rle_path'][:-len(RLE_EXTENSION)] + ".png")
+                for row in self.connection.execute(
+                    f"SELECT id, gt_mask_path, pred_mask_path, pred_rle_path FROM images WHERE {condition} ORDER BY id")]
+
+    def set_status(self, image_ids, stage, status):
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO stage_status (id, stage, status, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id, stage) DO UPDATE SET status=excluded.status, updated_at=excluded.updated_at",
+                [(image_id, stage, status, now) for image_id in image_ids])
+
+    def status_counts(self, stage):
+        return dict(self.connection.execute(
+            "SELECT status, COUNT(*) FROM stage_status WHERE stage = ? GROUP BY status", (stage,)).fetchall())
+
+
+def open_manifest(refresh=True, db_path=MANIFEST_DB):
+    """
+    Ouvre le manifeste et, si refresh, le synchronise avec les répertoires (incrémental).
+    main.py le synchronise une fois au démarrage et la segmentation après l'écriture des masques :
+    les lectures qui suivent ouvrent le manifeste sans refresh.
+    """
+    manifest = Manifest(db_path)
+    if refresh:
+        manifest.refresh()
+    return manifest
+
+
+def mark_stage(filenames, stage, status="done"):
+    """Enregistre le statut d'une étape pour des fichiers (images, masques ou rendus)"""
+    with open_manifest(refresh=False) as manifest:
+        manifest.set_status([image_id_from_name(name) for name in filenames], stage, status)
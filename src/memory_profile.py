@@ -0,0 +1,216 @@
+from contextlib import contextmanager
+from pathlib import Path
+import json
+import os
+import resource
+import threading
+import time
+import tracemalloc
+import numpy as np
+from .utils import get_logger, set_memory_profiler
+from .config import MEMORY_PROFILE_REPORT, MEMORY_PROFILE_TOP_SITES, MEMORY_PROFILE_SAMPLE_INTERVAL
+
+logger = get_logger(__name__, __name__ + ".log")
+
+MB = 1024 * 1024
+
+# Cadres ignorés dans les sites d'allocation (profileur et machinerie d'import)
+IGNORED_FRAMES = (tracemalloc.Filter(False, tracemalloc.__file__),
+                  tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                  tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"))
+
+
+def current_rss():
+    """RSS courant du processus en octets (/proc/self/statm), None si indisponible"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def max_rss():
+    """Pic RSS du processus depuis son démarrage, en octets"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # ru_maxrss est en Ko sous Linux
+
+
+def _label(args):
+    """Libellé d'un appel : nom du fichier ou forme du premier tableau passé en argument"""
+    for arg in args:
+        if isinstance(arg, str):
+            return os.path.basename(arg)
+        if isinstance(arg, np.ndarray):
+            return "x".join(str(d) for d in arg.shape)
+    return ""
+
+
+class _Stage:
+    def __init__(self, name, parent):
+        self.name = name
+        self.parent = parent
+        self.traced_start = tracemalloc.get_traced_memory()[0]
+        self.traced_peak = self.traced_start
+        self.rss_start = current_rss()
+        self.rss_peak = self.rss_start or 0
+        self.snapshot = tracemalloc.take_snapshot().filter_traces(IGNORED_FRAMES)
+        self.started = time.perf_counter()
+
+
+class MemoryProfiler:
+    """
+    Profil mémoire par étape (segmentation, save_results, eval_dataset, analyze_dataset_eval,
+    fill_template_and_save : voir le décorateur memory_stage de src/utils.py).
+
+    Pour chaque étape : pic des allocations Python/NumPy suivies par tracemalloc au-dessus du
+    niveau d'entrée, pic RSS (échantillonné par un thread) et principaux sites d'allocation
+    encore présents en fin d'étape. Les fonctions de masques décorées par track_memory
+    enregistrent en plus le pic de chaque appel, c'est-à-dire par image.
+
+    Les étapes peuvent être imbriquées (save_results dans la segmentation) : les pics sont
+    reportés sur toutes les étapes ouvertes. Les allocations des threads concurrents sont
+    comptées dans l'étape en cours ; celles des processus fils ne le sont pas.
+    """
+
+    def __init__(self, top_sites=MEMORY_PROFILE_TOP_SITES, sample_interval=MEMORY_PROFILE_SAMPLE_INTERVAL):
+        self.top_sites = top_sites
+        self.sample_interval = sample_interval
+        self.stages = []
+        self.calls = {}
+        self.open_stages = []
+        self.open_calls = []  # [niveau d'entrée, pic] des appels en cours (éventuellement imbriqués)
+        self.lock = threading.RLock()
+        self.sampler = None
+        self.stopping = threading.Event()
+
+    def start(self):
+        tracemalloc.start()
+        self.started = time.perf_counter()
+        self.stopping.clear()
+        self.sampler = threading.Thread(target=self._sample_rss, name="rss-sampler", daemon=True)
+        self.sampler.start()
+        set_memory_profiler(self)
+        return self
+
+    def stop(self):
+        set_memory_profiler(None)
+        self.stopping.set()
+        if self.sampler is not None:
+            self.sampler.join()
+        self.process_peak_rss = max_rss()
+        self.duration = time.perf_counter() - self.started
+        tracemalloc.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _sample_rss(self):
+        while not self.stopping.wait(self.sample_interval):
+            rss = current_rss()
+            if rss is None:
+                return
+            with self.lock:
+                for stage in self.open_stages:
+                    stage.rss_peak = max(stage.rss_peak, rss)
+
+    def _fold_peak(self):
+        """Reporte le pic tracemalloc courant sur les étapes et appels ouverts puis le réinitialise"""
+        peak = tracemalloc.get_traced_memory()[1]
+        for stage in self.open_stages:
+            stage.traced_peak = max(stage.traced_peak, peak)
+        for call in self.open_calls:
+            call[1] = max(call[1], peak)
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def stage(self, name):
+        with self.lock:
+            self._fold_peak()
+            stage = _Stage(name, self.open_stages[-1].name if self.open_stages else None)
+            self.open_stages.append(stage)
+        try:
+            yield stage
+        finally:
+            with self.lock:
+                self._fold_peak()
+                self.open_stages.remove(stage)
+                self.stages.append(self._summarize(stage))
+
+    def call(self, func, args, kwargs):
+        """Exécute un appel de fonction de masque en mesurant son pic d'allocation"""
+        with self.lock:
+            self._fold_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            entry = [base, base]
+            self.open_calls.append(entry)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self.lock:
+                self._fold_peak()
+                self.open_calls.remove(entry)
+                self.calls.setdefault(func.__qualname__, []).append((_label(args), entry[1] - base))
+
+    def _summarize(self, stage):
+        snapshot = tracemalloc.take_snapshot().filter_traces(IGNORED_FRAMES)
+        sites = [diff for diff in snapshot.compare_to(stage.snapshot, 'lineno') if diff.size_diff > 0]
+        sites.sort(key=lambda diff: diff.size_diff, reverse=True)
+        rss_end = current_rss()
+        summary = {
+            'stage': stage.name,
+            'parent': stage.parent,
+            'start_seconds': stage.started - self.started,
+            'seconds': time.perf_counter() - stage.started,
+            'traced_peak_mb': (stage.traced_peak - stage.traced_start) / MB,
+            'traced_retained_mb': (tracemalloc.get_traced_memory()[0] - stage.traced_start) / MB,
+            'rss_start_mb': stage.rss_start / MB if stage.rss_start is not None else None,
+            'rss_peak_mb': stage.rss_peak / MB if stage.rss_start is not None else None,
+            'rss_end_mb': rss_end / MB if rss_end is not None else None,
+            'top_allocation_sites': [{
+                'site': f"{diff.traceback[0].filename}:{diff.traceback[0].lineno}",
+                'size_mb': diff.size_diff / MB,
+                'blocks': diff.count_diff
+            } for diff in sites[:self.top_sites]]
+        }
+        logger.info(f"Étape {stage.name} : pic tracemalloc {summary['traced_peak_mb']:.1f} Mo, "
+                    f"pic RSS {summary['rss_peak_mb'] or 0:.1f} Mo, {summary['seconds']:.2f} s")
+        return summary
+
+    def report(self):
+        """Résumé de l'exécution : étapes, appels par fonction de masque et pic RSS du processus"""
+        functions = {}
+        for name, calls in self.calls.items():
+            peaks = np.array([peak for _, peak in calls], dtype=np.float64) / MB
+            worst = sorted(calls, key=lambda call: call[1], reverse=True)[:self.top_sites]
+            functions[name] = {
+                'calls': len(calls),
+                'peak_mb_max': float(peaks.max()),
+                'peak_mb_mean': float(peaks.mean()),
+                'peak_mb_p95': float(np.percentile(peaks, 95)),
+                'worst_calls': [{'input': label, 'peak_mb': peak / MB} for label, peak in worst]
+            }
+        return {
+            'duration_seconds': getattr(self, 'duration', None),
+            'process_peak_rss_mb': getattr(self, 'process_peak_rss', max_rss()) / MB,
+            'stages': sorted(self.stages, key=lambda stage: stage['start_seconds']),
+            'per_call_peaks': functions
+        }
+
+    def save(self, output_path=MEMORY_PROFILE_REPORT):
+        report = self.report()
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"\nProfil mémoire ({output_path}) :")
+        print(f"{'Étape':<26}{'Pic tracemalloc':>17}{'Pic RSS':>12}{'Durée':>10}")
+        for stage in report['stages']:
+            name = ("  " if stage['parent'] else "") + stage['stage']
+            rss = f"{stage['rss_peak_mb']:.1f} Mo" if stage['rss_peak_mb'] is not None else "-"
+            print(f"{name:<26}{stage['traced_peak_mb']:>14.1f} Mo{rss:>12}{stage['seconds']:>9.2f}s")
+        for name, stats in report['per_call_peaks'].items():
+            print(f"{name} : {stats['calls']} appel(s), pic max {stats['peak_mb_max']:.1f} Mo "
+                  f"(moyenne {stats['peak_mb_mean']:.1f} Mo)")
+        print(f"Pic RSS du processus : {report['process_peak_rss_mb']:.1f} Mo")
+        return report
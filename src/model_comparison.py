@@ -0,0 +1,194 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+import json
+import os
+import numpy as np
+from tqdm import tqdm
+from .api import call_hf_segmentation_api
+from .utils import get_logger, get_image_dimensions, create_masks, save_mask, load_mask, rle_path_for
+from .evaluation import get_y_from_mask, compute_confusion_matrix, evaluate_pair_from_confusion, MASK_TRUE_DIR
+from .analyzer import clean_numpy_for_json
+from .processing import mask_filename_for
+from .config import CLASS_MAPPING, MODEL_COMPARISON_WORKERS, MODEL_OUTPUTS_DIR, MASK_STORAGE_FORMAT
+
+logger = get_logger(__name__, __name__ + ".log")
+
+
+def model_slug(model):
+    """Nom de répertoire d'un modèle (sayeed99/segformer_b3_clothes -> sayeed99__segformer_b3_clothes)"""
+    return model.replace('/', '__')
+
+
+def model_mask_dir(model, output_root=MODEL_OUTPUTS_DIR):
+    return os.path.join(output_root, model_slug(model), "Mask")
+
+
+def _segment_with_model(img_path, model, width, height, mask_storage_format, output_root):
+    """Segmente une image avec un modèle et sauvegarde son masque dans le répertoire du modèle"""
+    output = call_hf_segmentation_api(img_path, model=model)
+    if not (isinstance(output, list) and len(output) > 0):
+        return False
+    mask_path = os.path.join(model_mask_dir(model, output_root), mask_filename_for(os.path.basename(img_path)))
+    save_mask(mask_path, create_masks(output, width, height), mask_storage_format)
+    return True
+
+
+def segment_images_multi_model(image_paths, models, max_workers=MODEL_COMPARISON_WORKERS,
+                               mask_storage_format=MASK_STORAGE_FORMAT, output_root=MODEL_OUTPUTS_DIR):
+    """
+    Segmente chaque image avec plusieurs modèles en parallèle.
+    Les masques sont rangés dans un répertoire par modèle (<output_root>/<modèle>/Mask).
+
+    Returns:
+        dict: Nombre de masques produits par modèle.
+    """
+    for model in models:
+        os.makedirs(model_mask_dir(model, output_root), exist_ok=True)
+    produced = {model: 0 for model in models}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for img_path in image_paths:
+            width, height = get_image_dimensions(img_path)
+            for model in models:
+                future = executor.submit(_segment_with_model, img_path, model, width, height,
+                                         mask_storage_format, output_root)
+                futures[future] = (img_path, model)
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Segmentation multi-modèles"):
+            img_path, model = futures[future]
+            try:
+                if future.result():
+                    produced[model] += 1
+                else:
+                    print(f"Réponse API invalide pour {os.path.basename(img_path)} ({model})")
+            except Exception as e:
+                print(f"Erreur lors du traitement de {img_path} avec {model}: {e}")
+                logger.info(f"Erreur {model} sur {img_path}: {e}")
+
+    for model, count in produced.items():
+        print(f"{model} : {count}/{len(image_paths)} masque(s) produit(s)")
+    return produced
+
+
+def summarize_model_results(per_image_results):
+    """Mean IoU global, Pixel Accuracy et Mean IoU par classe d'un modèle (mêmes conventions que analyze_dataset_eval)"""
+    class_names = [name for name in CLASS_MAPPING if name != 'Background']
+    per_class = {}
+    for class_name in class_names:
+        values = [score['iou'] for img in per_image_results for score in img['iou_scores']
+                  if score['class_name'] == class_name and not np.isnan(score['iou'])]
+        if values:
+            per_class[class_name] = float(np.mean(values))
+    return {
+        'mean_iou': float(np.mean([img['mean_iou'] for img in per_image_results])),
+        'pixel_accuracy': float(np.mean([img['accuracy'] for img in per_image_results])),
+        'per_class_iou': per_class
+    }
+
+
+def compare_models(models, output_root=MODEL_OUTPUTS_DIR, report_dir="reports"):
+    """
+    Évalue plusieurs modèles sur les mêmes images : chaque masque ground truth est décodé une
+    seule fois puis comparé aux prédictions de chaque modèle. Seules les images prédites par
+    tous les modèles sont retenues. Le premier modèle sert de référence pour les écarts.
+
+    Returns:
+        dict: Résumé par modèle et écarts par classe par rapport à la référence.
+    """
+    baseline = models[0]
+    mask_files = sorted(f for f in os.listdir(MASK_TRUE_DIR) if f.endswith('.png'))
+
+    def has_prediction(model, mask_file):
+        mask_path = os.path.join(model_mask_dir(model, output_root), mask_file)
+        return os.path.exists(mask_path) or os.path.exists(rle_path_for(mask_path))
+
+    common = [f for f in mask_files if all(has_prediction(m, f) for m in models)]
+    print(f"\nComparaison de {len(models)} modèle(s) sur {len(common)} image(s) communes")
+
+    per_model = {model: [] for model in models}
+    for mask_file in tqdm(common, desc="Comparaison des modèles"):
+        y_true = get_y_from_mask(os.path.join(MASK_TRUE_DIR, mask_file))  # Décodé une seule fois
+        for model in models:
+            y_pred = load_mask(os.path.join(model_mask_dir(model, output_root), mask_file))
+            mean_iou, iou_scores, accuracy, _, _ = evaluate_pair_from_confusion(compute_confusion_matrix(y_true, y_pred))
+            per_model[model].append({'image': mask_file, 'mean_iou': mean_iou, 'iou_scores': iou_scores, 'accuracy': accuracy})
+
+    summaries = {model: summarize_model_results(results) for model, results in per_model.items() if results}
+    deltas = {}
+    for model in models[1:]:
+        if model not in summaries or baseline not in summaries:
+            continue
+        deltas[model] = {
+            'mean_iou': summaries[model]['mean_iou'] - summaries[baseline]['mean_iou'],
+            'pixel_accuracy': summaries[model]['pixel_accuracy'] - summaries[baseline]['pixel_accuracy'],
+            'per_class_iou': {
+                class_name: iou - summaries[baseline]['per_class_iou'][class_name]
+                for class_name, iou in summaries[model]['per_class_iou'].items()
+                if class_name in summaries[baseline]['per_class_iou']
+            }
+        }
+
+    comparison = clean_numpy_for_json({
+        'baseline': baseline,
+        'models': models,
+        'images': len(common),
+        'summaries': summaries,
+        'deltas_vs_baseline': deltas,
+        'per_image_results': per_model
+    })
+    with open('model_comparison.json', 'w') as f:
+        json.dump(comparison, f, indent=4)
+    report_path = write_comparison_report(comparison, report_dir)
+    logger.info(f"Comparaison des modèles sauvegardée dans 'model_comparison.json' et '{report_path}'")
+    print(f"Rapport de comparaison généré : {report_path}")
+    return comparison
+
+
+def write_comparison_report(comparison, report_dir="reports"):
+    """Écrit le tableau comparatif Markdown (une colonne par modèle, écarts vs référence)"""
+    output_dir = Path(report_dir)
+    output_dir.mkdir(exist_ok=True)
+    models = [m for m in comparison['models'] if m in comparison['summaries']]
+    baseline = comparison['baseline']
+    summaries, deltas = comparison['summaries'], comparison['deltas_vs_baseline']
+
+    columns = ["Classe"] + models + [f"Δ {m}" for m in models[1:]]
+    header = "| " + " | ".join(columns) + " |\n"
+    separator = "|" + "|".join("---" for _ in columns) + "|\n"
+
+    def cell(value):
+        return f"{value*100:.1f}%" if value is not None else "-"
+
+    def delta_cell(value):
+        if value is None:
+            return "-"
+        icon = "🟢" if value > 0.01 else "🔴" if value < -0.01 else "⚪"
+        return f"{icon} {value*100:+.1f} pts"
+
+    def row(label, values, delta_values):
+        return "| " + " | ".join([label] + values + delta_values) + " |"
+
+    rows = [
+        row("**Mean IoU**", [cell(summaries[m]['mean_iou']) for m in models],
+            [delta_cell(deltas.get(m, {}).get('mean_iou')) for m in models[1:]]),
+        row("**Pixel Accuracy**", [f"{summaries[m]['pixel_accuracy']:.1f}%" for m in models],
+            [f"{deltas[m]['pixel_accuracy']:+.1f} pts" if m in deltas else "-" for m in models[1:]])
+    ]
+    for class_name in CLASS_MAPPING:
+        if class_name == 'Background':
+            continue
+        values = [summaries[m]['per_class_iou'].get(class_name) for m in models]
+        if all(v is None for v in values):
+            continue
+        rows.append(row(class_name, [cell(v) for v in values],
+                        [delta_cell(deltas.get(m, {}).get('per_class_iou', {}).get(class_name)) for m in models[1:]]))
+
+    content = "# 🔬 Comparaison des modèles de segmentation\n\n"
+    content += f"- **Référence** : {baseline}\n"
+    content += f"- **Images communes évaluées** : {comparison['images']}\n\n"
+    content += header + separator + "\n".join(rows) + "\n"
+
+    output_file = output_dir / "model_comparison.md"
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(content)
+    return output_file
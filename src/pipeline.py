@@ -0,0 +1,95 @@
+import json
+import os
+from . import (analyzer, api, concurrency, confusion, dedup as dedup_module, evaluation, instances as instances_module, manifest,
+               presence_index, processing, report, shm_pipeline, stability, utils, writer)
+from .dag import Stage, Pipeline
+from .processing import segment_images_batch
+from .evaluation import eval_dataset, MASK_PRED_DIR, MASK_TRUE_DIR
+from .analyzer import analyze_dataset_eval
+from .report import fill_template_and_save
+from .presence_index import update_indexes_from_eval
+from .manifest import mark_stage
+from .shm_pipeline import eval_dataset_parallel, save_results_parallel
+from .utils import save_results
+from .writer import OutputWriter
+from .config import (IMG_DIR, MASK_DIR, EXPECTED_SEGMENTATION_OUTPUTS_DIR, WWG_SEGMENTATION_OUTPUTS_DIR,
+                     RLE_EXTENSION, MASK_STORAGE_FORMAT, DEDUP_MAX_DISTANCE, SHM_DECODE_WORKERS, RESULT_PYRAMID_FORMAT)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+RESULT_EXTENSIONS = ('.png', f".{RESULT_PYRAMID_FORMAT}")  # Visuels pleine résolution et niveaux de la pyramide
+DATASET_REPORT = "dataset_evaluation_report.json"
+TEMPLATE_PATH = "templates/template_report.md"
+REPORT_PATH = "reports/evaluation_report.md"
+
+
+def build_pipeline(image_paths, mask_storage_format=MASK_STORAGE_FORMAT, tiled=False, dedup=False,
+                   dedup_max_distance=DEDUP_MAX_DISTANCE, adaptive=False, compute_workers=0,
+                   decode_workers=SHM_DECODE_WORKERS, instances=False):
+    """
+    Pipeline complet : segmentation -> (visuels attendus) -> évaluation et analyse -> rapport.
+    Chaque étape déclare ses entrées et sorties ; la version d'une étape est le code source
+    des modules qu'elle utilise et ses options.
+    """
+    def segment():
+        segment_images_batch(image_paths, mask_storage_format=mask_storage_format, tiled=tiled, dedup=dedup,
+                             dedup_max_distance=dedup_max_distance, adaptive=adaptive)
+
+    def expected_visuals():
+        if compute_workers > 0:
+            save_results_parallel(IMG_DIR, MASK_DIR, EXPECTED_SEGMENTATION_OUTPUTS_DIR, tiled=tiled,
+                                  decode_workers=decode_workers, compute_workers=compute_workers)
+            return
+        with OutputWriter() as writer:
+            save_results(IMG_DIR, MASK_DIR, EXPECTED_SEGMENTATION_OUTPUTS_DIR, tiled=tiled, writer=writer)
+
+    def evaluate():
+        if compute_workers > 0:
+            all_img_eval = eval_dataset_parallel(decode_workers, compute_workers, instances=instances, tiled=tiled)
+        else:
+            all_img_eval = eval_dataset(use_rle=mask_storage_format != 'png', tiled=tiled, instances=instances)
+        update_indexes_from_eval(all_img_eval, MASK_TRUE_DIR, MASK_PRED_DIR)
+        mark_stage([img['image'] for img in all_img_eval], "evaluate")
+        analyze_dataset_eval(all_img_eval)  # Écrit dataset_evaluation_report.json
+
+    def build_report():
+        with open(DATASET_REPORT, 'r') as f:
+            fill_template_and_save(json.load(f))
+
+    return [
+        Stage("segment", segment,
+              inputs=[(IMG_DIR, IMAGE_EXTENSIONS)],
+              outputs=[MASK_PRED_DIR, WWG_SEGMENTATION_OUTPUTS_DIR],
+              code=[processing, api, dedup_module, concurrency, presence_index, manifest, utils, writer],
+              params={'images': sorted(os.path.basename(p) for p in image_paths), 'mask_format': mask_storage_format,
+                      'tiled': tiled, 'dedup': dedup, 'dedup_distance': dedup_max_distance}),
+        Stage("expected_visuals", expected_visuals,
+              inputs=[(IMG_DIR, IMAGE_EXTENSIONS), (MASK_DIR, ('.png',))],
+              outputs=[EXPECTED_SEGMENTATION_OUTPUTS_DIR],
+              code=[utils, writer, shm_pipeline],
+              params={'tiled': tiled}),
+        Stage("evaluate", evaluate,
+              inputs=[(MASK_TRUE_DIR, ('.png',)), (MASK_PRED_DIR, ('.png', RLE_EXTENSION))],
+              outputs=[DATASET_REPORT],
+              deps=["segment"],
+              code=[evaluation, analyzer, stability, confusion, instances_module, shm_pipeline, presence_index,
+                    manifest, utils],
+              params={'mask_format': mask_storage_format, 'tiled': tiled, 'instances': instances}),
+        Stage("report", build_report,
+              inputs=[DATASET_REPORT, TEMPLATE_PATH, (WWG_SEGMENTATION_OUTPUTS_DIR, RESULT_EXTENSIONS),
+                      (EXPECTED_SEGMENTATION_OUTPUTS_DIR, RESULT_EXTENSIONS)],
+              outputs=[REPORT_PATH],
+              deps=["evaluate", "segment", "expected_visuals"],
+              code=[report])
+    ]
+
+
+def run_pipeline(stages, dry_run=False, force=()):
+    """Exécute le pipeline avec cache (ou affiche seulement le plan si dry_run)"""
+    pipeline = Pipeline(stages)
+    if dry_run:
+        pipeline.print_plan(force)
+        pipeline.save()
+        return []
+    executed = pipeline.run(force)
+    print(f"\nÉtapes exécutées : {', '.join(executed) if executed else 'aucune (tout est à jour)'}")
+    return executed
@@ -0,0 +1,181 @@
+import os
+import numpy as np
+from .utils import get_logger, load_mask_rle, load_mask
+from .config import CLASS_MAPPING, RLE_EXTENSION, PRESENCE_INDEX_FILE
+
+logger = get_logger(__name__, __name__ + ".log")
+
+CLASS_BITS = np.left_shift(np.uint32(1), np.arange(len(CLASS_MAPPING), dtype=np.uint32))
+
+
+def presence_bits(label_map):
+    """Classes présentes d'une carte de labels sous forme d'entier (bit i = classe i)"""
+    present = np.bincount(label_map.ravel(), minlength=len(CLASS_MAPPING))[:len(CLASS_MAPPING)] > 0
+    return int(CLASS_BITS[present].sum())
+
+
+def presence_bits_from_ids(class_ids):
+    return int(sum(1 << int(class_id) for class_id in class_ids))
+
+
+def class_mask(class_names):
+    """Masque de bits d'une liste de noms de classes"""
+    return presence_bits_from_ids(CLASS_MAPPING[name] for name in class_names)
+
+
+def index_path_for(mask_dir):
+    return os.path.join(mask_dir, PRESENCE_INDEX_FILE)
+
+
+def list_mask_files(mask_dir):
+    """{nom du masque PNG: fichier à lire} ; un masque stocké uniquement en RLE est lu depuis le RLE"""
+    files = {}
+    for f in os.listdir(mask_dir):
+        if f.endswith('.png'):
+            files[f] = os.path.join(mask_dir, f)
+        elif f.endswith(RLE_EXTENSION):
+            files.setdefault(f[:-len(RLE_EXTENSION)] + ".png", os.path.join(mask_dir, f))
+    return files
+
+
+def read_presence_bits(mask_file):
+    """Bits de présence d'un fichier masque ; un RLE donne directement ses classes sans décodage"""
+    if mask_file.endswith(RLE_EXTENSION):
+        return presence_bits_from_ids(load_mask_rle(mask_file)['classes'].keys())
+    mask = load_mask(mask_file)
+    return None if mask is None else presence_bits(mask)
+
+
+class ClassPresenceIndex:
+    """
+    Index de présence des classes : un entier de 18 bits par masque dans un tableau NumPy.
+    Les requêtes booléennes sont des opérations bit à bit vectorisées sur tout le tableau et
+    la matrice de co-occurrence est un unique produit matriciel X.T @ X.
+
+    Persisté en .npz (noms, bits, date de modification du fichier masque) et mis à jour de
+    façon incrémentale : seuls les masques nouveaux ou modifiés sont relus.
+    """
+
+    def __init__(self, names=None, bits=None, mtimes=None):
+        self.names = list(names) if names is not None else []
+        self.bits = np.asarray(bits if bits is not None else [], dtype=np.uint32)
+        self.mtimes = np.asarray(mtimes if mtimes is not None else [], dtype=np.float64)
+        self.rows = {name: row for row, name in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def update(self, name, bits, mtime=0.0):
+        """Ajoute ou remplace l'entrée d'un masque"""
+        row = self.rows.get(name)
+        if row is None:
+            self.rows[name] = len(self.names)
+            self.names.append(name)
+            self.bits = np.append(self.bits, np.uint32(bits))
+            self.mtimes = np.append(self.mtimes, mtime)
+        else:
+            self.bits[row] = bits
+            self.mtimes[row] = mtime
+
+    def remove(self, names):
+        names = set(names)
+        keep = np.array([name not in names for name in self.names], dtype=bool)
+        self.names = [name for name in self.names if name not in names]
+        self.bits, self.mtimes = self.bits[keep], self.mtimes[keep]
+        self.rows = {name: row for row, name in enumerate(self.names)}
+
+    def refresh(self, mask_dir):
+        """
+        Synchronise l'index avec un répertoire de masques : relit uniquement les masques
+        nouveaux ou modifiés depuis leur indexation et retire les masques supprimés.
+
+        Returns:
+            int: Nombre de masques (re)lus.
+        """
+        files = list_mask_files(mask_dir)
+        self.remove([name for name in self.names if name not in files])
+        read = 0
+        for name, mask_file in sorted(files.items()):
+            mtime = os.path.getmtime(mask_file)
+            row = self.rows.get(name)
+            if row is not None and self.mtimes[row] >= mtime:
+                continue
+            bits = read_presence_bits(mask_file)
+            if bits is None:
+                logger.warning(f"Masque illisible : {mask_file}")
+                continue
+            self.update(name, bits, mtime)
+            read += 1
+        return read
+
+    def select(self, with_classes=(), without_classes=(), any_classes=()):
+        """
+        Masques contenant toutes les classes `with_classes`, aucune de `without_classes`
+        et au moins une de `any_classes` (si fournie).
+
+        Returns:
+            np.ndarray: Masque booléen (n,) des lignes correspondantes.
+        """
+        required, excluded = np.uint32(class_mask(with_classes)), np.uint32(class_mask(without_classes))
+        selected = ((self.bits & required) == required) & ((self.bits & excluded) == 0)
+        if any_classes:
+            selected &= (self.bits & np.uint32(class_mask(any_classes))) != 0
+        return selected
+
+    def query(self, with_classes=(), without_classes=(), any_classes=()):
+        """
+        Noms des masques correspondant aux classes demandées (voir select).
+
+        Returns:
+            list: Noms des masques correspondants.
+        """
+        selected = self.select(with_classes, without_classes, any_classes)
+        return [self.names[row] for row in np.flatnonzero(selected)]
+
+    def copy(self):
+        return ClassPresenceIndex(self.names, self.bits.copy(), self.mtimes.copy())
+
+    def presence_matrix(self):
+        """Matrice binaire (n images, 18 classes)"""
+        return ((self.bits[:, None] & CLASS_BITS[None, :]) != 0).astype(np.int64)
+
+    def cooccurrence(self):
+        """Matrice (18, 18) : nombre d'images contenant à la fois les classes i et j (diagonale : présence)"""
+        presence = self.presence_matrix()
+        return presence.T @ presence
+
+    def save(self, path):
+        np.savez(path, names=np.array(self.names, dtype=str), bits=self.bits, mtimes=self.mtimes)
+
+    @classmethod
+    def load(cls, path):
+        """Charge un index sauvegardé, ou retourne un index vide s'il n'existe pas"""
+        if not os.path.exists(path):
+            return cls()
+        with np.load(path) as data:
+            return cls(data['names'].tolist(), data['bits'], data['mtimes'])
+
+
+def update_presence_index(mask_dir):
+    """Met à jour (incrémentalement) et sauvegarde l'index de présence d'un répertoire de masques"""
+    index = ClassPresenceIndex.load(index_path_for(mask_dir))
+    read = index.refresh(mask_dir)
+    index.save(index_path_for(mask_dir))
+    logger.info(f"Index de présence de '{mask_dir}' : {len(index)} masque(s), {read} (re)lu(s)")
+    return index
+
+
+def update_indexes_from_eval(dataset_eval, true_mask_dir, pred_mask_dir):
+    """
+    Met à jour les index ground truth et prédit à partir des matrices de confusion de
+    l'évaluation (lignes : classes GT présentes, colonnes : classes prédites), sans relire les masques.
+    """
+    for mask_dir, axis in ((true_mask_dir, 1), (pred_mask_dir, 0)):
+        index = ClassPresenceIndex.load(index_path_for(mask_dir))
+        files = list_mask_files(mask_dir)
+        for img in dataset_eval:
+            if 'confusion' not in img or img['image'] not in files:
+                continue
+            bits = presence_bits_from_ids(np.flatnonzero(np.asarray(img['confusion']).sum(axis=axis)))
+            index.update(img['image'], bits, os.path.getmtime(files[img['image']]))
+        index.save(index_path_for(mask_dir))
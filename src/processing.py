@@ -1,101 +1,341 @@
 from tqdm import tqdm
 import os
 import time 
-from .utils import get_image_dimensions, create_masks, get_logger, save_results
+from .utils import (get_image_dimensions, get_image_dimensions_from_bytes, read_image_file, copy_original_image,
+                    create_masks, create_masks_tiled, get_logger, save_results, save_mask, load_mask, rle_path_for,
+                    memory_stage, iter_source_images, count_source_images, SourceIdAllocator)
 from .api import call_hf_segmentation_api
+from .dedup import find_near_duplicates, save_dedup_report
+from .presence_index import ClassPresenceIndex, presence_bits, index_path_for
+from .manifest import open_manifest, image_id_from_name
+from .concurrency import AdaptiveConcurrencyController, CircuitOpenError, call_with_controller
+from .writer import OutputWriter
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
 import matplotlib as mplt
-from .config import API_SEGMENTATION_OUTPUTS_DIR, WWG_SEGMENTATION_OUTPUTS_DIR
+from .config import API_SEGMENTATION_OUTPUTS_DIR, SOURCE_IDS_FILE, WWG_SEGMENTATION_OUTPUTS_DIR, MASK_STORAGE_FORMAT, DEDUP_MAX_DISTANCE, DEFAULT_MODEL, ADAPTIVE_MAX_RETRIES
 import cv2
 
 logger = get_logger(__name__, __name__ + ".log")
 
 mplt.use('Agg')  # Pour les environnements sans interface graphique 
 
-def segment_images_batch(list_of_image_paths):
+def mask_filename_for(image_filename):
+    """Nom du masque associé à une image (image_12.jpg -> mask_12.png)"""
+    return image_filename.replace("image", "mask").rsplit('.', 1)[0] + ".png"
+
+
+def reuse_canonical_mask(img_path, canonical_path, mask_storage_format=MASK_STORAGE_FORMAT, writer=None):
+    """
+    Réutilise le masque déjà produit pour l'image canonique d'un quasi-doublon,
+    redimensionné à la géométrie du doublon. Avec un OutputWriter, le masque canonique
+    peut être encore en cours d'écriture : les écritures en attente sont alors terminées.
+
+    Returns:
+        bool: True si le masque a pu être réutilisé (sinon l'API doit être appelée).
+    """
+    image_filename = os.path.basename(img_path)
+    canonical_mask_path = os.path.join(API_SEGMENTATION_OUTPUTS_DIR, "Mask", mask_filename_for(os.path.basename(canonical_path)))
+    canonical_mask = load_mask(canonical_mask_path)
+    if canonical_mask is None and writer is not None:
+        writer.flush()
+        canonical_mask = load_mask(canonical_mask_path)
+    if canonical_mask is None:
+        return False
+    width, height = get_image_dimensions(img_path)
+    mask = cv2.resize(canonical_mask, (width, height), interpolation=cv2.INTER_NEAREST)
+    output_mask_path = os.path.join(API_SEGMENTATION_OUTPUTS_DIR, "Mask", mask_filename_for(image_filename))
+    output_img_path = os.path.join(API_SEGMENTATION_OUTPUTS_DIR, "IMG", image_filename)
+    if writer is None:
+        save_mask(output_mask_path, mask, mask_storage_format)
+        copy_original_image(img_path, output_img_path)
+    else:
+        writer.write_mask(output_mask_path, mask, mask_storage_format)
+        writer.copy_image(img_path, output_img_path)
+    return True
+
+
+def save_segmentation_output(img_path, output, width, height, mask_storage_format=MASK_STORAGE_FORMAT,
+                             tiled=False, presence_index=None, image_data=None, writer=None, image_filename=None):
+    """
+    Construit le masque combiné d'une réponse de l'API et sauvegarde masque et image
+    dans API_SEGMENTATION_OUTPUTS_DIR (l'index de présence est mis à jour s'il est fourni).
+    L'image originale est copiée octet pour octet (lien physique si possible, sinon
+    image_data si le contenu a déjà été lu), sans décodage ni réencodage.
+    Avec un OutputWriter, les écritures sont asynchrones et l'index de présence est mis
+    à jour au prochain flush. image_filename remplace le nom de img_path pour les sorties
+    (images lues depuis une archive, renommées image_N).
+
+    Returns:
+        bool: False si la réponse de l'API est invalide.
+    """
+    if not (isinstance(output, list) and len(output) > 0):
+        return False
+    image_filename = image_filename or os.path.basename(img_path)
+    mask_filename = mask_filename_for(image_filename)
+    print(f"Nombre de segments détectés: {len(output)}")
+
+    # Créer le masque de segmentation combiné avec palette et labels
+    print("Création du masque de segmentation...")
+    segmentation_result = create_masks_tiled(output, width, height) if tiled else create_masks(output, width, height)
+    combined_mask = segmentation_result
+
+    # Statistiques du masque
+    unique_classes = np.unique(combined_mask)
+    print(f"Classes présentes: {unique_classes}")
+
+
+    print("Segmentation terminée avec succès")
+    logger.info(f"Image: {os.path.basename(img_path)} - Classes Detected: {unique_classes}")
+
+    # Sauvegarder les résultats dans un répertoire spécifique
+    if not os.path.exists(API_SEGMENTATION_OUTPUTS_DIR):
+        os.makedirs(API_SEGMENTATION_OUTPUTS_DIR, exist_ok=True)
+
+    seg_mask_np = np.array(combined_mask)
+    # Si le masque possède 3 canaux, le convertir en niveaux de gris
+    if seg_mask_np.ndim == 3:
+        seg_mask_np = cv2.cvtColor(seg_mask_np, cv2.COLOR_BGR2GRAY)
+
+    output_mask_path = os.path.join(API_SEGMENTATION_OUTPUTS_DIR, "Mask", mask_filename)
+    os.makedirs(os.path.dirname(output_mask_path), exist_ok=True)
+    output_img_path = os.path.join(API_SEGMENTATION_OUTPUTS_DIR, "IMG", image_filename)
+    os.makedirs(os.path.dirname(output_img_path), exist_ok=True)
+
+    saved_path = rle_path_for(output_mask_path) if mask_storage_format == "rle" else output_mask_path
+    if writer is None:
+        save_mask(output_mask_path, seg_mask_np, mask_storage_format)
+        copy_original_image(img_path, output_img_path, image_data)
+        if presence_index is not None:
+            presence_index.update(mask_filename, presence_bits(seg_mask_np), os.path.getmtime(saved_path))
+    else:
+        writer.write_mask(output_mask_path, seg_mask_np, mask_storage_format)
+        writer.copy_image(img_path, output_img_path, image_data)
+        if presence_index is not None:
+            bits = presence_bits(seg_mask_np)
+            writer.on_flush(lambda: os.path.exists(saved_path) and presence_index.update(
+                mask_filename, bits, os.path.getmtime(saved_path)))
+
+    print(f"Sauvegardé: {mask_filename}")
+    return True
+
+
+def _read_and_call_with_controller(controller, img_path, model, max_retries):
+    """Lecture unique de l'image puis appel de l'API : (contenu, largeur, hauteur, réponse)"""
+    image_data, width, height = read_image_file(img_path)
+    return image_data, width, height, call_with_controller(controller, img_path, model, max_retries, data=image_data)
+
+
+def segment_images_adaptive(list_of_image_paths, duplicates, mask_storage_format=MASK_STORAGE_FORMAT, tiled=False,
+                            model=DEFAULT_MODEL, presence_index=None, writer=None):
+    """
+    Segmente les images avec des requêtes simultanées dont le nombre est ajusté en AIMD selon
+    la latence et les codes d'erreur observés, derrière un disjoncteur. Les appels réseau sont
+    faits dans des threads, la composition et l'écriture des masques dans le thread principal.
+    Les quasi-doublons sont traités après les images canoniques.
+
+    Returns:
+        int: Nombre d'appels API évités par la déduplication.
+    """
+    controller = AdaptiveConcurrencyController()
+    api_calls_avoided = 0
+    to_segment = [p for p in list_of_image_paths if p not in duplicates]
+    aborted = False
+
+    with ThreadPoolExecutor(max_workers=controller.max_limit) as executor:
+        futures = {executor.submit(_read_and_call_with_controller, controller, img_path, model, ADAPTIVE_MAX_RETRIES): img_path
+                   for img_path in to_segment}
+        progress = tqdm(as_completed(list(futures)), total=len(futures), desc="Segmentation adaptative")
+        for future in progress:
+            img_path = futures.pop(future)  # Libère le contenu de l'image une fois traitée
+            try:
+                image_data, width, height, output = future.result()
+                if not save_segmentation_output(img_path, output, width, height, mask_storage_format, tiled,
+                                                presence_index, image_data, writer):
+                    print(f"Réponse API invalide pour {os.path.basename(img_path)}")
+            except CircuitOpenError as e:
+                if not aborted:
+                    aborted = True
+                    print(f"Endpoint indisponible, arrêt du lot : {e}")
+                    logger.info(f"Arrêt du lot : {e}")
+                    for pending in futures:
+                        pending.cancel()
+            except Exception as e:
+                print(f"Erreur lors du traitement de {img_path}: {e}")
+            progress.set_postfix(controller.snapshot())
+    logger.info(f"Fin de la segmentation adaptative : {controller.describe()}")
+
+    for img_path, (canonical_path, distance) in duplicates.items():
+        os.makedirs(os.path.join(API_SEGMENTATION_OUTPUTS_DIR, "Mask"), exist_ok=True)
+        os.makedirs(os.path.join(API_SEGMENTATION_OUTPUTS_DIR, "IMG"), exist_ok=True)
+        if reuse_canonical_mask(img_path, canonical_path, mask_storage_format, writer):
+            api_calls_avoided += 1
+            logger.info(f"Image: {os.path.basename(img_path)} - Masque réutilisé depuis {os.path.basename(canonical_path)}")
+        else:
+            print(f"Masque canonique indisponible pour {os.path.basename(img_path)}")
+    return api_calls_avoided
+
+
+@memory_stage("segmentation")
+def segment_images_batch(list_of_image_paths, mask_storage_format=MASK_STORAGE_FORMAT, tiled=False,
+                         dedup=False, dedup_max_distance=DEDUP_MAX_DISTANCE, model=DEFAULT_MODEL, adaptive=False):
     """
     Segmente une liste d'images en utilisant l'API Hugging Face de manière séquentielle.
+    Les masques sont sauvegardés en PNG, en RLE ou les deux selon mask_storage_format.
+    Avec tiled=True, la composition des masques et le rendu sont faits à mémoire bornée
+    (voir create_masks_tiled et render_result_tiled) pour les très grandes images.
+    Avec dedup=True, les quasi-doublons (hash perceptuel) réutilisent le masque de leur
+    image canonique au lieu d'appeler l'API.
+    Avec adaptive=True, les requêtes partent en parallèle sous le contrôle d'une limite de
+    concurrence adaptative et d'un disjoncteur (voir segment_images_adaptive).
+    Les masques, copies d'images et visuels sont écrits par un OutputWriter (voir src/writer.py).
     """
-   
-    for idx, img_path in enumerate(tqdm(list_of_image_paths, desc="Segmentation des images")):
-        image_filename = os.path.basename(img_path)
-        mask_filename = image_filename.replace("image", "mask").rsplit('.', 1)[0] + ".png"
-        print(f"\n--- Traitement de l'image {idx+1}/{len(list_of_image_paths)} ---")
-        print(f"Fichier: {image_filename}")
+    duplicates = find_near_duplicates(list_of_image_paths, dedup_max_distance) if dedup else {}
+    api_calls_avoided = 0
+    output_mask_dir = os.path.join(API_SEGMENTATION_OUTPUTS_DIR, "Mask")
+    presence_index = ClassPresenceIndex.load(index_path_for(output_mask_dir))
+
+    # Encodage et écriture des sorties en arrière-plan, en recouvrement avec les appels API
+    with OutputWriter() as writer:
+        if adaptive:
+            api_calls_avoided = segment_images_adaptive(list_of_image_paths, duplicates, mask_storage_format, tiled,
+                                                        model, presence_index, writer)
+        else:
+            for idx, img_path in enumerate(tqdm(list_of_image_paths, desc="Segmentation des images")):
+                image_filename = os.path.basename(img_path)
+                print(f"\n--- Traitement de l'image {idx+1}/{len(list_of_image_paths)} ---")
+                print(f"Fichier: {image_filename}")
+
+                if img_path in duplicates:
+                    canonical_path, distance = duplicates[img_path]
+                    os.makedirs(os.path.join(API_SEGMENTATION_OUTPUTS_DIR, "Mask"), exist_ok=True)
+                    os.makedirs(os.path.join(API_SEGMENTATION_OUTPUTS_DIR, "IMG"), exist_ok=True)
+                    if reuse_canonical_mask(img_path, canonical_path, mask_storage_format, writer):
+                        api_calls_avoided += 1
+                        print(f"Quasi-doublon de {os.path.basename(canonical_path)} (distance {distance}) : masque réutilisé")
+                        logger.info(f"Image: {image_filename} - Masque réutilisé depuis {os.path.basename(canonical_path)}")
+                        continue
+                    print("Masque canonique indisponible, appel de l'API...")
         
-        try:
-            # Obtenir les dimensions de l'image originale
-            width, height = get_image_dimensions(img_path)
-            print(f"Dimensions: {width}x{height}")
-            
-            # Appeler l'API avec le chemin de fichier (méthode qui fonctionne)
-            print("Envoi de la requête à l'API...")
-            start_time = time.time()
+                try:
+                    # Lecture unique de l'image : dimensions lues dans l'en-tête, même contenu
+                    # pour l'envoi à l'API et pour la copie de l'original
+                    image_data, width, height = read_image_file(img_path)
+                    print(f"Dimensions: {width}x{height}")
             
-            output = call_hf_segmentation_api(img_path)
+                    print("Envoi de la requête à l'API...")
+                    start_time = time.time()
             
-            end_time = time.time()
-            processing_time = end_time - start_time
-            print(f"Réponse reçue en {processing_time:.2f} secondes")
-            logger.info(f"Image: {os.path.basename(img_path)} - Processing Time: {processing_time:.2f} seconds")
+                    output = call_hf_segmentation_api(image_data, model=model)
             
-            # Vérifier la structure de la réponse
-            if isinstance(output, list) and len(output) > 0:
-                print(f"Nombre de segments détectés: {len(output)}")
-                
-                # Créer le masque de segmentation combiné avec palette et labels
-                print("Création du masque de segmentation...")
-                segmentation_result = create_masks(output, width, height)
-                combined_mask = segmentation_result
-                
-                # Statistiques du masque
-                unique_classes = np.unique(combined_mask)
-                print(f"Classes présentes: {unique_classes}")
-                
-                
-                print("Segmentation terminée avec succès")
-                logger.info(f"Image: {os.path.basename(img_path)} - Classes Detected: {unique_classes}")
-                
-                # Sauvegarder les résultats dans un répertoire spécifique
-                if not os.path.exists(API_SEGMENTATION_OUTPUTS_DIR):
-                    os.makedirs(API_SEGMENTATION_OUTPUTS_DIR, exist_ok=True)
-                    
-                seg_mask_np = np.array(combined_mask)
-                # Si le masque possède 3 canaux, le convertir en niveaux de gris
-                if seg_mask_np.ndim == 3:
-                    seg_mask_np = cv2.cvtColor(seg_mask_np, cv2.COLOR_BGR2GRAY)
-                    
-                output_mask_path = os.path.join(API_SEGMENTATION_OUTPUTS_DIR, "Mask", mask_filename)
-                os.makedirs(os.path.dirname(output_mask_path), exist_ok=True)
-                output_img_path = os.path.join(API_SEGMENTATION_OUTPUTS_DIR, "IMG", image_filename)
-                os.makedirs(os.path.dirname(output_img_path), exist_ok=True)
-
-                cv2.imwrite(output_mask_path, seg_mask_np)
-                
-                image_np = np.array(cv2.imread(img_path))
-                # # Conversion de l'image de RGB à BGR (pour cv2.imwrite)
-                # image_bgr = cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
-                
-                cv2.imwrite(output_img_path, image_np)
-
-                print(f"Sauvegardé: {mask_filename}")
-                
+                    end_time = time.time()
+                    processing_time = end_time - start_time
+                    print(f"Réponse reçue en {processing_time:.2f} secondes")
+                    logger.info(f"Image: {os.path.basename(img_path)} - Processing Time: {processing_time:.2f} seconds")
             
-            else:
-                print("Réponse API invalide")
+                    if not save_segmentation_output(img_path, output, width, height, mask_storage_format, tiled,
+                                                    presence_index, image_data, writer):
+                        print("Réponse API invalide")
 
-        except Exception as e:
-            print(f"Erreur lors du traitement de {img_path}: {e}")
+                except Exception as e:
+                    print(f"Erreur lors du traitement de {img_path}: {e}")
         
-        # Temporisation entre les requêtes pour éviter de surcharger l'API
-        if idx < len(list_of_image_paths) - 1:  # Pas de pause après la dernière image
-            print("Pause de 2 secondes avant la prochaine requête...")
-            time.sleep(2)
-            
-    # Création du visuel de comparaison
+                # Temporisation entre les requêtes pour éviter de surcharger l'API
+                if idx < len(list_of_image_paths) - 1:  # Pas de pause après la dernière image
+                    print("Pause de 2 secondes avant la prochaine requête...")
+                    time.sleep(2)
+
+        # Les masques doivent être sur disque avant la mise à jour du manifeste et des index
+        writer.flush()
+
+        if dedup:
+            save_dedup_report(duplicates, api_calls_avoided, len(list_of_image_paths),
+                              os.path.join(API_SEGMENTATION_OUTPUTS_DIR, "dedup_report.json"))
+            print(f"Appels API évités grâce à la déduplication : {api_calls_avoided}/{len(list_of_image_paths)}")
+            logger.info(f"Appels API évités grâce à la déduplication : {api_calls_avoided}/{len(list_of_image_paths)}")
+
+        finish_segmentation_batch(list_of_image_paths, presence_index, writer, tiled)
+
+
+def finish_segmentation_batch(image_names, presence_index, writer, tiled=False):
+    """
+    Fin d'un lot de segmentation (masques déjà sur disque) : statut dans le manifeste,
+    index de présence des classes et visuels de comparaison.
+    """
     output_mask_dir = os.path.join(API_SEGMENTATION_OUTPUTS_DIR, "Mask")
+
+    # Statut de segmentation dans le manifeste
+    with open_manifest() as manifest:
+        segmented = {entry['id'] for entry in manifest.entries() if entry['pred_mask_path'] or entry['pred_rle_path']}
+        batch_ids = [image_id_from_name(p) for p in image_names]
+        manifest.set_status([i for i in batch_ids if i in segmented], "segment", "done")
+        manifest.set_status([i for i in batch_ids if i not in segmented], "segment", "failed")
+
+    # Index de présence des classes (les masques réutilisés par déduplication sont lus ici)
+    if os.path.isdir(output_mask_dir):
+        presence_index.refresh(output_mask_dir)
+        presence_index.save(index_path_for(output_mask_dir))
+
+    # Création du visuel de comparaison
     output_img_dir = os.path.join(API_SEGMENTATION_OUTPUTS_DIR, "IMG")
-    save_results(output_img_dir, output_mask_dir, WWG_SEGMENTATION_OUTPUTS_DIR)
+    save_results(output_img_dir, output_mask_dir, WWG_SEGMENTATION_OUTPUTS_DIR, tiled=tiled, writer=writer)
+
+
+@memory_stage("segmentation")
+def segment_image_stream(source, mask_storage_format=MASK_STORAGE_FORMAT, tiled=False, model=DEFAULT_MODEL, limit=None):
+    """
+    Segmente les images d'une source (répertoire ou archive zip / tar) lues en flux, sans
+    extraction : chaque image est lue une fois en mémoire, envoyée à l'API puis écrite
+    telle quelle dans Output_API/IMG sous le nom image_N attribué par SourceIdAllocator.
+    Les numéros ne se chevauchent pas entre sources ni entre runs : une image dont le numéro
+    est déjà pris par une autre origine est signalée en erreur et enregistrée sous un numéro libre.
+
+    Returns:
+        list: Noms des images traitées.
+    """
+    total = count_source_images(source)
+    if limit is not None:
+        total = limit if total is None else min(total, limit)
+    output_mask_dir = os.path.join(API_SEGMENTATION_OUTPUTS_DIR, "Mask")
+    os.makedirs(output_mask_dir, exist_ok=True)
+    os.makedirs(os.path.join(API_SEGMENTATION_OUTPUTS_DIR, "IMG"), exist_ok=True)
+    presence_index = ClassPresenceIndex.load(index_path_for(output_mask_dir))
+    allocator = SourceIdAllocator(os.path.join(API_SEGMENTATION_OUTPUTS_DIR, "IMG"), SOURCE_IDS_FILE)
+    image_names = []
+
+    with OutputWriter() as writer:
+        images = islice(iter_source_images(source), limit)
+        for idx, (origin_path, image_data) in enumerate(tqdm(images, total=total, desc="Segmentation des images")):
+            if idx > 0:
+                # Temporisation entre les requêtes pour éviter de surcharger l'API
+                time.sleep(2)
+            image_id, collision = allocator.assign(origin_path)
+            allocator.save()  # Avant l'écriture des sorties : un run interrompu garde la trace du numéro
+            image_filename = f"image_{image_id}{os.path.splitext(origin_path)[1].lower()}"
+            if collision is not None:
+                message = f"Collision : image_{collision} est déjà pris, {origin_path} est enregistrée sous {image_filename}"
+                print(f"Erreur : {message}")
+                logger.error(message)
+            image_names.append(image_filename)
+            print(f"\n--- Traitement de l'image {idx+1} : {image_filename} ---")
+            try:
+                width, height = get_image_dimensions_from_bytes(image_data)
+                start_time = time.time()
+                output = call_hf_segmentation_api(image_data, model=model)
+                processing_time = time.time() - start_time
+                print(f"Réponse reçue en {processing_time:.2f} secondes")
+                logger.info(f"Image: {image_filename} ({source}) - Processing Time: {processing_time:.2f} seconds")
+                # Hors répertoire, origin_path n'existe pas sur disque : le contenu lu est écrit tel quel
+                if not save_segmentation_output(origin_path, output, width, height, mask_storage_format, tiled,
+                                                presence_index, image_data, writer, image_filename):
+                    print("Réponse API invalide")
+            except Exception as e:
+                print(f"Erreur lors du traitement de {image_filename}: {e}")
+
+        writer.flush()
+        finish_segmentation_batch(image_names, presence_index, writer, tiled)
+    return image_names
     
 
 
@@ -0,0 +1,501 @@
+import argparse
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+import numpy as np
+import cv2
+from .utils import get_logger, load_mask
+from .manifest import image_id_from_name
+from .presence_index import CLASS_BITS, update_presence_index, index_path_for
+from .evaluation import MASK_TRUE_DIR, MASK_PRED_DIR
+from .pipeline import DATASET_REPORT
+from .config import (CLASS_MAPPING, COLOR_MAPPING, SERVE_HOST, SERVE_PORT, SERVE_RELOAD_INTERVAL, SERVE_PAGE_SIZE,
+                     SERVE_MAX_PAGE_SIZE, SERVE_TILE_WIDTHS, SERVE_TILE_CACHE_MB, SERVE_TILE_MAX_AGE)
+
+logger = get_logger(__name__, __name__ + ".log")
+
+CLASS_NAMES = list(CLASS_MAPPING.keys())
+
+PALETTE = np.zeros((256, 3), dtype=np.uint8)  # Mêmes couleurs que les visuels de résultats
+for _label, _color in COLOR_MAPPING.items():
+    PALETTE[_label] = _color
+
+# État servi : remplacé d'un bloc à chaque rechargement, les requêtes en cours gardent l'ancien
+Snapshot = namedtuple('Snapshot', ['table', 'presence', 'joins'])
+
+
+class QueryError(Exception):
+    """Requête invalide ou ressource introuvable, retournée au client avec son statut HTTP"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def mask_name_for(key):
+    """Nom du masque d'une image quelle que soit la forme donnée (12, image_12, image_12.jpg, mask_12.png)"""
+    image_id = image_id_from_name(key)
+    if image_id is None:
+        raise QueryError(404, f"Image inconnue : {key}")
+    return f"mask_{image_id}.png"
+
+
+def _value(x):
+    """Flottant JSON (NaN -> None)"""
+    x = float(x)
+    return None if np.isnan(x) else x
+
+
+def _nan(x):
+    return np.nan if x is None else x
+
+
+class ResultTable:
+    """
+    Résultats par image du rapport d'évaluation en tableaux NumPy : Mean IoU, Pixel Accuracy et
+    matrice (n, 18) des IoU par classe (NaN si la classe n'est pas évaluée sur l'image). Les
+    filtres et classements sont des opérations vectorisées sur ces tableaux.
+    """
+
+    def __init__(self, records=(), summary=None, mtime=0.0):
+        self.records = list(records)
+        self.summary = summary or {}
+        self.mtime = mtime
+        self.names = [record['image'] for record in self.records]
+        self.rows = {name: row for row, name in enumerate(self.names)}
+        self.mean_iou = np.array([_nan(r['mean_iou']) for r in self.records], dtype=np.float64)
+        self.accuracy = np.array([_nan(r['accuracy']) for r in self.records], dtype=np.float64)
+        self.class_iou = np.full((len(self.records), len(CLASS_MAPPING)), np.nan)
+        for row, record in enumerate(self.records):
+            for score in record['iou_scores']:
+                self.class_iou[row, CLASS_MAPPING[score['class_name']]] = _nan(score['iou'])
+
+    def __len__(self):
+        return len(self.names)
+
+    def metric(self, name):
+        """Valeurs par image d'une métrique : mean_iou, accuracy ou nom d'une classe (IoU de la classe)"""
+        if name == 'mean_iou':
+            return self.mean_iou
+        if name == 'accuracy':
+            return self.accuracy
+        if name in CLASS_MAPPING:
+            return self.class_iou[:, CLASS_MAPPING[name]]
+        raise QueryError(400, f"Métrique inconnue : {name} (mean_iou, accuracy ou nom de classe)")
+
+    @classmethod
+    def load(cls, path):
+        """Charge la partie par image (et les métriques globales) d'un dataset_evaluation_report.json"""
+        mtime = os.path.getmtime(path)
+        with open(path, 'r') as f:
+            report = json.load(f)
+        summary = {key: report.get(key) for key in ('global_metrics', 'problematic_classes', 'approximation')}
+        return cls(report.get('per_image_results', []), summary, mtime)
+
+
+class TileCache:
+    """Cache LRU des tuiles encodées, borné en octets"""
+
+    def __init__(self, max_bytes=SERVE_TILE_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self.entries), 'bytes': self.size, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'hit_rate': self.hits / lookups if lookups else None}
+
+
+def tile_width_for(width):
+    """Largeur servie : plus petit niveau de SERVE_TILE_WIDTHS couvrant la largeur demandée"""
+    return next((w for w in SERVE_TILE_WIDTHS if w >= width), SERVE_TILE_WIDTHS[-1])
+
+
+def render_tile(label_map, width):
+    """Masque colorisé en PNG, réduit au plus proche voisin (sans mélange de labels) avant colorisation"""
+    height, mask_width = label_map.shape
+    if width < mask_width:
+        size = (width, max(1, round(height * width / mask_width)))
+        label_map = cv2.resize(label_map, size, interpolation=cv2.INTER_NEAREST)
+    ok, encoded = cv2.imencode('.png', PALETTE[label_map])
+    if not ok:
+        raise QueryError(500, "Encodage de la tuile impossible")
+    return encoded.tobytes()
+
+
+class QueryIndex:
+    """
+    Index en mémoire des résultats servis : table des résultats par image et index de présence
+    des classes des masques ground truth et prédits, joints par nom de masque.
+
+    reload() est incrémental : le rapport n'est relu que si sa date de modification a changé et
+    les index de présence ne relisent que les masques nouveaux ou modifiés. Le nouvel état est
+    construit à part puis publié d'un bloc, sans bloquer les requêtes en cours.
+    """
+
+    def __init__(self, report_path=DATASET_REPORT, mask_dirs=None):
+        self.report_path = report_path
+        self.mask_dirs = mask_dirs or {'pred': MASK_PRED_DIR, 'gt': MASK_TRUE_DIR}
+        self.lock = threading.Lock()  # Un seul rechargement à la fois
+        self.snapshot = Snapshot(ResultTable(), {}, {})
+        self.reloads = 0
+        self.loaded_at = None
+
+    def reload(self):
+        """
+        Returns:
+            dict: Ce qui a changé (rapport relu, masques (re)lus par source).
+        """
+        with self.lock:
+            start = time.perf_counter()
+            table, presence = self.snapshot.table, dict(self.snapshot.presence)
+            changes = {'report_reloaded': False, 'masks_read': {}}
+            if os.path.exists(self.report_path) and os.path.getmtime(self.report_path) != table.mtime:
+                try:
+                    table = ResultTable.load(self.report_path)
+                    changes['report_reloaded'] = True
+                except ValueError as e:  # Rapport en cours d'écriture : relu au prochain rechargement
+                    logger.warning(f"Rapport '{self.report_path}' illisible : {e}")
+            for source, mask_dir in self.mask_dirs.items():
+                if not os.path.isdir(mask_dir):
+                    continue
+                if source not in presence:
+                    presence[source] = update_presence_index(mask_dir)  # Chargé depuis le disque puis rafraîchi
+                    changes['masks_read'][source] = len(presence[source])
+                    continue
+                index = presence[source].copy()
+                read = index.refresh(mask_dir)
+                if read or len(index) != len(presence[source]):
+                    index.save(index_path_for(mask_dir))
+                    presence[source] = index
+                    changes['masks_read'][source] = read
+            if changes['report_reloaded'] or changes['masks_read']:
+                joins = {source: np.array([table.rows.get(name, -1) for name in index.names], dtype=np.int64)
+                         for source, index in presence.items()}
+                self.snapshot = Snapshot(table, presence, joins)
+            self.reloads += 1
+            self.loaded_at = time.time()
+            if changes['report_reloaded'] or changes['masks_read']:
+                logger.info(f"Rechargement en {(time.perf_counter() - start) * 1000:.1f} ms : {len(table)} image(s) "
+                            f"évaluée(s), masques (re)lus {changes['masks_read']}, rapport relu : {changes['report_reloaded']}")
+            return changes
+
+    def stats(self):
+        snapshot = self.snapshot
+        return {
+            'evaluated_images': len(snapshot.table),
+            'masks': {source: len(index) for source, index in snapshot.presence.items()},
+            'report': self.report_path if snapshot.table.mtime else None,
+            'reloads': self.reloads,
+            'loaded_at': self.loaded_at
+        }
+
+
+def _presence(snapshot, source):
+    if source not in snapshot.presence:
+        raise QueryError(404, f"Aucun masque indexé pour la source '{source}'")
+    return snapshot.presence[source], snapshot.joins[source]
+
+
+def _class_filter(params):
+    """Classes des paramètres with / without / any (noms séparés par des virgules)"""
+    filters = []
+    for key in ('with', 'without', 'any'):
+        names = [name for value in params.get(key, []) for name in value.split(',') if name]
+        unknown = [name for name in names if name not in CLASS_MAPPING]
+        if unknown:
+            raise QueryError(400, f"Classe(s) inconnue(s) : {', '.join(unknown)}")
+        filters.append(names)
+    return filters
+
+
+def _param(params, key, default, cast=str):
+    values = params.get(key)
+    if not values:
+        return default
+    try:
+        return cast(values[-1])
+    except ValueError:
+        raise QueryError(400, f"Paramètre invalide : {key}={values[-1]}")
+
+
+def _limit(params, key, default):
+    return min(max(_param(params, key, default, int), 0), SERVE_MAX_PAGE_SIZE)
+
+
+def _summary_row(table, row, name):
+    if row < 0:
+        return {'image': name, 'evaluated': False}
+    return {'image': name, 'evaluated': True, 'mean_iou': _value(table.mean_iou[row]),
+            'accuracy': _value(table.accuracy[row])}
+
+
+def query_images(snapshot, params):
+    """
+    /images : masques d'une source filtrés par classes présentes et, pour les images évaluées,
+    par Mean IoU (min_iou / max_iou), paginés (limit / offset).
+    """
+    source = _param(params, 'source', 'pred')
+    index, join = _presence(snapshot, source)
+    selected = index.select(*_class_filter(params))
+    min_iou, max_iou = _param(params, 'min_iou', None, float), _param(params, 'max_iou', None, float)
+    if _param(params, 'evaluated', 0, int) or min_iou is not None or max_iou is not None:
+        selected &= join >= 0
+        mean_iou = np.where(join >= 0, snapshot.table.mean_iou[np.maximum(join, 0)], np.nan)
+        if min_iou is not None:
+            selected &= mean_iou >= min_iou
+        if max_iou is not None:
+            selected &= mean_iou <= max_iou
+    rows = np.flatnonzero(selected)
+    offset, limit = max(_param(params, 'offset', 0, int), 0), _limit(params, 'limit', SERVE_PAGE_SIZE)
+    page = rows[offset:offset + limit]
+    return {
+        'source': source,
+        'total': len(rows),
+        'offset': offset,
+        'images': [_summary_row(snapshot.table, join[row], index.names[row]) for row in page]
+    }
+
+
+def query_ranking(snapshot, params):
+    """
+    /ranking : k pires (order=worst) ou meilleures (order=best) images évaluées selon une métrique
+    (mean_iou, accuracy ou IoU d'une classe), parmi celles dont les masques passent le filtre de classes.
+    """
+    table = snapshot.table
+    metric_name = _param(params, 'metric', 'mean_iou')
+    order = _param(params, 'order', 'worst')
+    if order not in ('worst', 'best'):
+        raise QueryError(400, "order : worst ou best")
+    k = _limit(params, 'k', 10)
+    values = table.metric(metric_name)
+    candidates = ~np.isnan(values)
+    class_filter = _class_filter(params)
+    if any(class_filter):
+        index, join = _presence(snapshot, _param(params, 'source', 'pred'))
+        matching = np.zeros(len(table), dtype=bool)
+        rows = join[index.select(*class_filter)]
+        matching[rows[rows >= 0]] = True
+        candidates &= matching
+    rows = np.flatnonzero(candidates)
+    scores = values[rows] if order == 'best' else -values[rows]
+    k = min(k, len(rows))
+    if k:
+        best = np.argpartition(-scores, k - 1)[:k]
+        rows = rows[best[np.argsort(-scores[best], kind='stable')]]
+    else:
+        rows = rows[:0]
+    return {
+        'metric': metric_name,
+        'order': order,
+        'candidates': int(candidates.sum()),
+        'images': [dict(_summary_row(table, row, table.names[row]), value=_value(values[row])) for row in rows]
+    }
+
+
+def query_image(snapshot, key):
+    """/images/<image> : enregistrement complet de l'évaluation et classes présentes par source"""
+    name = mask_name_for(key)
+    row = snapshot.table.rows.get(name)
+    classes = {}
+    for source, index in snapshot.presence.items():
+        index_row = index.rows.get(name)
+        if index_row is not None:
+            bits = index.bits[index_row]
+            classes[source] = [CLASS_NAMES[i] for i in np.flatnonzero(bits & CLASS_BITS)]
+    if row is None and not classes:
+        raise QueryError(404, f"Image inconnue : {key}")
+    return {
+        'image': name,
+        'evaluation': snapshot.table.records[row] if row is not None else None,
+        'classes': classes,
+        'tiles': {source: f"/tiles/{name}?source={source}" for source in classes}
+    }
+
+
+class QueryServer(ThreadingHTTPServer):
+    """Service HTTP local de requêtes sur les résultats (voir QueryHandler pour les routes)"""
+    daemon_threads = True
+
+    def __init__(self, address, index, cache=None):
+        super().__init__(address, QueryHandler)
+        self.index = index
+        self.cache = cache if cache is not None else TileCache()
+
+    def tile(self, snapshot, key, params):
+        """Tuile PNG (octets, ETag) d'un masque, rendue à la demande puis gardée dans le cache LRU"""
+        source = _param(params, 'source', 'pred')
+        index, _ = _presence(snapshot, source)
+        name = mask_name_for(key)
+        row = index.rows.get(name)
+        if row is None:
+            raise QueryError(404, f"Aucun masque '{source}' pour {key}")
+        width = tile_width_for(_param(params, 'width', SERVE_TILE_WIDTHS[0], int))
+        cache_key = (source, name, width, float(index.mtimes[row]))  # Un masque modifié change de clé
+        etag = f'"{source}-{name}-{width}-{index.mtimes[row]:.6f}"'
+        data = self.cache.get(cache_key)
+        if data is None:
+            label_map = load_mask(os.path.join(self.index.mask_dirs[source], name))
+            if label_map is None:
+                raise QueryError(404, f"Masque illisible : {name}")
+            data = render_tile(label_map, width)
+            self.cache.put(cache_key, data)
+        return data, etag
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    GET  /stats                  état des index et du cache de tuiles
+    GET  /summary                métriques globales du rapport d'évaluation
+    GET  /images                 ?source=pred|gt&with=Hat,Bag&without=Belt&any=...&evaluated=1&min_iou=&max_iou=&limit=&offset=
+    GET  /images/<image>         métriques et classes présentes d'une image (12, image_12, mask_12.png)
+    GET  /ranking                ?metric=mean_iou|accuracy|<classe>&order=worst|best&k=10 (+ filtres de classes)
+    GET  /tiles/<image>          ?source=pred|gt&width=256 : masque colorisé (PNG)
+    POST /reload                 prise en compte immédiate des nouveaux résultats
+    """
+
+    def do_GET(self):
+        start = time.perf_counter()
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        parts = [unquote(part) for part in url.path.strip('/').split('/') if part]
+        snapshot = self.server.index.snapshot
+        try:
+            if parts == ['stats']:
+                body = dict(self.server.index.stats(), tile_cache=self.server.cache.stats())
+            elif parts == ['summary']:
+                body = snapshot.table.summary
+            elif parts == ['images']:
+                body = query_images(snapshot, params)
+            elif len(parts) == 2 and parts[0] == 'images':
+                body = query_image(snapshot, parts[1])
+            elif parts == ['ranking']:
+                body = query_ranking(snapshot, params)
+            elif len(parts) == 2 and parts[0] == 'tiles':
+                data, etag = self.server.tile(snapshot, parts[1], params)
+                self.respond_tile(data, etag, start)
+                return
+            else:
+                raise QueryError(404, f"Route inconnue : {url.path}")
+            self.respond(200, body, start)
+        except QueryError as e:
+            self.respond(e.status, {'error': str(e)}, start)
+
+    def do_POST(self):
+        start = time.perf_counter()
+        if urlsplit(self.path).path.strip('/') != 'reload':
+            self.respond(404, {'error': f"Route inconnue : {self.path}"}, start)
+            return
+        changes = self.server.index.reload()
+        self.respond(200, dict(changes, **self.server.index.stats()), start)
+
+    def respond(self, status, body, start):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('X-Query-Time-Ms', f"{(time.perf_counter() - start) * 1000:.2f}")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def respond_tile(self, data, etag, start):
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', f"max-age={SERVE_TILE_MAX_AGE}")
+        self.send_header('X-Query-Time-Ms', f"{(time.perf_counter() - start) * 1000:.2f}")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.info(format % args)
+
+
+def _reload_loop(index, interval, stop):
+    while not stop.wait(interval):
+        try:
+            index.reload()
+        except Exception as e:
+            logger.warning(f"Rechargement impossible : {e}")
+
+
+def start_query_service(host=SERVE_HOST, port=SERVE_PORT, reload_interval=SERVE_RELOAD_INTERVAL,
+                        report_path=DATASET_REPORT, mask_dirs=None, background=False):
+    """
+    Charge les index en mémoire et démarre le service de requêtes. Les nouveaux résultats sont
+    pris en compte toutes les reload_interval secondes (0 : uniquement via POST /reload).
+
+    Returns:
+        QueryServer: Le serveur (servi dans un thread si background=True).
+    """
+    index = QueryIndex(report_path, mask_dirs)
+    index.reload()
+    server = QueryServer((host, port), index)
+    stats = index.stats()
+    print(f"Service de requêtes sur http://{host}:{server.server_port} ({stats['evaluated_images']} image(s) "
+          f"évaluée(s), masques indexés : {stats['masks']})")
+    stop = threading.Event()
+    if reload_interval:
+        threading.Thread(target=_reload_loop, args=(index, reload_interval, stop), daemon=True).start()
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stop.set()
+            server.server_close()
+            print(f"Cache de tuiles : {server.cache.stats()}")
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Service local de requêtes sur les résultats de segmentation')
+    parser.add_argument('--host', default=SERVE_HOST)
+    parser.add_argument('--port', type=int, default=SERVE_PORT)
+    parser.add_argument('--reload-interval', type=float, default=SERVE_RELOAD_INTERVAL,
+                        help='Secondes entre deux vérifications des nouveaux résultats (0 : POST /reload uniquement)')
+    parser.add_argument('--report', default=DATASET_REPORT)
+    args = parser.parse_args()
+    start_query_service(args.host, args.port, args.reload_interval, args.report)
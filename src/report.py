@@ -1,26 +1,30 @@
 import matplotlib.pyplot as plt
+import numpy as np
 from pathlib import Path
 import shutil
+from .manifest import open_manifest, image_id_from_name
+from .utils import memory_stage, select_result_image
+from .config import REPORT_IMAGE_WIDTH
 
 
 def copy_result_images(performance_ranking, output_dir, real_results_dir="content/top_influenceurs_2024/Real_Results"):
-    """Copie les images de résultats dans le dossier du rapport"""
+    """Copie dans le dossier du rapport le plus petit visuel suffisant (REPORT_IMAGE_WIDTH) des images extrêmes"""
     
     img_dir = output_dir / "img"
     real_results_path = Path(real_results_dir)
     
     image_paths = {}
+    worst_number = None
+    manifest = open_manifest(refresh=False)
     
     # Meilleure image
     if performance_ranking['best_5']:
         best_image = performance_ranking['best_5'][-1]['image']  # Dernière = meilleure
-        best_number = best_image.replace('mask_', '').replace('.png', '')
-        best_result = f"result_{best_number}.png"
+        best_number = image_id_from_name(best_image)
+        source_best = result_image_for(manifest, best_number, real_results_path)
         
-        source_best = real_results_path / best_result
-        dest_best = img_dir / f"best_{best_result}"
-        
-        if source_best.exists():
+        if source_best is not None:
+            dest_best = img_dir / f"best_{source_best.name}"
             shutil.copy2(source_best, dest_best)
             image_paths['best'] = f"img/{dest_best.name}"
             image_paths['titre_best_image'] = f"Best segmentation (Image {best_number})"
@@ -31,13 +35,11 @@ def copy_result_images(performance_ranking, output_dir, real_results_dir="conten
     # Pire image
     if performance_ranking['worst_5']:
         worst_image = performance_ranking['worst_5'][0]['image']  # Première = pire
-        worst_number = worst_image.replace('mask_', '').replace('.png', '')
-        worst_result = f"result_{worst_number}.png"
-        
-        source_worst = real_results_path / worst_result
-        dest_worst = img_dir / f"worst_{worst_result}"
+        worst_number = image_id_from_name(worst_image)
+        source_worst = result_image_for(manifest, worst_number, real_results_path)
         
-        if source_worst.exists():
+        if source_worst is not None:
+            dest_worst = img_dir / f"worst_{source_worst.name}"
             shutil.copy2(source_worst, dest_worst)
             image_paths['worst'] = f"img/{dest_worst.name}"
             image_paths['titre_worst_image'] = f"Problematic segmentation (Image {worst_number})"
@@ -45,8 +47,22 @@ def copy_result_images(performance_ranking, output_dir, real_results_dir="conten
             image_paths['worst'] = "*Image non trouvée*"
             image_paths['titre_worst_image'] = ""
     
+    manifest.close()
     return image_paths, worst_number
 
+def result_path_for(manifest, image_id, real_results_path):
+    """Chemin du rendu d'une image d'après le manifeste (nom par défaut si le rendu n'y figure pas)"""
+    entry = manifest.get(image_id)
+    if entry and entry['result_path']:
+        return Path(entry['result_path'])
+    return real_results_path / f"result_{image_id}.png"
+
+def result_image_for(manifest, image_id, real_results_path, min_width=REPORT_IMAGE_WIDTH):
+    """Plus petit visuel d'au moins min_width de large (niveau de la pyramide ou PNG pleine résolution), ou None"""
+    path = select_result_image(str(real_results_path), image_id, min_width,
+                               full_path=str(result_path_for(manifest, image_id, real_results_path)))
+    return Path(path) if path else None
+
 def format_worst_image_analysis(worst_mask_data):
     """Formate l'analyse détaillée de la pire image avec logique complète"""
     if not worst_mask_data:
@@ -170,6 +186,89 @@ Le modèle présente une stabilité {stability_level} avec un écart-type de ±{
 **Interprétation** : Les performances varient en moyenne de ±{std_iou*100:.1f}% entre les images.
 """
 
+def generate_confidence_analysis(json_data):
+    """Génère l'analyse des intervalles de confiance et de la cross-validation IoU"""
+    stability = json_data['stability_metrics']
+    intervals = stability.get('confidence_intervals')
+    cross_validation = stability.get('cross_validation_iou')
+    if not intervals or not intervals.get('mean_iou'):
+        return "*Intervalles de confiance non disponibles.*"
+
+    global_ci = intervals['mean_iou']
+    analysis = (f"**Mean IoU global** : IC {intervals['confidence']*100:.0f}% "
+                f"[{global_ci['low']*100:.1f}% ; {global_ci['high']*100:.1f}%] "
+                f"(largeur {global_ci['width']*100:.1f} pts, {intervals['n_resamples']} rééchantillonnages bootstrap)\n\n")
+    if cross_validation:
+        analysis += (f"**Cross-validation IoU** ({cross_validation['folds']} plis"
+                     f"{' stratifiés' if cross_validation['stratified'] else ''}) : "
+                     f"{cross_validation['mean_iou']*100:.1f}% ± {cross_validation['std_iou']*100:.1f}%\n\n")
+
+    analysis += "| Classe | IC bas | IC haut | Largeur |\n"
+    analysis += "|--------|--------|---------|---------|\n"
+    for class_name, ci in intervals['per_class'].items():
+        analysis += f"| {class_name} | {ci['low']*100:.1f}% | {ci['high']*100:.1f}% | {ci['width']*100:.1f} pts |\n"
+    return analysis
+
+def generate_confusion_analysis(json_data, confusion_chart=None):
+    """Génère l'accuracy hiérarchique et les principales confusions par niveau"""
+    confusion_analysis = json_data.get('confusion_analysis')
+    if not confusion_analysis:
+        return "*Matrice de confusion non disponible.*"
+    levels = confusion_analysis['levels']
+    level_titles = {'classes': "Classes", 'parts': "Parties (gauche/droite regroupés)", 'families': "Familles"}
+
+    analysis = f"![Matrice de confusion]({confusion_chart})\n\n" if confusion_chart else ""
+    analysis += "| Niveau | Pixel Accuracy |\n"
+    analysis += "|--------|----------------|\n"
+    for level, metrics in levels.items():
+        accuracy = f"{metrics['accuracy']:.1f}%" if metrics['accuracy'] is not None else "-"
+        analysis += f"| {level_titles.get(level, level)} | {accuracy} |\n"
+
+    for level, metrics in levels.items():
+        if not metrics['top_confusions']:
+            continue
+        analysis += f"\n**Principales confusions - {level_titles.get(level, level)}**\n\n"
+        analysis += "| Classe GT | Prédite comme | Pixels | % des pixels GT |\n"
+        analysis += "|-----------|---------------|--------|-----------------|\n"
+        for pair in metrics['top_confusions']:
+            analysis += f"| {pair['true']} | {pair['pred']} | {pair['pixels']:,} | {pair['rate']*100:.1f}% |\n"
+    return analysis
+
+def generate_instance_analysis(json_data):
+    """Génère la précision/rappel de détection et les erreurs de comptage des accessoires"""
+    instance_analysis = json_data.get('instance_analysis')
+    if not instance_analysis:
+        return "*Évaluation par instances non demandée (`-e --instances`).*"
+
+    def percent(value):
+        return f"{value*100:.1f}%" if value is not None else "-"
+
+    overall = instance_analysis['overall']
+    analysis = (f"Instances appariées si IoU ≥ {instance_analysis['iou_threshold']:.2f} "
+                f"(composantes de moins de {instance_analysis['min_area']} pixels ignorées). "
+                f"**Précision** : {percent(overall['precision'])} - **Rappel** : {percent(overall['recall'])} - "
+                f"**F1** : {percent(overall['f1'])}\n\n")
+    analysis += "| Classe | Instances GT | Prédites | Précision | Rappel | IoU appariées | Erreur de comptage | Comptage exact | Images manquées |\n"
+    analysis += "|--------|--------------|----------|-----------|--------|---------------|--------------------|----------------|-----------------|\n"
+    for class_name, stats in instance_analysis['per_class'].items():
+        analysis += (f"| {class_name} | {stats['gt_instances']} | {stats['pred_instances']} | {percent(stats['precision'])} | "
+                     f"{percent(stats['recall'])} | {percent(stats['mean_matched_iou'])} | {stats['count_mae']:.2f} | "
+                     f"{percent(stats['count_exact_rate'])} | {stats['missed_images']} |\n")
+    return analysis
+
+def generate_approximation_note(json_data):
+    """Avertissement et bornes d'erreur d'une évaluation approchée (vide pour une évaluation exacte)"""
+    approximation = json_data.get('approximation')
+    if not approximation:
+        return ""
+    note = (f"\n> ⚡ **Évaluation approchée** : masques réduits d'un facteur {approximation['factor']} "
+            f"({approximation['method']})")
+    if not approximation['calibrated']:
+        return note + ", bornes d'erreur non calibrées (`--calibrate-approx`).\n"
+    return note + (f", {approximation['pixel_fraction']*100:.1f}% des pixels évalués. Écart au calcul exact "
+                   f"≤ {approximation['mean_iou_bound']*100:.2f} pts de Mean IoU et "
+                   f"≤ {approximation['pixel_accuracy_bound']:.2f} pts de précision des pixels (calibration).\n")
+
 def generate_warning_analysis(json_data):
     """Génère l'analyse des classes problématiques"""
     problematic = json_data['problematic_classes']
@@ -203,6 +302,9 @@ def generate_charts(json_data, img_dir):
     # 3. Chart de fréquence des classes
     charts_paths['frequency'] = create_frequency_chart(json_data, img_dir)
     
+    # 4. Matrice de confusion du jeu de données
+    charts_paths['confusion'] = create_confusion_chart(json_data, img_dir)
+    
     return charts_paths
 
 def create_performance_chart(json_data, img_dir):
@@ -292,6 +394,32 @@ def create_frequency_chart(json_data, img_dir):
     
     return f"img/{chart_path.name}"
 
+def create_confusion_chart(json_data, img_dir):
+    """Crée la heatmap de la matrice de confusion normalisée par classe GT (hors Background GT)"""
+    confusion_analysis = json_data.get('confusion_analysis')
+    if not confusion_analysis:
+        return None
+    matrix = np.array(confusion_analysis['matrix'], dtype=np.float64)[1:, :]
+    class_names = confusion_analysis['class_names']
+    row_totals = matrix.sum(axis=1, keepdims=True)
+    normalized = np.divide(matrix, row_totals, out=np.zeros_like(matrix), where=row_totals > 0) * 100
+    
+    plt.figure(figsize=(12, 10))
+    plt.imshow(normalized, cmap='Blues', vmin=0, vmax=100)
+    plt.colorbar(label='% des pixels GT')
+    plt.xticks(range(len(class_names)), class_names, rotation=45, ha='right')
+    plt.yticks(range(len(class_names) - 1), class_names[1:])
+    plt.title('Matrice de Confusion (jeu de données)', fontsize=16, fontweight='bold')
+    plt.xlabel('Classe prédite', fontsize=12)
+    plt.ylabel('Classe GT', fontsize=12)
+    plt.tight_layout()
+    
+    chart_path = img_dir / "confusion_matrix.png"
+    plt.savefig(chart_path, dpi=300, bbox_inches='tight')
+    plt.close()
+    
+    return f"img/{chart_path.name}"
+
 def create_class_table(classes_list, title):
     """Crée un tableau Markdown pour les classes"""
     if not classes_list:
@@ -306,6 +434,7 @@ def create_class_table(classes_list, title):
     
     return table
 
+@memory_stage("fill_template_and_save")
 def fill_template_and_save(json_data, template_path="templates/template_report.md", output_dir="reports"):
     """Remplit le template et sauvegarde le rapport final"""
     
@@ -347,7 +476,7 @@ def fill_template_and_save(json_data, template_path="templates/template_report.m
     # Copier les images de résultats
     result_images, worst_number = copy_result_images(json_data['performance_ranking'], output_dir)
     # Nom de la pire image pour récuperer ses datas dans le json
-    worst_mask = f"mask_{worst_number}.png"
+    worst_mask = json_data['performance_ranking']['worst_5'][0]['image'] if json_data['performance_ranking']['worst_5'] else None
     worst_mask_data = next((img for img in json_data['per_image_results'] if img['image'] == worst_mask), None)    # Générer les tableaux et analyses
     # Formatage élégant des données de la pire image
     worst_mask_data_formatted = format_worst_image_analysis(worst_mask_data)
@@ -356,6 +485,9 @@ def fill_template_and_save(json_data, template_path="templates/template_report.m
     problematic_table = create_class_table(problematic_classes, "Problématiques")
     
     stability_analysis = generate_stability_analysis(json_data)
+    confidence_analysis = generate_confidence_analysis(json_data)
+    confusion_analysis = generate_confusion_analysis(json_data, charts_paths['confusion'])
+    instance_analysis = generate_instance_analysis(json_data)
     warning_classes = generate_warning_analysis(json_data)
     best_images_table = create_images_table(json_data['performance_ranking']['best_5'], "Meilleures")
     worst_images_table = create_images_table(json_data['performance_ranking']['worst_5'], "Pires")
@@ -363,6 +495,7 @@ def fill_template_and_save(json_data, template_path="templates/template_report.m
     # Remplacer les placeholders
     filled_template = template.format(
         total_images=global_metrics['total_images'],
+        approximation_note=generate_approximation_note(json_data),
         mean_iou_percent=mean_iou_percent,
         pixel_accuracy_percent=pixel_accuracy_percent,
         std_iou_percent=std_iou_percent,
@@ -370,6 +503,9 @@ def fill_template_and_save(json_data, template_path="templates/template_report.m
         good_classes_table=good_table,
         problematic_classes_table=problematic_table,
         stability_analysis=stability_analysis,
+        confidence_analysis=confidence_analysis,
+        confusion_analysis=confusion_analysis,
+        instance_analysis=instance_analysis,
         warning_classes=warning_classes,
         best_images_table=best_images_table,
         worst_images_table=worst_images_table,
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import numpy as np
+from .utils import get_logger
+from .manifest import image_id_from_name
+from .confusion import accumulate_confusion
+from .config import SHARD_OUTPUT_DIR
+
+logger = get_logger(__name__, __name__ + ".log")
+
+
+def shard_of(image_id, shard_count):
+    """Shard d'une image : hachage stable de son identifiant (indépendant de la machine et de l'ordre)"""
+    digest = hashlib.blake2b(str(image_id).encode('ascii'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shard_count
+
+
+def in_shard(image_id, shard):
+    """Vrai si l'image appartient au shard (index, nombre), ou si aucun shard n'est demandé"""
+    return shard is None or shard_of(image_id, shard[1]) == shard[0]
+
+
+def select_shard(paths, shard_index, shard_count):
+    """Chemins (images ou masques) appartenant au shard `shard_index` sur `shard_count`"""
+    return [p for p in paths if shard_of(image_id_from_name(p), shard_count) == shard_index]
+
+
+class OnlineStats:
+    """
+    Accumulateur de Welford (effectif, moyenne, somme des carrés des écarts), fusionnable :
+    la fusion de deux accumulateurs (formule de Chan) donne le même résultat qu'un
+    accumulateur unique ayant vu toutes les valeurs.
+    """
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def add(self, value):
+        if value is None or np.isnan(value):
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        return self
+
+    @property
+    def std(self):
+        return float(np.sqrt(self.m2 / self.count)) if self.count else None
+
+    def to_dict(self):
+        return {'count': self.count, 'mean': self.mean, 'm2': self.m2}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['count'], data['mean'], data['m2'])
+
+
+def _to_builtin(obj):
+    """Types NumPy -> types Python (les NaN sont conservés pour un aller-retour JSON exact)"""
+    if isinstance(obj, dict):
+        return {k: _to_builtin(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_to_builtin(v) for v in obj]
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj)
+    return obj
+
+
+def accumulate_stats(dataset_eval):
+    """Accumulateurs en ligne du Mean IoU, de la Pixel Accuracy et de l'IoU par classe"""
+    stats = {'mean_iou': OnlineStats(), 'pixel_accuracy': OnlineStats(), 'class_iou': {}}
+    for img in dataset_eval:
+        stats['mean_iou'].add(img['mean_iou'])
+        stats['pixel_accuracy'].add(img['accuracy'])
+        for score in img['iou_scores']:
+            stats['class_iou'].setdefault(score['class_name'], OnlineStats()).add(score['iou'])
+    return stats
+
+
+def _restore_record(img):
+    """Types d'origine d'un enregistrement relu (IoU en np.float64, matrices de confusion et d'instances en ndarray)"""
+    for score in img['iou_scores']:
+        score['iou'] = np.float64(np.nan if score['iou'] is None else score['iou'])
+    if 'confusion' in img:
+        img['confusion'] = np.asarray(img['confusion'], dtype=np.int64)
+    if 'instances' in img:
+        img['instances'] = np.asarray(img['instances'], dtype=np.float64)
+    return img
+
+
+def shard_output_path(shard_index, shard_count, output_dir=SHARD_OUTPUT_DIR):
+    return os.path.join(output_dir, f"shard_{shard_index}_of_{shard_count}.json")
+
+
+def write_shard_results(dataset_eval, shard_index, shard_count, output_dir=SHARD_OUTPUT_DIR):
+    """
+    Écrit les résultats partiels d'un shard : enregistrements par image (avec leur matrice de
+    confusion), matrice de confusion sommée et accumulateurs en ligne.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    stats = accumulate_stats(dataset_eval)
+    partial = {
+        'shard_index': shard_index,
+        'shard_count': shard_count,
+        'images': len(dataset_eval),
+        'confusion': accumulate_confusion(img['confusion'] for img in dataset_eval if 'confusion' in img),
+        'stats': {
+            'mean_iou': stats['mean_iou'].to_dict(),
+            'pixel_accuracy': stats['pixel_accuracy'].to_dict(),
+            'class_iou': {name: s.to_dict() for name, s in stats['class_iou'].items()}
+        },
+        'per_image_results': dataset_eval
+    }
+    path = shard_output_path(shard_index, shard_count, output_dir)
+    with open(path, 'w') as f:
+        json.dump(_to_builtin(partial), f)
+    logger.info(f"Shard {shard_index}/{shard_count} : {len(dataset_eval)} image(s) écrites dans '{path}'")
+    print(f"Résultats partiels du shard {shard_index}/{shard_count} : {path}")
+    return path
+
+
+def load_shard_files(sources):
+    """Fichiers de shards à partir d'une liste de fichiers et/ou de répertoires"""
+    files = []
+    for source in sources:
+        if os.path.isdir(source):
+            files += sorted(os.path.join(source, f) for f in os.listdir(source)
+                            if f.startswith("shard_") and f.endswith(".json"))
+        else:
+            files.append(source)
+    return files
+
+
+def merge_shard_results(sources):
+    """
+    Fusionne des résultats partiels de shards.
+
+    Les enregistrements par image sont triés par identifiant, comme lors d'une exécution sur
+    une seule machine, de sorte que analyze_dataset_eval produise le même rapport.
+
+    Returns:
+        tuple: (enregistrements par image, matrice de confusion sommée, accumulateurs fusionnés)
+    """
+    partials = []
+    for path in load_shard_files(sources):
+        with open(path, 'r') as f:
+            partials.append(json.load(f))
+    if not partials:
+        raise FileNotFoundError(f"Aucun résultat de shard trouvé dans {sources}")
+
+    counts = {p['shard_count'] for p in partials}
+    if len(counts) > 1:
+        raise ValueError(f"Shards issus de partitions différentes : {sorted(counts)}")
+    shard_count = counts.pop()
+    indices = sorted(p['shard_index'] for p in partials)
+    missing = sorted(set(range(shard_count)) - set(indices))
+    if missing:
+        logger.warning(f"Shards manquants : {missing} sur {shard_count}")
+        print(f"Attention : shard(s) manquant(s) {missing} sur {shard_count}, rapport partiel")
+    if len(indices) != len(set(indices)):
+        raise ValueError(f"Shard fourni plusieurs fois : {indices}")
+
+    dataset_eval = [_restore_record(img) for p in partials for img in p['per_image_results']]
+    dataset_eval.sort(key=lambda img: image_id_from_name(img['image']))
+    confusion = accumulate_confusion(p['confusion'] for p in partials)
+
+    stats = {'mean_iou': OnlineStats(), 'pixel_accuracy': OnlineStats(), 'class_iou': {}}
+    for p in partials:
+        stats['mean_iou'].merge(OnlineStats.from_dict(p['stats']['mean_iou']))
+        stats['pixel_accuracy'].merge(OnlineStats.from_dict(p['stats']['pixel_accuracy']))
+        for name, data in p['stats']['class_iou'].items():
+            stats['class_iou'].setdefault(name, OnlineStats()).merge(OnlineStats.from_dict(data))
+    print(f"{len(partials)} shard(s) fusionné(s) : {len(dataset_eval)} image(s), "
+          f"Mean IoU {stats['mean_iou'].mean:.4f} ± {stats['mean_iou'].std or 0:.4f}")
+    return dataset_eval, confusion, stats
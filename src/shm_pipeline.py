@@ -0,0 +1,407 @@
+import functools
+import multiprocessing as mp
+import queue
+import tracemalloc
+from multiprocessing import shared_memory
+import time
+import os
+import numpy as np
+import cv2
+from PIL import Image
+from tqdm import tqdm
+from .utils import (get_logger, write_result_renders, set_memory_profiler, get_memory_profiler, load_mask,
+                    local_dataset_pairs, is_archive, save_results, load_mask_rle, rle_path_for)
+from .evaluation import get_y_from_mask, compute_confusion_matrix, evaluate_pair_from_confusion, check_pairs_found
+from .manifest import open_manifest, image_id_from_name
+from .sharding import in_shard
+from .instances import instance_counts
+from .config import (SHM_DECODE_WORKERS, SHM_COMPUTE_WORKERS, SHM_SLOT_MB, SHM_SLOTS_PER_WORKER,
+                     SHM_POLL_SECONDS, RESULT_PYRAMID_WIDTHS)
+
+logger = get_logger(__name__, __name__ + ".log")
+
+
+def aligned_nbytes(nbytes):
+    """Taille occupée par un tableau dans un emplacement (alignement sur 64 octets)"""
+    return (nbytes + 63) // 64 * 64
+
+
+class SharedRingBuffer:
+    """
+    Tampon circulaire d'emplacements de taille fixe dans un bloc multiprocessing.shared_memory.
+
+    Les producteurs copient leurs tableaux NumPy dans un emplacement libre et ne transmettent
+    par les files que l'identifiant de l'emplacement et les métadonnées (décalage, forme, dtype) ;
+    les consommateurs construisent des vues sans copie sur ce même bloc. La file des emplacements
+    libres assure la contre-pression : un producteur attend tant qu'aucun emplacement n'est rendu.
+    """
+
+    def __init__(self, n_slots, slot_bytes, ctx=None):
+        ctx = ctx or mp.get_context()
+        self.n_slots = n_slots
+        self.slot_bytes = slot_bytes
+        self.shm = shared_memory.SharedMemory(create=True, size=n_slots * slot_bytes)
+        self.free_slots = ctx.Queue()
+        for slot in range(n_slots):
+            self.free_slots.put(slot)
+
+    def write(self, slot, arrays):
+        """Copie des tableaux dans un emplacement et retourne leurs métadonnées"""
+        meta = []
+        offset = slot * self.slot_bytes
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            view = np.ndarray(array.shape, dtype=array.dtype, buffer=self.shm.buf, offset=offset)
+            view[...] = array
+            meta.append((offset, array.shape, array.dtype.str))
+            offset += aligned_nbytes(array.nbytes)
+        return meta
+
+    def views(self, meta):
+        """Vues NumPy sans copie sur les tableaux d'un emplacement"""
+        return [np.ndarray(shape, dtype=np.dtype(dtype), buffer=self.shm.buf, offset=offset)
+                for offset, shape, dtype in meta]
+
+    def fits(self, arrays):
+        return sum(aligned_nbytes(np.asarray(a).nbytes) for a in arrays) <= self.slot_bytes
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _detach_memory_profiler():
+    """
+    Un processus forké hérite du profileur mémoire du parent, dont le verrou a pu être copié
+    alors qu'il était tenu par le thread d'échantillonnage RSS (absent de l'enfant) : le premier
+    appel profilé bloquerait. Les workers s'exécutent donc sans profilage.
+    """
+    set_memory_profiler(None)
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def _decode_worker(ring, tasks, ready, results, stats, decode_fn):
+    """Étage de décodage : lit les fichiers puis copie les tableaux dans un emplacement libre"""
+    _detach_memory_profiler()
+    busy = wait = 0.0
+    count = 0
+    start = time.perf_counter()
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        t0 = time.perf_counter()
+        try:
+            arrays = decode_fn(task)
+        except Exception as e:
+            results.put((task, None, f"{type(e).__name__}: {e}"))
+            busy += time.perf_counter() - t0
+            continue
+        busy += time.perf_counter() - t0
+
+        if not ring.fits(arrays):
+            # Taille sous-estimée : transmis par sérialisation (copie hors mémoire partagée) plutôt que d'échouer
+            message = (f"Attention : tâche {task[0]} ({sum(np.asarray(a).nbytes for a in arrays)} octets) plus grande "
+                       f"qu'un emplacement de {ring.slot_bytes} octets, transmise par copie hors mémoire partagée")
+            print(message)
+            logger.warning(message)
+            ready.put((task, None, arrays))
+            count += 1
+            continue
+
+        t1 = time.perf_counter()
+        slot = ring.free_slots.get()  # Contre-pression : bloque tant qu'aucun emplacement n'est libre
+        t2 = time.perf_counter()
+        meta = ring.write(slot, arrays)
+        del arrays
+        ready.put((task, slot, meta))
+        wait += t2 - t1
+        busy += time.perf_counter() - t2
+        count += 1
+    stats.put(('decode', os.getpid(), busy, wait, time.perf_counter() - start, count))
+
+
+def _compute_worker(ring, ready, results, stats, compute_fn):
+    """Étage de calcul : applique compute_fn sur des vues du tampon partagé puis libère l'emplacement"""
+    _detach_memory_profiler()
+    busy = wait = 0.0
+    count = 0
+    start = time.perf_counter()
+    while True:
+        t0 = time.perf_counter()
+        item = ready.get()
+        wait += time.perf_counter() - t0
+        if item is None:
+            break
+        task, slot, payload = item
+        t1 = time.perf_counter()
+        try:
+            arrays = payload if slot is None else ring.views(payload)
+            results.put((task, compute_fn(task, *arrays), None))
+        except Exception as e:
+            results.put((task, None, f"{type(e).__name__}: {e}"))
+        finally:
+            arrays = None
+            if slot is not None:
+                ring.free_slots.put(slot)
+        busy += time.perf_counter() - t1
+        count += 1
+    stats.put(('compute', os.getpid(), busy, wait, time.perf_counter() - start, count))
+
+
+def _get_checked(source, processes, poll=SHM_POLL_SECONDS):
+    """
+    Lit un élément d'une file en vérifiant régulièrement les processus : un worker arrêté
+    anormalement (OOM, segfault, kill) ne rendra jamais son résultat, l'attente s'arrête alors en erreur.
+    """
+    while True:
+        try:
+            return source.get(timeout=poll)
+        except queue.Empty:
+            failed = [p for p in processes if p.exitcode not in (None, 0)]
+            if failed:
+                raise RuntimeError("Arrêt anormal de processus du pipeline : " + ", ".join(
+                    f"{p.name} (pid {p.pid}, code {p.exitcode})" for p in failed))
+            if not any(p.is_alive() for p in processes):
+                raise RuntimeError("Tous les processus du pipeline sont terminés sans avoir rendu tous les résultats")
+
+
+def slot_bytes_for(tasks, task_nbytes, default_bytes):
+    """
+    Taille d'emplacement suffisante pour la plus grande tâche, d'après task_nbytes(task) (en-têtes
+    des fichiers, sans décodage) ; default_bytes si aucune taille n'a pu être estimée.
+    """
+    sizes = []
+    for task in tasks:
+        try:
+            sizes.append(task_nbytes(task))
+        except (OSError, ValueError, KeyError) as e:
+            # Fichier absent ou illisible : l'erreur sera rapportée par le décodage de la tâche
+            logger.warning(f"Taille de la tâche {task[0]} non estimée : {e}")
+    return max(sizes) if sizes else default_bytes
+
+
+def run_shared_memory_pipeline(tasks, decode_fn, compute_fn, decode_workers=SHM_DECODE_WORKERS,
+                               compute_workers=SHM_COMPUTE_WORKERS, slot_mb=SHM_SLOT_MB,
+                               slots_per_worker=SHM_SLOTS_PER_WORKER, desc="Pipeline", task_nbytes=None):
+    """
+    Exécute decode_fn puis compute_fn sur chaque tâche avec deux étages de processus reliés
+    par un tampon circulaire en mémoire partagée.
+
+    Args:
+        tasks (list): Tâches (objets sérialisables, ex. tuples de chemins).
+        decode_fn (callable): decode_fn(task) -> tuple de np.ndarray (fonction de niveau module).
+        compute_fn (callable): compute_fn(task, *arrays) -> résultat léger (fonction de niveau module).
+        decode_workers (int): Nombre de processus de décodage.
+        compute_workers (int): Nombre de processus de calcul.
+        slot_mb (int): Taille d'un emplacement en Mo, si task_nbytes n'est pas donné.
+        slots_per_worker (int): Emplacements par processus de calcul.
+        task_nbytes (callable): task_nbytes(task) -> octets occupés par les tableaux décodés de la tâche
+            (fonction de niveau module) ; les emplacements sont alors dimensionnés pour la plus grande tâche.
+
+    Returns:
+        tuple: (résultats [(task, result, error)] dans l'ordre d'arrivée, utilisation par étage)
+    """
+    if get_memory_profiler() is not None:
+        message = (f"{desc} : profilage mémoire limité au processus principal, les pics par image "
+                   f"des workers ne sont pas enregistrés")
+        print(message)
+        logger.warning(message)
+    slot_bytes = slot_mb * 1024 * 1024
+    if task_nbytes is not None:
+        slot_bytes = slot_bytes_for(tasks, task_nbytes, slot_bytes)
+    n_slots = max(1, compute_workers * slots_per_worker)
+    logger.info(f"{desc} : {n_slots} emplacement(s) de {slot_bytes / 1024 ** 2:.1f} Mo en mémoire partagée")
+    ctx = mp.get_context()
+    ring = SharedRingBuffer(n_slots, slot_bytes, ctx=ctx)
+    task_queue, ready, results, stats = ctx.Queue(), ctx.Queue(), ctx.Queue(), ctx.Queue()
+    for task in tasks:
+        task_queue.put(task)
+    for _ in range(decode_workers):
+        task_queue.put(None)
+
+    processes = [ctx.Process(target=_decode_worker, args=(ring, task_queue, ready, results, stats, decode_fn))
+                 for _ in range(decode_workers)]
+    processes += [ctx.Process(target=_compute_worker, args=(ring, ready, results, stats, compute_fn))
+                  for _ in range(compute_workers)]
+    start = time.perf_counter()
+    try:
+        for process in processes:
+            process.start()
+        # Chaque tâche produit exactement un résultat (éventuellement une erreur)
+        collected = [_get_checked(results, processes) for _ in tqdm(range(len(tasks)), desc=desc)]
+        for _ in range(compute_workers):
+            ready.put(None)
+        worker_stats = [_get_checked(stats, processes) for _ in processes]
+        for process in processes:
+            process.join()
+    except BaseException:
+        # Les files peuvent garder des éléments que plus personne ne lira : ne pas bloquer la sortie
+        for pending in (task_queue, ready, ring.free_slots):
+            pending.cancel_join_thread()
+        raise
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        ring.close()
+    wall = time.perf_counter() - start
+
+    utilization = summarize_utilization(worker_stats, wall)
+    for stage in ('decode', 'compute'):
+        stage_stats = utilization.get(stage)
+        if stage_stats is None:
+            continue
+        message = (f"Étage {stage} : {stage_stats['workers']} processus, utilisation {stage_stats['utilization']*100:.1f}%, "
+                   f"attente {stage_stats['wait_ratio']*100:.1f}%, {stage_stats['items']} élément(s)")
+        print(message)
+        logger.info(message)
+    return collected, utilization
+
+
+def summarize_utilization(worker_stats, wall):
+    """Agrège les temps occupés/en attente des processus par étage"""
+    utilization = {}
+    for stage in ('decode', 'compute'):
+        rows = [s for s in worker_stats if s[0] == stage]
+        if not rows:
+            continue
+        busy = sum(r[2] for r in rows)
+        wait = sum(r[3] for r in rows)
+        utilization[stage] = {
+            'workers': len(rows),
+            'items': sum(r[5] for r in rows),
+            'busy_seconds': busy,
+            'wait_seconds': wait,
+            'utilization': busy / (wall * len(rows)) if wall > 0 else 0.0,
+            'wait_ratio': wait / (wall * len(rows)) if wall > 0 else 0.0
+        }
+    utilization['wall_seconds'] = wall
+    return utilization
+
+
+def stored_image_size(path):
+    """(largeur, hauteur) d'une image ou d'un masque lue dans l'en-tête, ou dans le RLE d'un masque stocké uniquement en RLE"""
+    if os.path.exists(path):
+        with Image.open(path) as img:  # Lecture de l'en-tête uniquement
+            return img.size
+    height, width = load_mask_rle(rle_path_for(path))['size']
+    return width, height
+
+
+def mask_pair_nbytes(task):
+    """Octets des deux masques uint8 d'une tâche d'évaluation (dimensions du masque ground truth)"""
+    width, height = stored_image_size(task[1])
+    return 2 * aligned_nbytes(width * height)
+
+
+def image_and_mask_nbytes(task):
+    """Octets de l'image BGR et du masque uint8 d'une tâche de rendu"""
+    width, height = stored_image_size(task[0])
+    return aligned_nbytes(3 * width * height) + aligned_nbytes(width * height)
+
+
+def decode_mask_pair(task):
+    """
+    Lecture des masques ground truth et prédit d'une tâche (nom, chemin GT, chemin prédit) ;
+    un masque prédit stocké uniquement en RLE est décodé depuis son RLE (load_mask)
+    """
+    _, true_path, pred_path = task
+    return get_y_from_mask(true_path), get_y_from_mask(pred_path)
+
+
+def evaluate_mask_pair(task, y_true, y_pred, tiled=False, instances=False):
+    """
+    Métriques d'une paire de masques (même format que eval_dataset) ; avec tiled, matrice de confusion
+    accumulée par bandes, avec instances, comptes d'instances (eval_dataset(instances=True))
+    """
+    confusion = compute_confusion_matrix(y_true, y_pred, tiled=tiled)
+    mean_iou, iou_scores, accuracy, distributions_GT, distributions_Pred = evaluate_pair_from_confusion(confusion)
+    result = {
+        'image': task[0],
+        'mean_iou': mean_iou,
+        'iou_scores': iou_scores,
+        'accuracy': accuracy,
+        'distributions_GT': distributions_GT,
+        'distributions_Pred': distributions_Pred,
+        'confusion': confusion
+    }
+    if instances:
+        result['instances'] = instance_counts(y_true, y_pred)
+    return result
+
+
+def decode_image_and_mask(task):
+    """Lecture de l'image couleur et du masque (PNG ou RLE) d'une tâche (chemin image, chemin masque, sortie, idx, tiled)"""
+    img_path, mask_path = task[:2]
+    image = cv2.imread(img_path)
+    mask = load_mask(mask_path)
+    if image is None or mask is None:
+        raise FileNotFoundError(f"Could not read {img_path} or {mask_path}")
+    return image, mask
+
+
+def render_and_save(task, image, mask):
+    """Colorisation, superposition et écriture des visuels d'une tâche (write_result_renders, comme save_results)"""
+    _, _, output_dir, idx, tiled = task
+    write_result_renders(cv2.imwrite, output_dir, idx, image, mask, tiled=tiled)
+    return idx
+
+
+def eval_dataset_parallel(decode_workers=SHM_DECODE_WORKERS, compute_workers=SHM_COMPUTE_WORKERS, shard=None,
+                          instances=False, tiled=False):
+    """
+    Équivalent parallèle de eval_dataset : décodage des masques et calcul des métriques
+    dans des processus séparés, les masques transitant par la mémoire partagée.
+    Les masques prédits PNG et ceux stockés uniquement en RLE (--mask-format rle) sont évalués.
+    Si shard = (index, nombre), seules les images de ce shard sont évaluées.
+    Si instances est vrai, les comptes d'instances sont calculés dans les mêmes processus.
+    Si tiled est vrai, la matrice de confusion est accumulée par bandes (résultats identiques).
+    """
+    tasks = []
+    with open_manifest(refresh=False) as manifest:
+        pairs = [pair for pair in manifest.eval_pairs(include_rle=True) if in_shard(pair[0], shard)]
+    check_pairs_found(len(pairs), shard)
+    for image_id, true_mask_path, pred_mask_path in pairs:
+        if true_mask_path is None:
+            raise FileNotFoundError(f"Le masque ground truth de l'image {image_id} est introuvable.")
+        tasks.append((os.path.basename(pred_mask_path), true_mask_path, pred_mask_path))
+
+    print(f"\nEvaluation parallèle de {len(tasks)} masque(s)...")
+    compute_fn = functools.partial(evaluate_mask_pair, tiled=tiled, instances=instances)
+    collected, _ = run_shared_memory_pipeline(tasks, decode_mask_pair, compute_fn, decode_workers, compute_workers,
+                                              desc="Evaluation", task_nbytes=mask_pair_nbytes)
+    list_metrics_per_img = []
+    for task, result, error in collected:
+        if error is not None:
+            raise RuntimeError(f"Erreur lors de l'évaluation de {task[0]}: {error}")
+        list_metrics_per_img.append(result)
+    # Même ordre que eval_dataset (manifest.eval_pairs, par identifiant numérique : mask_2 avant mask_10)
+    list_metrics_per_img.sort(key=lambda r: image_id_from_name(r['image']))
+    return list_metrics_per_img
+
+
+def save_results_parallel(image_dir, mask_dir, output_dir, tiled=False, decode_workers=SHM_DECODE_WORKERS,
+                          compute_workers=SHM_COMPUTE_WORKERS):
+    """
+    Équivalent parallèle de save_results (même appariement par numéro, mêmes visuels : PNG pleine
+    résolution et pyramide) : lecture des paires et rendu dans des processus séparés.
+    Une archive zip / tar est lue en flux par save_results (séquentiel).
+    """
+    if is_archive(image_dir):
+        save_results(image_dir, mask_dir, output_dir, tiled=tiled)
+        return None
+    for directory in [output_dir] + [os.path.join(output_dir, f"w{width}") for width in RESULT_PYRAMID_WIDTHS]:
+        os.makedirs(directory, exist_ok=True)
+    tasks = [(img_path, mask_path, output_dir, idx, tiled)
+             for idx, img_path, mask_path in local_dataset_pairs(image_dir, mask_dir)]
+
+    collected, utilization = run_shared_memory_pipeline(tasks, decode_image_and_mask, render_and_save,
+                                                        decode_workers, compute_workers, desc="Rendu",
+                                                        task_nbytes=image_and_mask_nbytes)
+    for task, _, error in collected:
+        if error is not None:
+            print(f"Warning: {error}")
+    return utilization
@@ -0,0 +1,371 @@
+import os
+import numpy as np
+import cv2
+from tqdm import tqdm
+from .utils import get_logger, load_mask
+from .colors import bgr_to_lab
+from .manifest import scan_dir, image_id_from_name, IMAGE_EXTENSIONS
+from .presence_index import list_mask_files
+from .config import (CLASS_MAPPING, IMG_DIR, API_SEGMENTATION_OUTPUTS_DIR, COLOR_ANALYSIS_CLASSES, COLOR_MIN_PIXELS,
+                     SIMILARITY_INDEX_FILE, SIMILARITY_GRID_SIZE, SIMILARITY_COLOR_BINS, SIMILARITY_BLOCK_WEIGHTS,
+                     SIMILARITY_MAX_SCAN_PIXELS, SIMILARITY_TOP_K, SIMILARITY_MAX_SCORE_CELLS,
+                     SIMILARITY_IVF_MIN_VECTORS, SIMILARITY_IVF_LISTS_FACTOR, SIMILARITY_IVF_TRAIN_PER_LIST,
+                     SIMILARITY_IVF_ITERATIONS, SIMILARITY_IVF_NPROBE)
+
+logger = get_logger(__name__, __name__ + ".log")
+
+# Classes hors Background (une colonne par classe dans les blocs surface et disposition)
+N_CLASSES = len(CLASS_MAPPING) - 1
+
+# Emplacement de chaque classe dans le bloc couleur (-1 : classe sans histogramme de couleur)
+COLOR_SLOTS = np.full(len(CLASS_MAPPING), -1, dtype=np.int64)
+for _slot, _name in enumerate(COLOR_ANALYSIS_CLASSES):
+    COLOR_SLOTS[CLASS_MAPPING[_name]] = _slot
+N_COLOR_BINS = int(np.prod(SIMILARITY_COLOR_BINS))
+
+# Taille des blocs du descripteur, dans l'ordre de concaténation
+DESCRIPTOR_BLOCKS = {
+    'area': N_CLASSES,
+    'layout': SIMILARITY_GRID_SIZE * SIMILARITY_GRID_SIZE * N_CLASSES,
+    'color': len(COLOR_ANALYSIS_CLASSES) * N_COLOR_BINS
+}
+DESCRIPTOR_DIM = sum(DESCRIPTOR_BLOCKS.values())
+
+
+def index_path_for(mask_dir):
+    return os.path.join(mask_dir, SIMILARITY_INDEX_FILE)
+
+
+def image_key(name):
+    """Clé d'une image dans l'index (image_12.jpg, mask_12.png, 12 -> image_12)"""
+    image_id = image_id_from_name(str(name))
+    return None if image_id is None else f"image_{image_id}"
+
+
+def color_bins(points_lab, bins=SIMILARITY_COLOR_BINS):
+    """Indice de bin (L, a, b) de chaque point Lab (N, 3)"""
+    bins = np.asarray(bins)
+    lows = np.array([0.0, -128.0, -128.0], dtype=np.float32)
+    spans = np.array([100.0, 256.0, 256.0], dtype=np.float32)
+    cells = np.clip(((points_lab - lows) / spans * bins).astype(np.int64), 0, bins - 1)
+    return (cells[:, 0] * bins[1] + cells[:, 1]) * bins[2] + cells[:, 2]
+
+
+def outfit_descriptor(image, label_map, max_scan_pixels=SIMILARITY_MAX_SCAN_PIXELS,
+                      weights=SIMILARITY_BLOCK_WEIGHTS, min_pixels=COLOR_MIN_PIXELS):
+    """
+    Descripteur de taille fixe (DESCRIPTOR_DIM, float32) d'une tenue, calculé à partir du masque
+    et des pixels de l'image :
+    - surface : part de chaque classe dans la silhouette (pixels hors Background) ;
+    - disposition : part de chaque classe dans chaque cellule d'une grille G x G posée sur la boîte
+      englobante de la silhouette (insensible au cadrage et à la taille de la personne) ;
+    - couleur : histogramme Lab grossier de chaque vêtement de COLOR_ANALYSIS_CLASSES.
+
+    Chaque bloc est normalisé (L2) puis pondéré, et le vecteur final est de norme 1 :
+    le produit scalaire de deux descripteurs est une similarité cosinus pondérée par bloc.
+    Un masque sans silhouette donne le vecteur nul.
+    """
+    if image.shape[:2] != label_map.shape[:2]:
+        raise ValueError(f"Dimensions incompatibles entre l'image {image.shape[:2]} et le masque {label_map.shape[:2]}")
+    # Sous-échantillonnage régulier (vue sans copie) pour borner le nombre de pixels parcourus
+    height, width = label_map.shape[:2]
+    stride = max(1, int(np.ceil(np.sqrt(height * width / max_scan_pixels))))
+    labels = label_map[::stride, ::stride]
+    ys, xs = np.nonzero(labels)
+    vector = np.zeros(DESCRIPTOR_DIM, dtype=np.float32)
+    if len(ys) == 0:
+        return vector
+    class_ids = labels[ys, xs].astype(np.int64)
+
+    area = np.bincount(class_ids - 1, minlength=N_CLASSES).astype(np.float64)
+
+    grid = SIMILARITY_GRID_SIZE
+    y0, x0 = ys.min(), xs.min()
+    rows = (ys - y0) * grid // (ys.max() + 1 - y0)
+    cols = (xs - x0) * grid // (xs.max() + 1 - x0)
+    layout = np.bincount((rows * grid + cols) * N_CLASSES + class_ids - 1,
+                         minlength=DESCRIPTOR_BLOCKS['layout']).astype(np.float64)
+
+    slots = COLOR_SLOTS[class_ids]
+    colored = slots >= 0
+    color = np.zeros((len(COLOR_ANALYSIS_CLASSES), N_COLOR_BINS))
+    if colored.any():
+        points = bgr_to_lab(image[::stride, ::stride][ys[colored], xs[colored]])
+        color = np.bincount(slots[colored] * N_COLOR_BINS + color_bins(points),
+                            minlength=color.size).reshape(color.shape).astype(np.float64)
+        counts = color.sum(axis=1, keepdims=True)
+        # Histogramme normalisé par vêtement : la couleur compte autant quelle que soit la surface
+        color = np.where(counts * stride * stride >= min_pixels, color / np.maximum(counts, 1), 0.0)
+
+    offset = 0
+    for name, block in (('area', area), ('layout', layout), ('color', color.ravel())):
+        norm = np.linalg.norm(block)
+        if norm > 0:
+            vector[offset:offset + len(block)] = block / norm * np.sqrt(weights.get(name, 1.0))
+        offset += len(block)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def _chunk_rows(n_columns, max_cells=SIMILARITY_MAX_SCORE_CELLS):
+    """Nombre de lignes d'une matrice de scores (lignes x n_columns) calculée en une fois"""
+    return max(1, max_cells // max(1, n_columns))
+
+
+def _top_k(scores, k):
+    """Indices des k meilleurs scores de chaque ligne, triés par score décroissant"""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.empty((len(scores), 0), dtype=np.int64)
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(best, order, axis=1)
+
+
+def nearest_centroids(vectors, centroids, count=1):
+    """Indices des `count` centroïdes de plus grand produit scalaire pour chaque vecteur (par blocs)"""
+    nearest = np.empty((len(vectors), min(count, len(centroids))), dtype=np.int64)
+    step = _chunk_rows(len(centroids))
+    for start in range(0, len(vectors), step):
+        scores = vectors[start:start + step] @ centroids.T
+        nearest[start:start + step] = _top_k(scores, count) if count > 1 else scores.argmax(axis=1)[:, None]
+    return nearest
+
+
+def spherical_kmeans(points, k, max_iter=SIMILARITY_IVF_ITERATIONS, rng=None):
+    """
+    K-means sphérique (centroïdes de norme 1, affectation par produit scalaire maximal) pour la
+    quantification grossière de l'index IVF. Initialisation aléatoire : contrairement à
+    l'initialisation k-means++ de kmeans_lab, son coût ne dépend pas du nombre de listes.
+
+    Returns:
+        np.ndarray: Centroïdes (k, d) en float32.
+    """
+    rng = rng if rng is not None else np.random.default_rng(0)
+    points = np.asarray(points, dtype=np.float32)
+    k = min(k, len(points))
+    centroids = points[rng.choice(len(points), size=k, replace=False)].copy()
+    labels = None
+    for _ in range(max_iter):
+        new_labels = nearest_centroids(points, centroids)[:, 0]
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        # Sommes par cluster en un seul passage (tri puis réduction par segments)
+        order = np.argsort(labels, kind='stable')
+        present, starts = np.unique(labels[order], return_index=True)
+        sums = np.add.reduceat(points[order], starts, axis=0)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids[present] = sums / np.maximum(norms, 1e-12)
+        empty = np.setdiff1d(np.arange(k), present)
+        if len(empty):  # Cluster vide : réinitialisé sur un point tiré au hasard
+            centroids[empty] = points[rng.choice(len(points), size=len(empty), replace=False)]
+    return centroids
+
+
+class OutfitIndex:
+    """
+    Index de similarité des tenues : un descripteur par image dans une matrice float32 contiguë
+    (n, DESCRIPTOR_DIM), la liste des noms servant de correspondance ligne -> image.
+
+    La recherche exacte est un produit matriciel par blocs de requêtes suivi d'un top-k par
+    argpartition. Au-delà de SIMILARITY_IVF_MIN_VECTORS images, un index IVF (centroïdes d'un
+    k-means sphérique et listes inversées) limite chaque requête aux listes des `nprobe`
+    centroïdes les plus proches.
+
+    Persisté en .npz et mis à jour de façon incrémentale : seules les images dont l'image ou le
+    masque a été modifié depuis leur indexation sont relues.
+    """
+
+    def __init__(self, names=None, vectors=None, mtimes=None, centroids=None, assignments=None):
+        self.names = list(names) if names is not None else []
+        self.vectors = np.ascontiguousarray(vectors if vectors is not None else np.empty((0, DESCRIPTOR_DIM)),
+                                            dtype=np.float32)
+        self.mtimes = np.asarray(mtimes if mtimes is not None else [], dtype=np.float64)
+        self.centroids = None if centroids is None or len(centroids) == 0 else np.asarray(centroids, dtype=np.float32)
+        self.assignments = None
+        if self.centroids is not None:
+            self.assignments = (np.asarray(assignments, dtype=np.int64) if assignments is not None
+                                else nearest_centroids(self.vectors, self.centroids)[:, 0])
+        self.rows = {name: row for row, name in enumerate(self.names)}
+        self._lists = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def update_many(self, names, vectors, mtimes):
+        """Ajoute ou remplace les descripteurs de plusieurs images (une seule réallocation de la matrice)"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, DESCRIPTOR_DIM)
+        mtimes = np.asarray(mtimes, dtype=np.float64)
+        existing = np.array([name in self.rows for name in names], dtype=bool)
+        replaced = [self.rows[name] for name, known in zip(names, existing) if known]
+        self.vectors[replaced] = vectors[existing]
+        self.mtimes[replaced] = mtimes[existing]
+        for name in (name for name, known in zip(names, existing) if not known):
+            self.rows[name] = len(self.names)
+            self.names.append(name)
+        self.vectors = np.concatenate([self.vectors, vectors[~existing]])
+        self.mtimes = np.concatenate([self.mtimes, mtimes[~existing]])
+        if self.centroids is not None:
+            new_assignments = nearest_centroids(vectors, self.centroids)[:, 0]
+            self.assignments[replaced] = new_assignments[existing]
+            self.assignments = np.concatenate([self.assignments, new_assignments[~existing]])
+        self._lists = None
+
+    def remove(self, names):
+        names = set(names)
+        keep = np.array([name not in names for name in self.names], dtype=bool)
+        self.names = [name for name in self.names if name not in names]
+        self.vectors, self.mtimes = np.ascontiguousarray(self.vectors[keep]), self.mtimes[keep]
+        if self.assignments is not None:
+            self.assignments = self.assignments[keep]
+        self.rows = {name: row for row, name in enumerate(self.names)}
+        self._lists = None
+
+    def refresh(self, image_dir, mask_dir):
+        """
+        Synchronise l'index avec un répertoire d'images et de masques : calcule le descripteur
+        des images nouvelles ou modifiées et retire les images disparues.
+
+        Returns:
+            int: Nombre de descripteurs (re)calculés.
+        """
+        images = scan_dir(image_dir, IMAGE_EXTENSIONS)
+        # {id: (chemin PNG lu par load_mask, fichier présent : PNG ou seulement RLE)}
+        masks = {image_id_from_name(name): (os.path.join(mask_dir, name), path)
+                 for name, path in list_mask_files(mask_dir).items()}
+        pairs = {f"image_{image_id}": (images[image_id], *masks[image_id])
+                 for image_id in sorted(set(images) & set(masks))}
+        self.remove([name for name in self.names if name not in pairs])
+
+        stale = []
+        for name, (img_path, mask_path, mask_file) in pairs.items():
+            mtime = max(os.path.getmtime(img_path), os.path.getmtime(mask_file))
+            row = self.rows.get(name)
+            if row is None or self.mtimes[row] < mtime:
+                stale.append((name, img_path, mask_path, mtime))
+
+        names, vectors, mtimes = [], [], []
+        for name, img_path, mask_path, mtime in tqdm(stale, desc="Descripteurs de tenues"):
+            image, mask = cv2.imread(img_path), load_mask(mask_path)
+            if image is None or mask is None:
+                logger.warning(f"Image ou masque illisible : {img_path}, {mask_path}")
+                continue
+            names.append(name)
+            vectors.append(outfit_descriptor(image, mask))
+            mtimes.append(mtime)
+        if names:
+            self.update_many(names, np.stack(vectors), mtimes)
+        return len(names)
+
+    def train_ivf(self, n_lists=None, rng=None):
+        """
+        Construit l'index IVF : centroïdes appris sur un échantillon des descripteurs
+        (SIMILARITY_IVF_TRAIN_PER_LIST par liste) puis affectation de chaque image à sa liste.
+        """
+        rng = rng if rng is not None else np.random.default_rng(0)
+        n = len(self)
+        if n == 0:
+            return
+        n_lists = n_lists or max(1, int(SIMILARITY_IVF_LISTS_FACTOR * np.sqrt(n)))
+        sample_size = min(n, n_lists * SIMILARITY_IVF_TRAIN_PER_LIST)
+        sample = self.vectors[np.sort(rng.choice(n, size=sample_size, replace=False))]
+        self.centroids = spherical_kmeans(sample, n_lists, rng=rng)
+        self.assignments = nearest_centroids(self.vectors, self.centroids)[:, 0]
+        self._lists = None
+        logger.info(f"Index IVF : {len(self.centroids)} liste(s) apprises sur {sample_size} descripteur(s)")
+
+    def inverted_lists(self):
+        """(lignes triées par liste, début de chaque liste) : la liste l couvre order[starts[l]:starts[l + 1]]"""
+        if self._lists is None:
+            order = np.argsort(self.assignments, kind='stable')
+            starts = np.concatenate([[0], np.cumsum(np.bincount(self.assignments, minlength=len(self.centroids)))])
+            self._lists = (order, starts)
+        return self._lists
+
+    def search(self, queries, k=SIMILARITY_TOP_K, nprobe=None):
+        """
+        Top-k des images les plus similaires à chaque descripteur requête.
+
+        Args:
+            queries (np.ndarray): Descripteurs (q, DESCRIPTOR_DIM) ou (DESCRIPTOR_DIM,).
+            k (int): Nombre de résultats par requête.
+            nprobe (int, optional): Listes IVF parcourues ; None ou index IVF absent : recherche exacte.
+
+        Returns:
+            list: Pour chaque requête, [(nom, score)] par score décroissant.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, DESCRIPTOR_DIM)
+        if len(self) == 0:
+            return [[] for _ in queries]
+        if nprobe is None or self.centroids is None:
+            results = []
+            step = _chunk_rows(len(self))
+            for start in range(0, len(queries), step):
+                scores = queries[start:start + step] @ self.vectors.T
+                best = _top_k(scores, k)
+                results.extend(zip(best, np.take_along_axis(scores, best, axis=1)))
+        else:
+            order, starts = self.inverted_lists()
+            probes = nearest_centroids(queries, self.centroids, nprobe)
+            results = []
+            for query, lists in zip(queries, probes):
+                candidates = np.concatenate([order[starts[l]:starts[l + 1]] for l in lists])
+                scores = (self.vectors[candidates] @ query)[None, :]
+                best = _top_k(scores, k)[0]
+                results.append((candidates[best], scores[0, best]))
+        return [[(self.names[row], float(score)) for row, score in zip(rows, scores)] for rows, scores in results]
+
+    def similar_to(self, name, k=SIMILARITY_TOP_K, nprobe=None):
+        """Top-k des images les plus similaires à une image de l'index (l'image elle-même exclue)"""
+        key = image_key(name)
+        if key not in self.rows:
+            raise KeyError(f"Image '{name}' absente de l'index de similarité")
+        matches = self.search(self.vectors[self.rows[key]], k + 1, nprobe)[0]
+        return [match for match in matches if match[0] != key][:k]
+
+    def save(self, path):
+        empty = np.empty((0, DESCRIPTOR_DIM), dtype=np.float32)
+        np.savez(path, names=np.array(self.names, dtype=str), vectors=self.vectors, mtimes=self.mtimes,
+                 centroids=self.centroids if self.centroids is not None else empty,
+                 assignments=self.assignments if self.assignments is not None else np.empty(0, dtype=np.int64))
+
+    @classmethod
+    def load(cls, path):
+        """Charge un index sauvegardé, ou retourne un index vide s'il n'existe pas ou si la taille des descripteurs a changé"""
+        if not os.path.exists(path):
+            return cls()
+        with np.load(path) as data:
+            if data['vectors'].shape[1:] != (DESCRIPTOR_DIM,):
+                logger.warning(f"Taille de descripteur différente dans '{path}' : index reconstruit")
+                return cls()
+            return cls(data['names'].tolist(), data['vectors'], data['mtimes'], data['centroids'], data['assignments'])
+
+
+def update_similarity_index(image_dir=IMG_DIR, mask_dir=os.path.join(API_SEGMENTATION_OUTPUTS_DIR, "Mask"), ivf=None):
+    """
+    Met à jour (incrémentalement) et sauvegarde l'index de similarité d'un répertoire de masques.
+    ivf=True force la (re)construction de l'index IVF ; None le construit automatiquement
+    au-delà de SIMILARITY_IVF_MIN_VECTORS images s'il n'existe pas encore.
+    """
+    index = OutfitIndex.load(index_path_for(mask_dir))
+    computed = index.refresh(image_dir, mask_dir)
+    if ivf or (ivf is None and index.centroids is None and len(index) >= SIMILARITY_IVF_MIN_VECTORS):
+        index.train_ivf()
+    index.save(index_path_for(mask_dir))
+    logger.info(f"Index de similarité de '{mask_dir}' : {len(index)} image(s), {computed} descripteur(s) calculé(s)")
+    return index
+
+
+def print_similar_outfits(index, names, k=SIMILARITY_TOP_K, nprobe=SIMILARITY_IVF_NPROBE):
+    """Affiche les tenues les plus similaires à chaque image demandée"""
+    for name in names:
+        try:
+            matches = index.similar_to(name, k, nprobe)
+        except KeyError as e:
+            print(e.args[0])
+            continue
+        print(f"\nTenues similaires à {image_key(name)} :")
+        for rank, (match, score) in enumerate(matches, start=1):
+            print(f"{rank:>3}. {match:<16} {score:.4f}")
+        logger.info(f"Similaires à {image_key(name)} : {matches}")
@@ -0,0 +1,198 @@
+import numpy as np
+from .utils import get_logger
+from .config import CLASS_MAPPING, STABILITY_BOOTSTRAP_RESAMPLES, STABILITY_CONFIDENCE, STABILITY_FOLDS
+
+logger = get_logger(__name__, 'report.log')
+
+# Vêtement principal utilisé comme strate (l'image est rangée selon le plus présent en GT)
+STRATA_CLASSES = ["Dress", "Skirt", "Pants", "Upper-clothes"]
+
+# Nombre maximal de cellules de la matrice de poids traitées en une fois
+MAX_WEIGHT_CELLS = 20_000_000
+
+
+def per_image_matrix(dataset_eval):
+    """
+    Convertit les résultats par image en tableaux NumPy.
+
+    Returns:
+        tuple: (mean IoU par image (n,), IoU par classe (n, C) avec NaN si non défini, noms des classes)
+    """
+    class_names = [name for name in CLASS_MAPPING if name != 'Background']
+    mean_ious = np.array([img['mean_iou'] for img in dataset_eval], dtype=np.float64)
+    class_ious = np.full((len(dataset_eval), len(class_names)), np.nan)
+    column = {name: i for i, name in enumerate(class_names)}
+    for row, img in enumerate(dataset_eval):
+        for score in img['iou_scores']:
+            if score['class_name'] in column and score['iou'] is not None:
+                class_ious[row, column[score['class_name']]] = score['iou']
+    return mean_ious, class_ious, class_names
+
+
+def _weighted_means(weights, values):
+    """
+    Moyennes (en ignorant les NaN) de `values` (n, C) pour chaque ligne de poids (R, n),
+    calculées par produit matriciel.
+    """
+    valid = ~np.isnan(values)
+    sums = weights @ np.where(valid, values, 0.0)
+    counts = weights @ valid.astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
+
+
+def bootstrap_means(mean_ious, class_ious, n_resamples=STABILITY_BOOTSTRAP_RESAMPLES, rng=None):
+    """
+    Moyennes bootstrap du Mean IoU global et par classe.
+
+    Tous les rééchantillonnages sont tirés en une seule matrice d'indices (R, n), convertie
+    en matrice de poids (nombre de tirages de chaque image) : les moyennes de tous les
+    rééchantillonnages s'obtiennent alors par un seul produit matriciel, sans boucle Python
+    sur les rééchantillonnages.
+
+    Returns:
+        tuple: (moyennes globales (R,), moyennes par classe (R, C))
+    """
+    rng = rng if rng is not None else np.random.default_rng(0)
+    n = len(mean_ious)
+    values = np.column_stack([mean_ious, class_ious])
+    indices = rng.integers(0, n, size=(n_resamples, n))
+    chunk = max(1, MAX_WEIGHT_CELLS // max(1, n))
+    means = np.empty((n_resamples, values.shape[1]))
+    for start in range(0, n_resamples, chunk):
+        rows = indices[start:start + chunk]
+        weights = np.zeros((len(rows), n))
+        np.add.at(weights, (np.arange(len(rows))[:, None], rows), 1.0)
+        means[start:start + len(rows)] = _weighted_means(weights, values)
+    return means[:, 0], means[:, 1:]
+
+
+def _interval(samples, confidence):
+    """Intervalle percentile d'échantillons bootstrap (NaN ignorés)"""
+    alpha = (1.0 - confidence) / 2.0
+    samples = samples[~np.isnan(samples)]
+    if len(samples) == 0:
+        return None
+    low, high = np.percentile(samples, [alpha * 100, (1 - alpha) * 100])
+    return {'low': float(low), 'high': float(high), 'width': float(high - low)}
+
+
+def bootstrap_confidence_intervals(dataset_eval, n_resamples=STABILITY_BOOTSTRAP_RESAMPLES,
+                                   confidence=STABILITY_CONFIDENCE, rng=None):
+    """
+    Intervalles de confiance bootstrap (percentile) du Mean IoU global et par classe.
+    """
+    mean_ious, class_ious, class_names = per_image_matrix(dataset_eval)
+    global_means, class_means = bootstrap_means(mean_ious, class_ious, n_resamples, rng)
+    results = {
+        'confidence': confidence,
+        'n_resamples': n_resamples,
+        'mean_iou': _interval(global_means, confidence),
+        'per_class': {}
+    }
+    for i, class_name in enumerate(class_names):
+        interval = _interval(class_means[:, i], confidence)
+        if interval is not None:
+            results['per_class'][class_name] = interval
+    logger.info(f"IC bootstrap {confidence*100:.0f}% du Mean IoU : {results['mean_iou']}")
+    return results
+
+
+def image_strata(dataset_eval):
+    """
+    Strate de chaque image : vêtement principal (le plus de pixels GT parmi STRATA_CLASSES) ou 'Other'.
+    """
+    strata = []
+    for img in dataset_eval:
+        counts = {d['class_name']: d['count'] for d in img.get('distributions_GT', []) if d['class_name'] in STRATA_CLASSES}
+        strata.append(max(counts, key=counts.get) if counts else 'Other')
+    return np.array(strata)
+
+
+def _fold_assignment(strata, k, rng):
+    """Affecte chaque image à un pli, en répartissant chaque strate équitablement entre les plis"""
+    n = len(strata)
+    order = rng.permutation(n)
+    order = order[np.argsort(strata[order], kind='stable')]  # Regroupe les strates, ordre aléatoire à l'intérieur
+    folds = np.empty(n, dtype=np.int64)
+    folds[order] = np.arange(n) % k
+    return folds
+
+
+def cross_validation_iou(dataset_eval, k=STABILITY_FOLDS, stratified=True, rng=None):
+    """
+    Cross-validation IoU : Mean IoU global et par classe sur k plis (stratifiés par vêtement
+    principal), moyenne et écart-type entre plis.
+    """
+    rng = rng if rng is not None else np.random.default_rng(0)
+    mean_ious, class_ious, class_names = per_image_matrix(dataset_eval)
+    k = max(1, min(k, len(mean_ious)))
+    strata = image_strata(dataset_eval) if stratified else np.zeros(len(mean_ious), dtype=str)
+    folds = _fold_assignment(strata, k, rng)
+    membership = (folds[None, :] == np.arange(k)[:, None]).astype(np.float64)  # (k, n)
+    fold_means = _weighted_means(membership, np.column_stack([mean_ious, class_ious]))
+
+    results = {
+        'folds': k,
+        'stratified': stratified,
+        'fold_mean_iou': [float(v) for v in fold_means[:, 0]],
+        'mean_iou': float(np.mean(fold_means[:, 0])),
+        'std_iou': float(np.std(fold_means[:, 0])),
+        'per_class': {}
+    }
+    for i, class_name in enumerate(class_names):
+        values = fold_means[:, i + 1]
+        values = values[~np.isnan(values)]
+        if len(values):
+            results['per_class'][class_name] = {'mean_iou': float(np.mean(values)), 'std_iou': float(np.std(values))}
+    logger.info(f"Cross-validation IoU ({k} plis) : {results['mean_iou']:.4f} ± {results['std_iou']:.4f}")
+    return results
+
+
+def _stratified_subset(strata, size, rng):
+    """Sous-ensemble de `size` images avec allocation proportionnelle aux strates"""
+    labels, counts = np.unique(strata, return_counts=True)
+    quotas = np.maximum(1, np.round(counts / counts.sum() * size).astype(int))
+    quotas = np.minimum(quotas, counts)
+    selected = []
+    for label, quota in zip(labels, quotas):
+        members = np.flatnonzero(strata == label)
+        selected.extend(rng.permutation(members)[:quota])
+    return np.sort(np.array(selected, dtype=np.int64))
+
+
+def select_stratified_sample(dataset_eval, target_ci_width, confidence=STABILITY_CONFIDENCE,
+                             n_resamples=STABILITY_BOOTSTRAP_RESAMPLES, min_size=5, rng=None):
+    """
+    Plus petit sous-ensemble stratifié dont l'intervalle de confiance bootstrap du Mean IoU
+    a une largeur <= target_ci_width (recherche dichotomique sur la taille).
+
+    Returns:
+        tuple: (liste des noms d'images retenues, largeur de l'IC obtenue)
+    """
+    rng = rng if rng is not None else np.random.default_rng(0)
+    mean_ious, class_ious, _ = per_image_matrix(dataset_eval)
+    strata = image_strata(dataset_eval)
+    seed = int(rng.integers(0, 2**32))
+
+    def evaluate(size):
+        subset = _stratified_subset(strata, size, np.random.default_rng(seed))
+        global_means, _ = bootstrap_means(mean_ious[subset], class_ious[subset], n_resamples, np.random.default_rng(seed))
+        interval = _interval(global_means, confidence)
+        return subset, interval['width'] if interval else np.inf
+
+    low, high = min(min_size, len(mean_ious)), len(mean_ious)
+    best_subset, best_width = evaluate(high)
+    while low < high:
+        middle = (low + high) // 2
+        subset, width = evaluate(middle)
+        if width <= target_ci_width:
+            best_subset, best_width = subset, width
+            high = middle
+        else:
+            low = middle + 1
+    if best_width > target_ci_width:
+        logger.warning(f"Largeur d'IC cible {target_ci_width} non atteinte, même avec tout le jeu de données ({best_width:.4f})")
+    selected = [dataset_eval[i]['image'] for i in best_subset]
+    logger.info(f"Échantillon stratifié : {len(selected)}/{len(dataset_eval)} images, largeur d'IC {best_width:.4f}")
+    return selected, float(best_width)
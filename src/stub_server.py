@@ -0,0 +1,194 @@
+import argparse
+import base64
+import io
+import json
+import os
+import threading
+import time
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+from PIL import Image
+from .utils import get_logger
+from .synthetic import generate_layout
+from .config import (LABELS_MAPPING, IMG_DIR, MASK_DIR, STUB_SERVER_PORT, STUB_LATENCY_MEDIAN_MS,
+                     STUB_LATENCY_SIGMA, STUB_ERROR_RATE, STUB_RATE_LIMIT_RATE, STUB_MAX_CONCURRENT,
+                     STUB_MASK_SCALE)
+
+logger = get_logger(__name__, __name__ + ".log")
+
+
+def encode_class_masks(label_map, scale=1.0):
+    """
+    Réponse au format de l'API : une entrée {label, score, mask} par classe présente,
+    chaque masque étant un PNG binaire (0/255) encodé en base64.
+    """
+    if scale != 1.0:
+        height, width = label_map.shape
+        size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+        label_map = np.array(Image.fromarray(label_map).resize(size, Image.NEAREST))
+    results = []
+    for class_id in np.unique(label_map):
+        buffer = io.BytesIO()
+        Image.fromarray(((label_map == class_id) * 255).astype(np.uint8)).save(buffer, format="PNG")
+        results.append({
+            'score': None,
+            'label': LABELS_MAPPING[str(int(class_id))],
+            'mask': base64.b64encode(buffer.getvalue()).decode('ascii')
+        })
+    return results
+
+
+def index_ground_truth(image_dir, mask_dir):
+    """Associe l'empreinte (CRC32) de chaque image à son masque ground truth, si présent"""
+    index = {}
+    if not (os.path.isdir(image_dir) and os.path.isdir(mask_dir)):
+        return index
+    for img_file in os.listdir(image_dir):
+        digits = ''.join(filter(str.isdigit, img_file))
+        mask_path = os.path.join(mask_dir, f"mask_{digits}.png")
+        if digits and os.path.exists(mask_path):
+            with open(os.path.join(image_dir, img_file), 'rb') as f:
+                index[zlib.crc32(f.read())] = mask_path
+    return index
+
+
+class StubSegmentationServer(ThreadingHTTPServer):
+    """
+    Serveur local parlant le même protocole que l'endpoint d'inférence : POST des octets de
+    l'image, réponse JSON [{label, score, mask}]. La latence suit une loi log-normale et des
+    erreurs 503 / 429 peuvent être injectées.
+
+    Pour une image connue (ground_truth), le masque retourné est son ground truth ; sinon une
+    disposition de vêtements déterministe (graine = CRC32 des octets de l'image) est générée.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, latency_median_ms=STUB_LATENCY_MEDIAN_MS, latency_sigma=STUB_LATENCY_SIGMA,
+                 error_rate=STUB_ERROR_RATE, rate_limit_rate=STUB_RATE_LIMIT_RATE,
+                 max_concurrent=STUB_MAX_CONCURRENT, mask_scale=STUB_MASK_SCALE, ground_truth=None, seed=0):
+        super().__init__(address, StubSegmentationHandler)
+        self.latency_median_ms = latency_median_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.max_concurrent = max_concurrent
+        self.mask_scale = mask_scale
+        self.ground_truth = ground_truth or {}
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.counts = {}
+
+    def draw(self):
+        """Tire (latence en secondes, statut) sous verrou (le générateur n'est pas thread-safe)"""
+        with self.lock:
+            latency = self.latency_median_ms / 1000 * float(np.exp(self.rng.normal(0, self.latency_sigma)))
+            u = self.rng.random()
+        if u < self.rate_limit_rate:
+            return latency, 429
+        if u < self.rate_limit_rate + self.error_rate:
+            return latency, 503
+        return latency, 200
+
+    def record(self, status):
+        with self.lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+
+
+class StubSegmentationHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        server = self.server
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with server.lock:
+            server.in_flight += 1
+            saturated = server.max_concurrent and server.in_flight > server.max_concurrent
+        try:
+            latency, status = server.draw()
+            if saturated:
+                status = 429
+            time.sleep(latency)
+            if status == 200:
+                try:
+                    body = self.segment(data)
+                except Exception as e:
+                    status, body = 400, {'error': f"Image illisible : {e}"}
+            elif status == 429:
+                body = {'error': "Rate limit reached"}
+            else:
+                body = {'error': "Model is currently loading", 'estimated_time': 20.0}
+            self.respond(status, body)
+            server.record(status)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def segment(self, data):
+        key = zlib.crc32(data)
+        mask_path = self.server.ground_truth.get(key)
+        if mask_path is not None:
+            label_map = np.array(Image.open(mask_path))
+        else:
+            width, height = Image.open(io.BytesIO(data)).size  # Lecture de l'en-tête uniquement
+            label_map = generate_layout(width, height, np.random.default_rng(key))
+        return encode_class_masks(label_map, self.server.mask_scale)
+
+    def respond(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        logger.info(format % args)
+
+
+def start_stub_server(port=STUB_SERVER_PORT, host="127.0.0.1", background=False, **options):
+    """
+    Démarre le serveur local. Pour y diriger le pipeline :
+    HF_API_BASE_URL=http://127.0.0.1:<port> python main.py ...
+
+    Returns:
+        StubSegmentationServer: Le serveur (servi dans un thread si background=True).
+    """
+    server = StubSegmentationServer((host, port), **options)
+    print(f"Serveur de segmentation local sur http://{host}:{server.server_port} "
+          f"({len(server.ground_truth)} masque(s) ground truth indexé(s))")
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            print(f"Réponses servies par statut : {server.counts}")
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serveur local compatible avec l\'API de segmentation')
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=STUB_SERVER_PORT)
+    parser.add_argument('--latency-ms', type=float, default=STUB_LATENCY_MEDIAN_MS, help='Latence médiane (ms)')
+    parser.add_argument('--latency-sigma', type=float, default=STUB_LATENCY_SIGMA, help='Dispersion log-normale')
+    parser.add_argument('--error-rate', type=float, default=STUB_ERROR_RATE, help='Proportion de réponses 503')
+    parser.add_argument('--rate-limit-rate', type=float, default=STUB_RATE_LIMIT_RATE, help='Proportion de réponses 429')
+    parser.add_argument('--max-concurrent', type=int, default=STUB_MAX_CONCURRENT,
+                        help='Requêtes simultanées au-delà desquelles le serveur répond 429 (0 : illimité)')
+    parser.add_argument('--mask-scale', type=float, default=STUB_MASK_SCALE,
+                        help='Résolution des masques par rapport à l\'image')
+    parser.add_argument('--ground-truth', default=False, action='store_true',
+                        help='Retourne le masque ground truth des images connues (IMG / Mask)')
+    parser.add_argument('--image-dir', default=IMG_DIR)
+    parser.add_argument('--mask-dir', default=MASK_DIR)
+    args = parser.parse_args()
+    start_stub_server(args.port, args.host,
+                      latency_median_ms=args.latency_ms, latency_sigma=args.latency_sigma,
+                      error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                      max_concurrent=args.max_concurrent, mask_scale=args.mask_scale,
+                      ground_truth=index_ground_truth(args.image_dir, args.mask_dir) if args.ground_truth else None)
@@ -0,0 +1,162 @@
+import argparse
+import os
+import cv2
+import numpy as np
+from tqdm import tqdm
+from .utils import get_logger
+from .config import CLASS_MAPPING, SYNTHETIC_IMG_DIR, SYNTHETIC_MASK_DIR, SYNTHETIC_IMAGE_SIZE
+
+logger = get_logger(__name__, __name__ + ".log")
+
+SKIN_CLASSES = ["Face", "Left-leg", "Right-leg", "Left-arm", "Right-arm"]
+
+
+def _point(x, y, width, height):
+    return int(round(x * width)), int(round(y * height))
+
+
+def generate_layout(width, height, rng):
+    """
+    Génère une carte de labels plausible : silhouette debout (visage, cheveux, bras, jambes,
+    chaussures) portant soit un haut et un pantalon ou une jupe, soit une robe, avec des
+    accessoires optionnels (chapeau, lunettes, ceinture, écharpe, sac).
+
+    Returns:
+        np.ndarray: (H, W) uint8 carte de labels (valeurs de CLASS_MAPPING).
+    """
+    label_map = np.zeros((height, width), dtype=np.uint8)
+    cx = rng.uniform(0.4, 0.6)
+    scale = rng.uniform(0.85, 1.0)
+    top = rng.uniform(0.02, 0.08)
+
+    def y(v):
+        return top + v * scale
+
+    def rect(name, x0, y0, x1, y1):
+        cv2.rectangle(label_map, _point(x0, y0, width, height), _point(x1, y1, width, height),
+                      CLASS_MAPPING[name], thickness=-1)
+
+    def ellipse(name, x, yc, rx, ry):
+        cv2.ellipse(label_map, _point(x, yc, width, height), _point(rx, ry, width, height), 0, 0, 360,
+                    CLASS_MAPPING[name], thickness=-1)
+
+    def polygon(name, points):
+        pts = np.array([_point(px, py, width, height) for px, py in points], dtype=np.int32)
+        cv2.fillPoly(label_map, [pts], CLASS_MAPPING[name])
+
+    half = 0.11 * scale  # Demi-largeur des épaules
+    # Cheveux puis visage
+    ellipse("Hair", cx, y(0.09), 0.07 * scale, 0.075 * scale)
+    ellipse("Face", cx, y(0.1), 0.055 * scale, 0.065 * scale)
+    # Bras (le long du corps, légèrement écartés)
+    spread = rng.uniform(0.0, 0.05)
+    polygon("Left-arm", [(cx + half, y(0.2)), (cx + half + 0.04, y(0.2)),
+                         (cx + half + 0.05 + spread, y(0.52)), (cx + half + 0.01 + spread, y(0.52))])
+    polygon("Right-arm", [(cx - half - 0.04, y(0.2)), (cx - half, y(0.2)),
+                          (cx - half - 0.01 - spread, y(0.52)), (cx - half - 0.05 - spread, y(0.52))])
+    # Jambes
+    rect("Left-leg", cx + 0.01, y(0.5), cx + 0.07, y(0.9))
+    rect("Right-leg", cx - 0.07, y(0.5), cx - 0.01, y(0.9))
+
+    outfit = rng.choice(["pants", "skirt", "dress"])
+    if outfit == "dress":
+        hem = rng.uniform(0.55, 0.8)
+        polygon("Dress", [(cx - half, y(0.19)), (cx + half, y(0.19)),
+                          (cx + half + 0.05, y(hem)), (cx - half - 0.05, y(hem))])
+    else:
+        if outfit == "pants":
+            rect("Pants", cx - 0.08, y(0.46), cx + 0.08, y(0.6))
+            rect("Pants", cx - 0.08, y(0.6), cx - 0.005, y(0.88))
+            rect("Pants", cx + 0.005, y(0.6), cx + 0.08, y(0.88))
+        else:
+            hem = rng.uniform(0.58, 0.75)
+            polygon("Skirt", [(cx - 0.08, y(0.46)), (cx + 0.08, y(0.46)),
+                              (cx + 0.12, y(hem)), (cx - 0.12, y(hem))])
+        rect("Upper-clothes", cx - half, y(0.19), cx + half, y(0.48))
+        if rng.random() < 0.4:
+            rect("Belt", cx - 0.085, y(0.455), cx + 0.085, y(0.475))
+
+    # Chaussures
+    rect("Left-shoe", cx + 0.005, y(0.89), cx + 0.085, y(0.94))
+    rect("Right-shoe", cx - 0.085, y(0.89), cx - 0.005, y(0.94))
+
+    # Accessoires
+    if rng.random() < 0.3:
+        ellipse("Hat", cx, y(0.035), 0.1 * scale, 0.03 * scale)
+    if rng.random() < 0.25:
+        rect("Sunglasses", cx - 0.045, y(0.085), cx + 0.045, y(0.105))
+    if rng.random() < 0.2:
+        rect("Scarf", cx - 0.06, y(0.16), cx + 0.06, y(0.21))
+    if rng.random() < 0.4:
+        side = 1 if rng.random() < 0.5 else -1
+        bx = cx + side * (half + 0.09)
+        rect("Bag", bx - 0.05, y(0.42), bx + 0.05, y(0.54))
+    return label_map
+
+
+def render_image(label_map, rng):
+    """
+    Image BGR associée à une carte de labels : fond en dégradé, une couleur par vêtement,
+    un teint commun aux zones de peau, bruit et ombrage vertical.
+    """
+    height, width = label_map.shape
+    background = np.linspace(rng.uniform(120, 220), rng.uniform(60, 200), height)[:, None, None]
+    image = np.broadcast_to(background, (height, width, 3)).astype(np.float32).copy()
+    palette = rng.uniform(0, 255, size=(len(CLASS_MAPPING), 3)).astype(np.float32)
+    skin = np.array([rng.uniform(60, 140), rng.uniform(110, 180), rng.uniform(160, 230)], dtype=np.float32)
+    for name in SKIN_CLASSES:
+        palette[CLASS_MAPPING[name]] = skin
+    present = label_map > 0
+    image[present] = palette[label_map[present]]
+    image *= np.linspace(1.05, 0.9, height, dtype=np.float32)[:, None, None]
+    image += rng.normal(0, 6, size=image.shape).astype(np.float32)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def generate_synthetic_dataset(count, image_dir=SYNTHETIC_IMG_DIR, mask_dir=SYNTHETIC_MASK_DIR,
+                               size=SYNTHETIC_IMAGE_SIZE, start_index=0, seed=0, force=False):
+    """
+    Écrit `count` paires image_N.jpg / mask_N.png (disposition IMG / Mask du projet).
+    Chaque paire est déterministe pour un (seed, N) donné.
+
+    Les répertoires cibles doivent être vides (ou absents) : sans force=True, un répertoire
+    non vide est refusé pour ne jamais écraser des images ou des masques annotés.
+
+    Returns:
+        int: Nombre de paires écrites.
+    """
+    if not force:
+        for directory in (image_dir, mask_dir):
+            if os.path.isdir(directory) and os.listdir(directory):
+                raise FileExistsError(f"Le répertoire '{directory}' n'est pas vide (--force pour y écrire quand même)")
+    os.makedirs(image_dir, exist_ok=True)
+    os.makedirs(mask_dir, exist_ok=True)
+    width, height = size
+    for index in tqdm(range(start_index, start_index + count), desc="Génération du jeu synthétique"):
+        rng = np.random.default_rng([seed, index])
+        label_map = generate_layout(width, height, rng)
+        cv2.imwrite(os.path.join(image_dir, f"image_{index}.jpg"), render_image(label_map, rng),
+                    [cv2.IMWRITE_JPEG_QUALITY, 90])
+        cv2.imwrite(os.path.join(mask_dir, f"mask_{index}.png"), label_map)
+    logger.info(f"{count} paires synthétiques écrites dans '{image_dir}' et '{mask_dir}'")
+    print(f"{count} paire(s) synthétique(s) écrite(s) dans '{image_dir}' et '{mask_dir}'")
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Génération d\'un jeu de données synthétique image/masque')
+    parser.add_argument('--count', type=int, default=1000, help='Nombre de paires à générer (défaut: 1000)')
+    parser.add_argument('--start-index', type=int, default=0, help='Premier indice N (défaut: 0)')
+    parser.add_argument('--width', type=int, default=SYNTHETIC_IMAGE_SIZE[0])
+    parser.add_argument('--height', type=int, default=SYNTHETIC_IMAGE_SIZE[1])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--image-dir', default=SYNTHETIC_IMG_DIR)
+    parser.add_argument('--mask-dir', default=SYNTHETIC_MASK_DIR)
+    parser.add_argument('--force', default=False, action='store_true',
+                        help='Écrit même si les répertoires cibles ne sont pas vides (les fichiers image_N / mask_N existants sont remplacés)')
+    args = parser.parse_args()
+    try:
+        generate_synthetic_dataset(args.count, args.image_dir, args.mask_dir, (args.width, args.height),
+                                   args.start_index, args.seed, args.force)
+    except FileExistsError as e:
+        parser.error(str(e))
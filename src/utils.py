@@ -5,7 +5,52 @@ import numpy as np
 import logging
 import cv2
 import os
-from .config import CLASS_MAPPING, LABELS_MAPPING, COLOR_MAPPING, LOG_DIR
+import json
+import shutil
+import functools
+import re
+import tarfile
+import zipfile
+from .config import (CLASS_MAPPING, LABELS_MAPPING, COLOR_MAPPING, LOG_DIR, RLE_EXTENSION, TILE_MEMORY_BUDGET_MB,
+                     ARCHIVE_EXTENSIONS, RESULT_PYRAMID_WIDTHS, RESULT_PYRAMID_FORMAT, RESULT_PYRAMID_QUALITY,
+                     RESULT_FULL_RESOLUTION, RESULT_LEGEND_MIN_HEIGHT)
+
+# Profileur mémoire actif (voir src/memory_profile.py), None hors profilage
+_memory_profiler = None
+
+
+def set_memory_profiler(profiler):
+    """Active (ou désactive avec None) le profilage mémoire des fonctions décorées ci-dessous"""
+    global _memory_profiler
+    _memory_profiler = profiler
+
+
+def get_memory_profiler():
+    return _memory_profiler
+
+
+def memory_stage(name):
+    """Décorateur : la fonction est une étape du profil mémoire (pic RSS, sites d'allocation)"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _memory_profiler is None:
+                return func(*args, **kwargs)
+            with _memory_profiler.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def track_memory(func):
+    """Décorateur : pic d'allocation de chaque appel (par image) enregistré par le profileur mémoire"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _memory_profiler is None:
+            return func(*args, **kwargs)
+        return _memory_profiler.call(func, args, kwargs)
+    return wrapper
+
 
 def get_image_dimensions(img_path):
     """
@@ -20,6 +65,64 @@ def get_image_dimensions(img_path):
     original_image = Image.open(img_path)
     return original_image.size
 
+def read_image_file(img_path):
+    """
+    Read an image file once into memory.
+
+    The dimensions come from the header of the in-memory buffer (PIL opens images lazily,
+    no pixel is decoded), and the same buffer can be uploaded to the API and written as the
+    original copy.
+
+    Args:
+        img_path (str): Path to the image.
+
+    Returns:
+        tuple: (raw bytes, width, height) of the image.
+    """
+    with open(img_path, "rb") as f:
+        data = f.read()
+    width, height = get_image_dimensions_from_bytes(data)
+    return data, width, height
+
+def get_image_dimensions_from_bytes(data):
+    """
+    Get the dimensions of an encoded image held in memory, from its header only.
+
+    Args:
+        data (bytes): Raw content of the image.
+
+    Returns:
+        tuple: (width, height) of the image.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        return image.size
+
+def copy_original_image(src_path, dst_path, data=None):
+    """
+    Copy an original image byte for byte (no decode / re-encode).
+
+    A hard link is used when possible; otherwise the in-memory buffer is written if
+    provided, or the file is copied. Images streamed from an archive have no file on
+    disk: their buffer is written.
+
+    Args:
+        src_path (str): Path to the original image (or its name inside an archive).
+        dst_path (str): Destination path.
+        data (bytes): Raw content of the image, if already read.
+    """
+    if os.path.exists(dst_path):
+        if os.path.exists(src_path) and os.path.samefile(src_path, dst_path):
+            return
+        os.remove(dst_path)
+    try:
+        os.link(src_path, dst_path)
+    except OSError:
+        if data is None:
+            shutil.copyfile(src_path, dst_path)
+        else:
+            with open(dst_path, "wb") as f:
+                f.write(data)
+
 def decode_base64_mask(base64_string, width, height):
     """
     Decode a base64-encoded mask into a NumPy array.
@@ -29,6 +132,21 @@ def decode_base64_mask(base64_string, width, height):
         width (int): Target width.
         height (int): Target height.
 
+    Returns:
+        np.ndarray: Single-channel mask array.
+    """
+    mask_array = decode_base64_mask_native(base64_string)
+    mask_image = Image.fromarray(mask_array).resize((width, height), Image.NEAREST)
+    return np.array(mask_image)
+
+
+def decode_base64_mask_native(base64_string):
+    """
+    Decode a base64-encoded mask at the resolution returned by the API (no resize).
+
+    Args:
+        base64_string (str): Base64-encoded mask.
+
     Returns:
         np.ndarray: Single-channel mask array.
     """
@@ -37,10 +155,10 @@ def decode_base64_mask(base64_string, width, height):
     mask_array = np.array(mask_image)
     if len(mask_array.shape) == 3:
         mask_array = mask_array[:, :, 0]  # Take first channel if RGB
-    mask_image = Image.fromarray(mask_array).resize((width, height), Image.NEAREST)
-    return np.array(mask_image)
+    return mask_array
 
 
+@track_memory
 def create_masks(results, width, height):
     """
     Combine multiple class masks into a single segmentation mask.
@@ -73,6 +191,364 @@ def create_masks(results, width, height):
 
     return combined_mask
 
+@track_memory
+def create_masks_tiled(results, width, height):
+    """
+    Memory-bounded equivalent of create_masks.
+
+    Class masks are combined at the resolution returned by the API and the label map is
+    upscaled only once. Nearest-neighbour resizing picks the same source pixel for every
+    mask of a given size, so combining before or after the resize gives the same result
+    as create_masks, without holding one full-resolution array per class.
+
+    Args:
+        results (list): List of dictionaries with 'label' and 'mask' keys.
+        width (int): Target width.
+        height (int): Target height.
+
+    Returns:
+        np.ndarray: Combined segmentation mask with class indices.
+    """
+    decoded = [(CLASS_MAPPING.get(result['label'], 0), decode_base64_mask_native(result['mask'])) for result in results]
+    if len({mask.shape for _, mask in decoded}) > 1:
+        # Masques de résolutions différentes : pas de grille commune, on garde le chemin dense
+        return create_masks(results, width, height)
+    if not decoded:
+        return np.zeros((height, width), dtype=np.uint8)
+
+    native_mask = np.zeros(decoded[0][1].shape, dtype=np.uint8)
+    for class_id, mask_array in decoded:
+        if class_id != 0:
+            native_mask[mask_array > 0] = class_id
+    for class_id, mask_array in decoded:
+        if class_id == 0:
+            native_mask[mask_array > 0] = 0
+    return np.array(Image.fromarray(native_mask).resize((width, height), Image.NEAREST))
+
+
+def tile_rows_for(width, bytes_per_pixel, budget_mb=TILE_MEMORY_BUDGET_MB):
+    """
+    Number of rows per band so that a band's working memory stays under the budget.
+    """
+    return max(1, int(budget_mb * 1024 * 1024 // max(1, width * bytes_per_pixel)))
+
+
+def iter_row_tiles(height, rows):
+    """Yield successive row slices of at most `rows` rows covering [0, height)."""
+    for start in range(0, height, rows):
+        yield slice(start, min(start + rows, height))
+
+
+def downsample_label_map(label_map, factor, method="stride"):
+    """
+    Reduce a label map by `factor` along each axis (about factor² fewer pixels) without mixing labels.
+
+    "stride" keeps every factor-th pixel as a zero-copy view; "resize" keeps the pixel nearest
+    to the centre of each factor x factor block (cv2.INTER_NEAREST_EXACT).
+    """
+    if factor <= 1:
+        return label_map
+    if method == "stride":
+        return label_map[::factor, ::factor]
+    if method == "resize":
+        height, width = label_map.shape[:2]
+        size = (max(1, width // factor), max(1, height // factor))
+        return cv2.resize(label_map, size, interpolation=cv2.INTER_NEAREST_EXACT)
+    raise ValueError(f"Unknown downsampling method '{method}' (expected 'stride' or 'resize')")
+
+
+def downsample_indices(size, factor, method="stride"):
+    """
+    Indices kept along one axis of length `size` by downsample_label_map (same pixels, same order).
+    """
+    if factor <= 1:
+        return np.arange(size)
+    if method == "stride":
+        return np.arange(0, size, factor)
+    if method == "resize":
+        # cv2.INTER_NEAREST_EXACT (pixel source le plus proche du centre, calcul en virgule fixe 16.16)
+        n = max(1, size // factor)
+        step = ((size << 16) + n // 2) // n
+        return np.minimum((step * np.arange(n, dtype=np.int64) + step // 2 - size % 2) >> 16, size - 1)
+    raise ValueError(f"Unknown downsampling method '{method}' (expected 'stride' or 'resize')")
+
+
+def _label_runs(label_map):
+    """
+    Compute the runs of a label map in column-major (COCO) order.
+
+    Returns:
+        tuple: (starts, lengths, values) of each run.
+    """
+    flat = np.asarray(label_map).ravel(order='F')
+    if flat.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), flat
+    change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    starts = np.concatenate(([0], change))
+    lengths = np.diff(np.concatenate((starts, [flat.size])))
+    return starts, lengths, flat[starts]
+
+
+def _counts_from_intervals(starts, lengths, total):
+    """Build alternating zero/one COCO counts from sorted, non-adjacent foreground intervals."""
+    ends = starts + lengths
+    gaps = starts - np.concatenate(([0], ends[:-1]))
+    counts = np.empty(2 * len(starts), dtype=np.int64)
+    counts[0::2] = gaps
+    counts[1::2] = lengths
+    tail = total - (ends[-1] if len(ends) else 0)
+    if tail > 0 or len(starts) == 0:
+        counts = np.append(counts, tail)
+    return counts
+
+
+def encode_rle(binary_mask):
+    """
+    Encode a binary mask with COCO-style run-length encoding.
+
+    Runs are taken in column-major order and always start with a run of zeros
+    (possibly empty), as in pycocotools uncompressed RLE.
+
+    Args:
+        binary_mask (np.ndarray): (H, W) mask, any non-zero value is foreground.
+
+    Returns:
+        dict: {'size': [height, width], 'counts': [int, ...]}
+    """
+    binary_mask = np.asarray(binary_mask) != 0
+    height, width = binary_mask.shape
+    starts, lengths, values = _label_runs(binary_mask)
+    counts = _counts_from_intervals(starts[values], lengths[values], height * width)
+    return {'size': [int(height), int(width)], 'counts': counts.tolist()}
+
+
+def decode_rle(rle):
+    """
+    Decode a COCO-style RLE into a binary mask.
+
+    Args:
+        rle (dict): {'size': [height, width], 'counts': [...]}
+
+    Returns:
+        np.ndarray: (H, W) uint8 mask with values 0/1.
+    """
+    height, width = rle['size']
+    counts = np.asarray(rle['counts'], dtype=np.int64)
+    values = (np.arange(len(counts)) % 2).astype(np.uint8)
+    return np.repeat(values, counts).reshape((height, width), order='F')
+
+
+def encode_label_map_rle(label_map):
+    """
+    Encode a label map as one RLE per present class, from a single pass over the runs.
+
+    Args:
+        label_map (np.ndarray): (H, W) array of class ids.
+
+    Returns:
+        dict: {'size': [height, width], 'classes': {class_id (str): counts}}
+    """
+    height, width = label_map.shape[:2]
+    starts, lengths, values = _label_runs(label_map)
+    classes = {}
+    for class_id in np.unique(values):
+        selected = values == class_id
+        classes[str(int(class_id))] = _counts_from_intervals(starts[selected], lengths[selected], height * width).tolist()
+    return {'size': [int(height), int(width)], 'classes': classes}
+
+
+@track_memory
+def decode_label_map_rle(label_rle):
+    """
+    Decode a label map RLE (see encode_label_map_rle) into a dense uint8 label map.
+    """
+    height, width = label_rle['size']
+    # Class runs are disjoint: a cumulative sum of +id/-id at run boundaries rebuilds the map
+    delta = np.zeros(height * width + 1, dtype=np.int32)
+    for class_id, counts in label_rle['classes'].items():
+        boundaries = np.cumsum(np.asarray(counts, dtype=np.int64))
+        np.add.at(delta, boundaries[0::2][:len(boundaries) // 2], int(class_id))
+        np.add.at(delta, boundaries[1::2], -int(class_id))
+    flat = np.cumsum(delta[:-1]).astype(np.uint8)
+    return flat.reshape((height, width), order='F')
+
+
+@track_memory
+def decode_label_map_rle_reduced(label_rle, factor, method="stride"):
+    """
+    Decode a label map RLE directly at reduced size: only the pixels kept by downsample_label_map
+    are looked up in the runs, the full-resolution map is never built.
+    """
+    height, width = label_rle['size']
+    rows = downsample_indices(height, factor, method)
+    cols = downsample_indices(width, factor, method)
+    starts, ends, values = [], [], []
+    for class_id, counts in label_rle['classes'].items():
+        boundaries = np.cumsum(np.asarray(counts, dtype=np.int64))
+        class_starts = boundaries[0::2][:len(boundaries) // 2]
+        starts.append(class_starts)
+        ends.append(boundaries[1::2])
+        values.append(np.full(len(class_starts), int(class_id), dtype=np.uint8))
+    if not starts:
+        return np.zeros((len(rows), len(cols)), dtype=np.uint8)
+    starts, ends, values = np.concatenate(starts), np.concatenate(ends), np.concatenate(values)
+    order = np.argsort(starts)
+    starts, ends, values = starts[order], ends[order], values[order]
+    # Index column-major (COCO) des pixels conservés, puis run qui les contient (runs disjoints)
+    flat = cols[None, :] * height + rows[:, None]
+    run = np.searchsorted(starts, flat, side='right') - 1
+    inside = (run >= 0) & (flat < ends[np.maximum(run, 0)])
+    return np.where(inside, values[np.maximum(run, 0)], 0).astype(np.uint8)
+
+
+def get_class_rle(label_rle, class_id):
+    """Return the binary RLE of one class of a label map RLE (empty mask if absent)."""
+    height, width = label_rle['size']
+    counts = label_rle['classes'].get(str(int(class_id)), [height * width])
+    return {'size': [height, width], 'counts': counts}
+
+
+def rle_area(rle):
+    """Number of foreground pixels of an RLE."""
+    return int(np.sum(np.asarray(rle['counts'], dtype=np.int64)[1::2]))
+
+
+def rle_intersection_area(rle_a, rle_b):
+    """
+    Number of pixels set in both RLEs, computed on the runs without densifying.
+
+    The run boundaries of both masks are merged; on every merged segment both masks
+    are constant, so the intersection is the total length of segments set in both.
+    """
+    if list(rle_a['size']) != list(rle_b['size']):
+        raise ValueError(f"RLE sizes differ: {rle_a['size']} vs {rle_b['size']}")
+    bounds_a = np.cumsum(np.asarray(rle_a['counts'], dtype=np.int64))
+    bounds_b = np.cumsum(np.asarray(rle_b['counts'], dtype=np.int64))
+    merged = np.union1d(bounds_a, bounds_b)
+    seg_starts = np.concatenate(([0], merged[:-1]))
+    seg_lengths = merged - seg_starts
+    inside_a = np.searchsorted(bounds_a, seg_starts, side='right') % 2 == 1
+    inside_b = np.searchsorted(bounds_b, seg_starts, side='right') % 2 == 1
+    return int(seg_lengths[inside_a & inside_b].sum())
+
+
+def rle_iou(rle_a, rle_b):
+    """IoU of two RLEs (1.0 when both are empty)."""
+    intersection = rle_intersection_area(rle_a, rle_b)
+    union = rle_area(rle_a) + rle_area(rle_b) - intersection
+    return intersection / union if union > 0 else 1.0
+
+
+def rle_confusion_counts(rle_true, rle_pred):
+    """
+    Binary confusion counts between a ground-truth and a predicted RLE.
+
+    Returns:
+        dict: {'tp', 'fp', 'fn', 'tn'} pixel counts.
+    """
+    height, width = rle_true['size']
+    tp = rle_intersection_area(rle_true, rle_pred)
+    fp = rle_area(rle_pred) - tp
+    fn = rle_area(rle_true) - tp
+    return {'tp': tp, 'fp': fp, 'fn': fn, 'tn': height * width - tp - fp - fn}
+
+
+def rle_path_for(mask_path):
+    """Path of the RLE file stored next to a PNG mask (mask_12.png -> mask_12.rle.json)."""
+    return os.path.splitext(mask_path)[0] + RLE_EXTENSION
+
+
+def save_mask_rle(path, label_map):
+    """Write a label map as a compact RLE JSON file."""
+    with open(path, 'w') as f:
+        json.dump(encode_label_map_rle(label_map), f, separators=(',', ':'))
+
+
+def load_mask_rle(path):
+    """Read a label map RLE JSON file (see save_mask_rle)."""
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+@track_memory
+def load_mask(mask_path):
+    """
+    Read a label map saved by save_mask, from the PNG or, if absent, from the RLE file.
+
+    Returns:
+        np.ndarray: (H, W) uint8 label map, or None if neither file can be read.
+    """
+    if os.path.exists(mask_path):
+        return cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+    if os.path.exists(rle_path_for(mask_path)):
+        return decode_label_map_rle(load_mask_rle(rle_path_for(mask_path)))
+    return None
+
+
+@track_memory
+def load_mask_reduced(mask_path, factor, method="stride"):
+    """
+    Read a label map reduced by `factor` (see downsample_label_map). An RLE-only mask is decoded
+    at reduced size; a PNG is decoded (no subsampled PNG decoding) and reduced right away.
+
+    Returns:
+        tuple: (reduced label map, (height, width) at full resolution), or None if neither file can be read.
+    """
+    if os.path.exists(mask_path):
+        mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+        return None if mask is None else (downsample_label_map(mask, factor, method), mask.shape[:2])
+    if os.path.exists(rle_path_for(mask_path)):
+        label_rle = load_mask_rle(rle_path_for(mask_path))
+        return decode_label_map_rle_reduced(label_rle, factor, method), tuple(label_rle['size'])
+    return None
+
+
+def save_mask(mask_path, label_map, storage_format="png"):
+    """
+    Save a label map as PNG, RLE, or both.
+
+    Args:
+        mask_path (str): Target PNG path (the RLE file is written next to it).
+        label_map (np.ndarray): (H, W) uint8 label map.
+        storage_format (str): "png", "rle" or "both".
+    """
+    if storage_format not in ("png", "rle", "both"):
+        raise ValueError(f"Format de stockage de masque inconnu : {storage_format}")
+    if storage_format in ("png", "both"):
+        cv2.imwrite(mask_path, label_map)
+    if storage_format in ("rle", "both"):
+        save_mask_rle(rle_path_for(mask_path), label_map)
+
+
+def convert_mask_dir_to_rle(mask_dir, overwrite=False, output_dir=None):
+    """
+    Write an RLE file for every PNG mask of a directory, next to it or into output_dir
+    (e.g. a cache of the ground-truth masks, so the dataset directory is left untouched).
+    An existing RLE file is rewritten only if it is older than its PNG mask, or if overwrite is set.
+
+    Returns:
+        int: Number of RLE files written.
+    """
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    written = 0
+    for mask_file in sorted(os.listdir(mask_dir)):
+        if not mask_file.endswith('.png'):
+            continue
+        mask_path = os.path.join(mask_dir, mask_file)
+        rle_path = rle_path_for(os.path.join(output_dir, mask_file) if output_dir is not None else mask_path)
+        if (not overwrite and os.path.exists(rle_path)
+                and os.path.getmtime(rle_path) >= os.path.getmtime(mask_path)):
+            continue
+        mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+        if mask is None:
+            print(f"Warning: Could not read {mask_path}")
+            continue
+        save_mask_rle(rle_path, mask)
+        written += 1
+    return written
+
+
 def get_logger(name=__name__, log_file='app.log'):
     """Retourne un logger configuré"""
     logger = logging.getLogger(name)
@@ -95,6 +571,7 @@ def get_logger(name=__name__, log_file='app.log'):
     return logger
 
 
+@track_memory
 def colorize_mask(mask, colormap):
     """
     Applique le colormap personnalisé au masque.
@@ -127,59 +604,367 @@ def add_legend(image, legend, start_x=10, start_y=10, box_size=15, spacing=5):
 
 
 # Charger les images et les masques depuis un répertoire local
+SOURCE_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def is_archive(path):
+    return os.path.isfile(path) and path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def is_source_image(member_name, extensions=SOURCE_IMAGE_EXTENSIONS):
+    """Vrai pour un fichier image d'une source (extension reconnue, fichier non caché)"""
+    basename = os.path.basename(member_name)
+    return not basename.startswith('.') and os.path.splitext(basename)[1].lower() in extensions
+
+
+def source_image_id(member_name):
+    """
+    Numéro N d'un fichier image d'une source : le nombre de son nom s'il n'en contient qu'un
+    (image_12.jpg, 12.png -> 12), None sinon (IMG_20240101_1234.jpg, photo.jpg).
+    """
+    numbers = re.findall(r'\d+', os.path.splitext(os.path.basename(member_name))[0])
+    return int(numbers[0]) if len(numbers) == 1 else None
+
+
+class SourceIdAllocator:
+    """
+    Attribution des numéros N (image_N, mask_N, result_N) des images lues en flux, sans collision
+    entre les sources d'un run ni entre runs.
+
+    Une image garde le numéro de son nom (source_image_id) s'il est libre, pour rester alignée
+    avec le ground truth ; sinon (nom sans numéro unique, ou numéro déjà pris par une autre
+    origine) elle reçoit le prochain numéro libre. La table {N: chemin d'origine} est persistée
+    dans `path` et les numéros déjà présents dans le répertoire de sortie sont réservés : une
+    même origine garde son numéro d'un run à l'autre, aucune sortie existante n'est écrasée.
+    """
+
+    def __init__(self, output_image_dir, path):
+        self.path = path
+        self.origins = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.origins = {int(image_id): origin for image_id, origin in json.load(f).items()}
+        self.ids = {origin: image_id for image_id, origin in self.origins.items()}
+        self.taken = set(self.origins)
+        if os.path.isdir(output_image_dir):
+            self.taken.update(source_image_id(f) for f in os.listdir(output_image_dir) if is_source_image(f))
+            self.taken.discard(None)
+
+    def assign(self, origin):
+        """
+        Returns:
+            tuple: (N, numéro du nom de fichier s'il était déjà pris par une autre origine, sinon None)
+        """
+        origin = os.path.abspath(origin)
+        if origin in self.ids:
+            return self.ids[origin], None
+        preferred = source_image_id(origin)
+        collision = preferred if preferred is not None and preferred in self.taken else None
+        image_id = preferred if preferred is not None and collision is None else self._next_free()
+        self.origins[image_id] = origin
+        self.ids[origin] = image_id
+        self.taken.add(image_id)
+        return image_id, collision
+
+    def _next_free(self):
+        """Numéro suivant le plus grand numéro pris : les trous restent aux images qui portent ce numéro"""
+        return max(self.taken, default=-1) + 1
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({str(image_id): origin for image_id, origin in sorted(self.origins.items())}, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _iter_directory(path):
+    for filename in sorted(os.listdir(path)):
+        file_path = os.path.join(path, filename)
+        if os.path.isfile(file_path):
+            yield file_path, lambda file_path=file_path: _read_file(file_path)
+
+
+def _iter_zip(path):
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if not info.is_dir():
+                yield os.path.join(path, info.filename), lambda info=info: archive.read(info)
+
+
+def _iter_tar(path):
+    # Mode flux ("r|*") : lecture séquentielle en un seul passage, même compressée
+    with tarfile.open(path, mode="r|*") as archive:
+        for member in archive:
+            if member.isfile():
+                yield os.path.join(path, member.name), lambda member=member: archive.extractfile(member).read()
+
+
+def iter_source_images(source, extensions=SOURCE_IMAGE_EXTENSIONS):
+    """
+    Parcourt les images d'une source (répertoire, archive zip ou tar) sans extraction sur
+    disque : le contenu de chaque image n'est lu qu'au moment où elle est produite, et une
+    seule image est en mémoire à la fois.
+
+    Les fichiers sont filtrés par extension ; leur numéro N est attribué par l'appelant
+    (source_image_id, SourceIdAllocator).
+
+    Yields:
+        tuple: (chemin d'origine (fichier, ou <archive>/<membre>), contenu brut)
+    """
+    if os.path.isdir(source):
+        members = _iter_directory(source)
+    elif zipfile.is_zipfile(source):
+        members = _iter_zip(source)
+    elif tarfile.is_tarfile(source):
+        members = _iter_tar(source)
+    else:
+        raise ValueError(f"Source d'images non reconnue : '{source}' (répertoire, zip ou tar attendu)")
+
+    for member_path, read in members:
+        if is_source_image(member_path, extensions):
+            yield member_path, read()
+
+
+def count_source_images(source, extensions=SOURCE_IMAGE_EXTENSIONS):
+    """Nombre d'images d'une source, ou None pour une archive tar (inconnu sans la parcourir)"""
+    if os.path.isdir(source):
+        return sum(is_source_image(f, extensions) and os.path.isfile(os.path.join(source, f)) for f in os.listdir(source))
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            return sum(not info.is_dir() and is_source_image(info.filename, extensions) for info in archive.infolist())
+    return None
+
+
+def _iter_archive_dataset(archive_path, mask_dir):
+    """
+    Paires (image, masque, idx) d'une archive d'images et d'un répertoire de masques, appariées
+    par le numéro du nom de fichier. Une image sans numéro unique ou dont le numéro est déjà
+    apparu dans l'archive ne peut pas être appariée sans ambiguïté : erreur, l'image est exclue.
+    """
+    if not os.path.exists(mask_dir):
+        raise FileNotFoundError(f"Le répertoire des masques '{mask_dir}' n'existe pas.")
+    seen = {}
+    for member_path, data in iter_source_images(archive_path):
+        idx = source_image_id(member_path)
+        if idx is None or idx in seen:
+            reason = "sans numéro unique" if idx is None else f"numéro {idx} déjà utilisé par {seen[idx]}"
+            print(f"Erreur : {member_path} exclu de l'évaluation ({reason})")
+            continue
+        seen[idx] = member_path
+        mask_path = os.path.join(mask_dir, f"mask_{idx}.png")
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        mask = load_mask(mask_path)
+        if image is not None and mask is not None:
+            yield image, mask, idx
+        else:
+            print(f"Warning: Could not read {member_path} or {mask_path}")
+
+
 def load_local_dataset(image_dir, mask_dir):
-    
+    return list(iter_local_dataset(image_dir, mask_dir))
+
+
+def local_dataset_pairs(image_dir, mask_dir):
+    """
+    [(idx, chemin image, chemin masque)] d'un répertoire d'images et de masques, par numéro
+    (image_N <-> mask_N) ; une image sans masque (segmentation partielle) est ignorée.
+    Un masque stocké uniquement en RLE est donné sous son nom PNG (voir load_mask).
+    """
     #Verifier si les répertoires existent
     if not os.path.exists(image_dir):
         raise FileNotFoundError(f"Le répertoire des images '{image_dir}' n'existe pas.")
     if not os.path.exists(mask_dir):
         raise FileNotFoundError(f"Le répertoire des masques '{mask_dir}' n'existe pas.")
 
-    
-    image_files = sorted([f for f in os.listdir(image_dir) if f.endswith(('.png', '.jpg', '.jpeg'))])
-    mask_files = sorted([f for f in os.listdir(mask_dir) if f.endswith(('.png', '.jpg', '.jpeg'))])
-    
-    paires = []
+    image_files = {source_image_id(f): f for f in os.listdir(image_dir) if is_source_image(f)}
+    mask_files = {source_image_id(f): f for f in os.listdir(mask_dir) if f.endswith('.png')}
+    # Masques stockés uniquement en RLE : on les relit sous leur nom PNG
+    for f in os.listdir(mask_dir):
+        if f.endswith(RLE_EXTENSION):
+            mask_files.setdefault(source_image_id(f[:-len(RLE_EXTENSION)]), f[:-len(RLE_EXTENSION)] + ".png")
+    image_files.pop(None, None)
+    return [(idx, os.path.join(image_dir, image_files[idx]), os.path.join(mask_dir, mask_files[idx]))
+            for idx in sorted(image_files.keys() & mask_files.keys())]
 
-    for img_file, mask_file in zip(image_files, mask_files):
-        img_path = os.path.join(image_dir, img_file)
-        mask_path = os.path.join(mask_dir, mask_file)
-        img_filename = os.path.basename(img_path)
-        idx = int(''.join(filter(str.isdigit, img_filename)))  # Extraire les chiffres du nom de fichier
-        
+
+def iter_local_dataset(image_dir, mask_dir):
+    """
+    Version paresseuse de load_local_dataset : les paires (image, masque, idx)
+    sont lues une par une, sans garder tout le jeu de données en mémoire.
+    image_dir peut aussi être une archive zip / tar : les images sont alors lues en flux
+    (voir iter_source_images) et associées au masque mask_N de même numéro.
+    """
+    if is_archive(image_dir):
+        yield from _iter_archive_dataset(image_dir, mask_dir)
+        return
+
+    for idx, img_path, mask_path in local_dataset_pairs(image_dir, mask_dir):
         image = cv2.imread(img_path) # chargement de l'image originale en couleur
-        mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE) # chargement du masque en niveaux de gris
+        mask = load_mask(mask_path) # chargement du masque en niveaux de gris (PNG ou RLE)
 
         if image is not None and mask is not None:
-            paires.append((image, mask, idx))
+            yield image, mask, idx
         else:
             print(f"Warning: Could not read {img_path} or {mask_path}")
 
-    return paires
 
 
+@track_memory
+def render_result_tiled(img, msk, budget_mb=TILE_MEMORY_BUDGET_MB, legend=LABELS_MAPPING,
+                        start_y=10, box_size=15, spacing=5):
+    """
+    Construit le visuel image | masque colorisé | superposition bande par bande.
 
-def save_results(image_dir, mask_dir, output_dir):
-    paires = load_local_dataset(image_dir, mask_dir)
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    Le résultat est identique à celui de save_results, mais seul le canevas final est alloué
+    en pleine résolution : colorisation et superposition sont calculées sur des bandes de
+    lignes dont la taille respecte budget_mb, et les légendes sont dessinées sur la seule
+    zone qu'elles occupent.
+    """
+    if img.shape[:2] != msk.shape[:2]:
+        raise ValueError(f"Dimensions incompatibles entre l'image {img.shape[:2]} et le masque {msk.shape[:2]}")
+    height, width = msk.shape[:2]
+    canvas = np.empty((height, 3 * width, 3), dtype=np.uint8)
+    palette = np.zeros((256, 3), dtype=np.uint8)
+    for label, color in COLOR_MAPPING.items():
+        palette[label] = color
+
+    # Par pixel et par bande : masque colorisé (3 octets) + superposition (3 octets) + marge
+    rows = tile_rows_for(width, bytes_per_pixel=8, budget_mb=budget_mb)
+    for band in iter_row_tiles(height, rows):
+        colored_band = palette[msk[band]]
+        canvas[band, :width] = img[band]
+        canvas[band, width:2 * width] = colored_band
+        canvas[band, 2 * width:] = cv2.addWeighted(img[band], 0.7, colored_band, 0.3, 0)
+
+    # La légende n'occupe que le haut de l'image : on ne dessine que sur cette zone
+    legend_height = min(height, start_y + len(legend) * (box_size + spacing) + box_size)
+    for panel in (slice(width, 2 * width), slice(2 * width, 3 * width)):
+        zone = np.ascontiguousarray(canvas[:legend_height, panel])
+        canvas[:legend_height, panel] = add_legend(zone, legend, start_y=start_y, box_size=box_size, spacing=spacing)
+    return canvas
+
+
+def render_result(img, msk):
+    """Visuel image | masque colorisé (légende) | superposition (légende) en pleine résolution"""
+    # Colorisation du masque avec le colormap personnalisé
+    colored_mask = colorize_mask(msk, COLOR_MAPPING)
+
+    # Ajout de la légende sur le masque colorisé
+    colored_mask_with_legend = add_legend(colored_mask, LABELS_MAPPING)
+
+    # Superposition du masque coloré sur l'image originale
+    overlay = cv2.addWeighted(img, 0.7, colored_mask, 0.3, 0)
+    overlay_with_legend = add_legend(overlay, LABELS_MAPPING)
+
+    # Concatenation des images sur une seule ligne
+    return np.hstack([img, colored_mask_with_legend, overlay_with_legend])
+
+
+def render_result_level(img, msk, width):
+    """
+    Visuel d'un niveau de la pyramide, de largeur totale au plus `width`, rendu directement à
+    cette résolution : l'image (INTER_AREA) et le masque (plus proche voisin, sans mélange de
+    labels) sont réduits avant la colorisation. Les niveaux trop bas pour la légende sont rendus sans.
+    """
+    height, panel_width = msk.shape[:2]
+    target = min(panel_width, max(1, width // 3))
+    if target < panel_width:
+        size = (target, max(1, round(height * target / panel_width)))
+        img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+        msk = cv2.resize(msk, size, interpolation=cv2.INTER_NEAREST)
+    legend = LABELS_MAPPING if msk.shape[0] >= RESULT_LEGEND_MIN_HEIGHT else {}
+    return render_result_tiled(img, msk, legend=legend)
+
+
+def result_level_path(output_dir, idx, width, image_format=RESULT_PYRAMID_FORMAT):
+    """Chemin d'un niveau de la pyramide (<sortie>/w256/result_12.webp)"""
+    return os.path.join(output_dir, f"w{width}", f"result_{idx}.{image_format}")
 
-    for img, msk, idx in paires:
-        # Colorisation du masque avec le colormap personnalisé
-        result_filename = f"result_{idx}.png"
-        
-        colored_mask = colorize_mask(msk, COLOR_MAPPING)
 
-        # Ajout de la légende sur le masque colorisé
-        colored_mask_with_legend = add_legend(colored_mask, LABELS_MAPPING)
+def encode_params(image_format=RESULT_PYRAMID_FORMAT, quality=RESULT_PYRAMID_QUALITY):
+    """Paramètres cv2.imwrite / cv2.imencode de qualité pour le format des niveaux"""
+    if image_format == "webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, quality]
+    if image_format in ("jpg", "jpeg"):
+        return [cv2.IMWRITE_JPEG_QUALITY, quality]
+    return []
 
-        # Superposition du masque coloré sur l'image originale
-        overlay = cv2.addWeighted(img, 0.7, colored_mask, 0.3, 0)
-        overlay_with_legend = add_legend(overlay, LABELS_MAPPING)
 
-        # Concatenation des images sur une seule ligne
-        concatenated = np.hstack([img, colored_mask_with_legend, overlay_with_legend])
+def write_result_renders(write_image, output_dir, idx, img, msk, tiled=False, pyramid=RESULT_PYRAMID_WIDTHS,
+                         full_resolution=RESULT_FULL_RESOLUTION):
+    """
+    Écrit les visuels d'une paire : le PNG pleine résolution (si full_resolution) et chaque niveau
+    de la pyramide plus étroit que lui. Sans PNG pleine résolution, le plus petit niveau assez
+    large reçoit le visuel non réduit, pour qu'il reste disponible.
+    """
+    full_width = 3 * msk.shape[1]
+    if full_resolution:
+        write_image(os.path.join(output_dir, f"result_{idx}.png"),
+                    render_result_tiled(img, msk) if tiled else render_result(img, msk))
+    params = encode_params()
+    for width in sorted(pyramid):
+        if width >= full_width:
+            if not full_resolution:
+                write_image(result_level_path(output_dir, idx, width), render_result_level(img, msk, full_width), params)
+            break
+        write_image(result_level_path(output_dir, idx, width), render_result_level(img, msk, width), params)
+
+
+def result_levels(output_dir, idx):
+    """{largeur: chemin} des niveaux de la pyramide disponibles pour une image"""
+    levels = {}
+    if not os.path.isdir(output_dir):
+        return levels
+    with os.scandir(output_dir) as entries:
+        for entry in entries:
+            if entry.is_dir() and entry.name.startswith('w') and entry.name[1:].isdigit():
+                for extension in ("webp", "jpg", "jpeg", "png"):
+                    path = os.path.join(entry.path, f"result_{idx}.{extension}")
+                    if os.path.exists(path):
+                        levels[int(entry.name[1:])] = path
+                        break
+    return levels
+
+
+def select_result_image(output_dir, idx, min_width, full_path=None):
+    """
+    Plus petit visuel d'une image d'au moins `min_width` de large : niveau de la pyramide, sinon
+    PNG pleine résolution (full_path, par défaut <sortie>/result_N.png), sinon le plus grand niveau.
+    Un niveau plus petit que sa largeur nominale contient le visuel entier (image plus étroite).
+
+    Returns:
+        str: Chemin du visuel, ou None si aucun n'existe.
+    """
+    levels = result_levels(output_dir, idx)
+    fitting = [width for width in levels if width >= min_width]
+    if fitting:
+        return levels[min(fitting)]
+    full_path = full_path or os.path.join(output_dir, f"result_{idx}.png")
+    if os.path.exists(full_path):
+        return full_path
+    return levels[max(levels)] if levels else None
+
+
+@memory_stage("save_results")
+def save_results(image_dir, mask_dir, output_dir, tiled=False, writer=None, pyramid=RESULT_PYRAMID_WIDTHS,
+                 full_resolution=RESULT_FULL_RESOLUTION):
+    """
+    Sauvegarde les visuels image | masque colorisé | superposition de chaque paire : PNG pleine
+    résolution (optionnel, full_resolution) et pyramide de vignettes WebP / JPEG (voir write_result_renders).
+    Avec tiled=True, le rendu se fait par bandes (voir render_result_tiled) pour les très grandes images.
+    Avec un OutputWriter (src/writer.py), l'encodage et l'écriture se font en arrière-plan
+    pendant le rendu des paires suivantes.
+    """
+    write_image = writer.write_image if writer is not None else cv2.imwrite
+    paires = iter_local_dataset(image_dir, mask_dir)
+    for directory in [output_dir] + [os.path.join(output_dir, f"w{width}") for width in pyramid]:
+        os.makedirs(directory, exist_ok=True)
 
-        # Sauvegarde de l'image résultante
-        output_path = os.path.join(output_dir, result_filename)
-        cv2.imwrite(output_path, concatenated)
\ No newline at end of file
+    for img, msk, idx in paires:
+        write_result_renders(write_image, output_dir, idx, img, msk, tiled, pyramid, full_resolution)
\ No newline at end of file
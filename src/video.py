@@ -0,0 +1,216 @@
+import json
+import os
+import numpy as np
+import cv2
+from tqdm import tqdm
+from .api import call_hf_segmentation_api
+from .utils import get_logger, create_masks, save_results
+from .presence_index import presence_bits
+from .writer import OutputWriter
+from .config import (CLASS_MAPPING, DEFAULT_MODEL, VIDEO_DIR, VIDEO_OUTPUTS_DIR, VIDEO_EXTENSIONS, VIDEO_SAMPLE_FPS,
+                     VIDEO_SEQUENCE_FPS, VIDEO_STATIC_THRESHOLD, VIDEO_MAX_REUSE, VIDEO_DIFF_WIDTH)
+
+logger = get_logger(__name__, __name__ + ".log")
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def list_video_sources(paths=None):
+    """Vidéos et séquences d'images (répertoires de frames) à traiter, par défaut celles de VIDEO_DIR"""
+    if not paths:
+        if not os.path.isdir(VIDEO_DIR):
+            return []
+        paths = [os.path.join(VIDEO_DIR, f) for f in sorted(os.listdir(VIDEO_DIR))]
+    return [p for p in paths if os.path.isdir(p) or p.lower().endswith(VIDEO_EXTENSIONS)]
+
+
+def sample_frames(source, sample_fps=VIDEO_SAMPLE_FPS):
+    """
+    Échantillonne les images d'une vidéo (ou d'un répertoire de frames) à sample_fps.
+    Les images non retenues d'une vidéo sont sautées avec grab(), sans conversion.
+
+    Yields:
+        tuple: (index de l'image dans la source, instant en secondes, image BGR)
+    """
+    if os.path.isdir(source):
+        frames = sorted(f for f in os.listdir(source) if f.lower().endswith(IMAGE_EXTENSIONS))
+        step = max(1, round(VIDEO_SEQUENCE_FPS / sample_fps))
+        for index in range(0, len(frames), step):
+            frame = cv2.imread(os.path.join(source, frames[index]))
+            if frame is not None:
+                yield index, index / VIDEO_SEQUENCE_FPS, frame
+        return
+
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise FileNotFoundError(f"Impossible d'ouvrir la vidéo '{source}'")
+    fps = capture.get(cv2.CAP_PROP_FPS) or VIDEO_SEQUENCE_FPS
+    step = max(1, round(fps / sample_fps))
+    index = 0
+    try:
+        while True:
+            if index % step == 0:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yield index, index / fps, frame
+            elif not capture.grab():
+                break
+            index += 1
+    finally:
+        capture.release()
+
+
+def frame_thumbnail(frame, width=VIDEO_DIFF_WIDTH):
+    """Vignette en niveaux de gris (float32) servant à la comparaison des images"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    height = max(1, round(gray.shape[0] * width / gray.shape[1]))
+    return cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def frame_difference(thumb_a, thumb_b):
+    """Écart absolu moyen entre deux vignettes (0-255)"""
+    return float(np.mean(np.abs(thumb_a - thumb_b)))
+
+
+def propagate_mask(mask, key_thumb, thumb):
+    """
+    Propage le masque d'une image clé sur une image quasi statique : le décalage global
+    (corrélation de phase entre vignettes) est appliqué au masque, ramené à sa résolution.
+
+    Returns:
+        tuple: (masque propagé, décalage (dx, dy) en pixels de l'image)
+    """
+    (dx, dy), _ = cv2.phaseCorrelate(key_thumb, thumb)
+    scale = mask.shape[1] / key_thumb.shape[1]
+    dx, dy = dx * scale, dy * scale
+    if abs(dx) < 0.5 and abs(dy) < 0.5:
+        return mask, (0.0, 0.0)
+    transform = np.float32([[1, 0, dx], [0, 1, dy]])
+    shifted = cv2.warpAffine(mask, transform, (mask.shape[1], mask.shape[0]), flags=cv2.INTER_NEAREST,
+                             borderMode=cv2.BORDER_REPLICATE)
+    return shifted, (float(dx), float(dy))
+
+
+def presence_timeline(frames, sample_fps):
+    """
+    Intervalles de présence de chaque classe à partir des classes détectées par image échantillonnée.
+
+    Returns:
+        dict: {classe: {'ratio': part des images où la classe est présente, 'intervals': [[début, fin], ...]}}
+    """
+    timeline = {}
+    half_step = 0.5 / sample_fps
+    for class_name in CLASS_MAPPING:
+        if class_name == 'Background':
+            continue
+        intervals = []
+        for frame in frames:
+            if class_name not in frame['classes']:
+                continue
+            start, end = frame['time'] - half_step, frame['time'] + half_step
+            if intervals and start <= intervals[-1][1] + 1e-6:
+                intervals[-1][1] = end
+            else:
+                intervals.append([max(0.0, start), end])
+        if intervals:
+            present = sum(class_name in frame['classes'] for frame in frames)
+            timeline[class_name] = {'ratio': present / len(frames), 'intervals': intervals}
+    return timeline
+
+
+def segment_video(source, output_root=VIDEO_OUTPUTS_DIR, sample_fps=VIDEO_SAMPLE_FPS,
+                  static_threshold=VIDEO_STATIC_THRESHOLD, max_reuse=VIDEO_MAX_REUSE, model=DEFAULT_MODEL):
+    """
+    Segmente une vidéo ou une séquence d'images.
+
+    Les images sont échantillonnées à sample_fps. Seules les images clés (changement de scène :
+    écart avec la dernière image clé > static_threshold, ou plus de max_reuse images réutilisées)
+    sont envoyées à l'API ; pour les images quasi statiques, le masque de l'image clé est
+    propagé (décalage global). Les sorties suivent la disposition des images fixes
+    (<output_root>/<vidéo>/IMG/image_N.jpg, Mask/mask_N.png, Real_Results/result_N.png,
+    N = index de l'image dans la vidéo) avec une chronologie de présence des vêtements
+    dans timeline.json.
+
+    Returns:
+        dict: Chronologie de la vidéo (images échantillonnées et intervalles de présence).
+    """
+    name = os.path.splitext(os.path.basename(os.path.normpath(source)))[0]
+    video_dir = os.path.join(output_root, name)
+    img_dir, mask_dir = os.path.join(video_dir, "IMG"), os.path.join(video_dir, "Mask")
+    os.makedirs(img_dir, exist_ok=True)
+    os.makedirs(mask_dir, exist_ok=True)
+
+    frames = []
+    key_mask = key_thumb = None
+    reused = 0
+    counts = {'api': 0, 'propagated': 0, 'failed': 0}
+    with OutputWriter() as writer:
+        for index, time_s, frame in tqdm(sample_frames(source, sample_fps), desc=f"Vidéo {name}"):
+            height, width = frame.shape[:2]
+            thumb = frame_thumbnail(frame)
+            difference = frame_difference(key_thumb, thumb) if key_thumb is not None and key_thumb.shape == thumb.shape else None
+            mask, source_kind, shift = None, 'api', None
+
+            if difference is not None and difference <= static_threshold and reused < max_reuse:
+                mask, shift = propagate_mask(key_mask, key_thumb, thumb)
+                source_kind = 'propagated'
+                reused += 1
+            else:
+                ok, encoded = cv2.imencode(".jpg", frame)
+                output = call_hf_segmentation_api(encoded.tobytes(), model=model) if ok else None
+                if isinstance(output, list) and len(output) > 0:
+                    mask = create_masks(output, width, height)
+                    key_mask, key_thumb, reused = mask, thumb, 0
+                elif key_mask is not None and key_mask.shape == (height, width):
+                    # Échec de l'appel : on garde le dernier masque plutôt que de perdre l'image
+                    mask, shift = propagate_mask(key_mask, key_thumb, thumb)
+                    source_kind = 'propagated'
+                else:
+                    counts['failed'] += 1
+                    logger.info(f"{name} : échec de la segmentation de l'image {index}")
+                    continue
+            counts[source_kind] += 1
+
+            writer.write_image(os.path.join(img_dir, f"image_{index}.jpg"), frame)
+            writer.write_mask(os.path.join(mask_dir, f"mask_{index}.png"), mask)
+            bits = presence_bits(mask)
+            frames.append({
+                'frame': index,
+                'time': time_s,
+                'source': source_kind,
+                'difference': difference,
+                'shift': shift,
+                'classes': [class_name for class_name, class_id in CLASS_MAPPING.items()
+                            if class_id > 0 and bits >> class_id & 1]
+            })
+        writer.flush()
+        save_results(img_dir, mask_dir, os.path.join(video_dir, "Real_Results"), writer=writer)
+
+    result = {
+        'source': source,
+        'sample_fps': sample_fps,
+        'static_threshold': static_threshold,
+        'frames_sampled': len(frames) + counts['failed'],
+        'api_calls': counts['api'],
+        'masks_propagated': counts['propagated'],
+        'failed': counts['failed'],
+        'timeline': presence_timeline(frames, sample_fps) if frames else {},
+        'frames': frames
+    }
+    with open(os.path.join(video_dir, "timeline.json"), 'w') as f:
+        json.dump(result, f, indent=4)
+    message = (f"{name} : {result['frames_sampled']} image(s) échantillonnée(s), {counts['api']} appel(s) API, "
+               f"{counts['propagated']} masque(s) propagé(s)")
+    print(message)
+    logger.info(message)
+    return result
+
+
+def segment_videos(sources=None, **options):
+    """Segmente chaque vidéo ou séquence d'images (par défaut, le contenu de VIDEO_DIR)"""
+    sources = list_video_sources(sources)
+    if not sources:
+        print(f"Aucune vidéo trouvée dans '{VIDEO_DIR}'.")
+        return {}
+    return {source: segment_video(source, **options) for source in sources}
@@ -0,0 +1,129 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import threading
+import uuid
+import cv2
+from .utils import get_logger, encode_label_map_rle, rle_path_for, copy_original_image
+from .config import WRITER_WORKERS, WRITER_MAX_PENDING_MB
+
+logger = get_logger(__name__, __name__ + ".log")
+
+
+def atomic_write(path, data):
+    """Écrit un fichier via un fichier temporaire du même répertoire puis un renommage atomique"""
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class OutputWriter:
+    """
+    Écriture asynchrone des sorties : l'encodage (PNG, RLE) et l'écriture sur disque sont faits
+    par un petit pool de threads, en recouvrement avec les appels API et les calculs du thread
+    principal. Chaque fichier est écrit de façon atomique (fichier temporaire + renommage).
+
+    Contre-pression : quand le volume des sorties en attente dépasse max_pending_mb, les appels
+    d'écriture bloquent jusqu'à ce que des écritures se terminent.
+    """
+
+    def __init__(self, workers=WRITER_WORKERS, max_pending_mb=WRITER_MAX_PENDING_MB):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="writer")
+        self.max_pending_bytes = max_pending_mb * 1024 * 1024
+        self.pending_bytes = 0
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self.flush_callbacks = []
+        self.errors = []
+        self.written = 0
+
+    def submit(self, path, nbytes, job):
+        """Planifie job() (qui écrit `path`), en comptant `nbytes` dans le budget en attente"""
+        with self.condition:
+            # Une sortie plus grosse que le budget passe seule plutôt que de bloquer indéfiniment
+            while self.pending_bytes > 0 and self.pending_bytes + nbytes > self.max_pending_bytes:
+                self.condition.wait()
+            self.pending_bytes += nbytes
+            self.in_flight += 1
+        return self.executor.submit(self._run, path, nbytes, job)
+
+    def _run(self, path, nbytes, job):
+        try:
+            job()
+            with self.condition:
+                self.written += 1
+        except Exception as e:
+            logger.info(f"Erreur d'écriture de '{path}' : {e}")
+            with self.condition:
+                self.errors.append((path, f"{type(e).__name__}: {e}"))
+        finally:
+            with self.condition:
+                self.pending_bytes -= nbytes
+                self.in_flight -= 1
+                self.condition.notify_all()
+
+    def write_image(self, path, image, params=()):
+        """Encode (selon l'extension de `path`, avec les paramètres cv2 `params`) et écrit une image"""
+        def job():
+            ok, encoded = cv2.imencode(os.path.splitext(path)[1], image, list(params))
+            if not ok:
+                raise ValueError("échec de l'encodage")
+            atomic_write(path, encoded.tobytes())
+        return self.submit(path, image.nbytes, job)
+
+    def write_mask(self, mask_path, label_map, storage_format="png"):
+        """Équivalent asynchrone de save_mask (PNG, RLE ou les deux)"""
+        if storage_format not in ("png", "rle", "both"):
+            raise ValueError(f"Format de stockage de masque inconnu : {storage_format}")
+        if storage_format in ("png", "both"):
+            self.write_image(mask_path, label_map)
+        if storage_format in ("rle", "both"):
+            rle_path = rle_path_for(mask_path)
+            self.submit(rle_path, label_map.nbytes, lambda: atomic_write(
+                rle_path, json.dumps(encode_label_map_rle(label_map), separators=(',', ':')).encode()))
+
+    def copy_image(self, src_path, dst_path, data=None):
+        """Équivalent asynchrone de copy_original_image"""
+        return self.submit(dst_path, len(data) if data is not None else 0,
+                           lambda: copy_original_image(src_path, dst_path, data))
+
+    def on_flush(self, callback):
+        """Appelle `callback` dans le thread appelant au prochain flush, une fois les écritures terminées"""
+        self.flush_callbacks.append(callback)
+
+    def flush(self):
+        """
+        Attend la fin de toutes les écritures en cours puis exécute les rappels de flush.
+
+        Returns:
+            list: [(chemin, erreur)] des écritures en échec depuis le dernier flush.
+        """
+        with self.condition:
+            while self.in_flight > 0:
+                self.condition.wait()
+            errors, self.errors = self.errors, []
+        callbacks, self.flush_callbacks = self.flush_callbacks, []
+        for callback in callbacks:
+            callback()
+        for path, error in errors:
+            print(f"Erreur d'écriture de {path} : {error}")
+        return errors
+
+    def close(self):
+        errors = self.flush()
+        self.executor.shutdown(wait=True)
+        logger.info(f"Écriture asynchrone terminée : {self.written} fichier(s), {len(errors)} erreur(s)")
+        return errors
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()